@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+⚙️ ОБЩИЙ АСИНХРОННЫЙ РАНТАЙМ АГЕНТОВ
+✅ Один долгоживущий event loop на процесс (без asyncio.run на каждое сообщение)
+✅ До N сообщений в работе одновременно (семафор, N задаётся в AGENT_CONCURRENCY)
+✅ Агент реализует только process(payload) -> output
+✅ Режим перегрузки доступен агенту через self.overload (см. overload.py)
+✅ Кэш вердиктов (verdict_cache.py), общий лимит провайдеров (rate_limiter.py) и счётчики (metrics.py)
+   подключаются к Redis агента при старте
+✅ Отмена спекулятивных вызовов доступна агенту через self.speculation (см. speculation.py)
+✅ Правила чатов (rules_cache.py) - в памяти процесса, агенты с per_chat_rules слушают канал их изменений
+"""
+
+import asyncio
+from typing import Dict, Any, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+
+from config import (
+    get_redis_config,
+    get_agent_concurrency,
+    QUEUE_TRANSPORT,
+    SPECULATIVE_ENABLED,
+    LOOP_BACKOFF_BASE,
+    LOOP_BACKOFF_MAX,
+)
+from circuit_breaker import backoff_delay
+from queue_transport import create_transport, QueueItem
+from llm_client import llm_client
+from overload import OverloadMode, OverloadController
+from verdict_cache import verdict_cache
+from rate_limiter import rate_limiter
+from metrics import metrics
+from speculation import Speculation
+from rules_cache import chat_rules
+
+
+class AsyncAgentWorker:
+    """
+    Базовый воркер агента.
+
+    Наследник задаёт agent_id, input_queues, output_queues и реализует process().
+    Если маршрут зависит от результата, переопределяется route().
+    """
+
+    agent_id: int = 0
+    input_queues: List[str] = []
+    output_queues: List[str] = []
+    # Провайдеры LLM, соединения с которыми прогреваются при старте
+    llm_providers: List[str] = []
+    # Запускать ли в этом агенте контроллер перегрузки (достаточно одного этапа - Агента 2)
+    overload_controller: bool = False
+    # Можно ли прервать вызов агента, если Агент 5 уже решил (спекулятивный веер, агенты 3 и 4)
+    cancellable: bool = False
+    # Берёт ли агент правила чата (rules_cache.chat_rules) - тогда слушает уведомления об их изменении
+    per_chat_rules: bool = False
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.concurrency = get_agent_concurrency(self.agent_id)
+        self.redis_client = None
+        # Очереди читаются байтами (конверты msgpack), поэтому у транспорта свой клиент
+        self.queue_client = None
+        self.transport = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+        self.overload: Optional[OverloadMode] = None
+        self._overload_task: Optional[asyncio.Task] = None
+        self.speculation: Optional[Speculation] = None
+
+    # ------------------------------------------------------------------------
+    # То, что реализует агент
+    # ------------------------------------------------------------------------
+
+    async def process(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Обрабатывает одно сообщение. None - ничего не отправлять дальше"""
+        raise NotImplementedError
+
+    def route(self, payload: Dict[str, Any], output: Dict[str, Any]) -> List[str]:
+        """В какие очереди отправить результат"""
+        return self.output_queues
+
+    async def setup(self):
+        """Хук для инициализации ресурсов агента внутри event loop"""
+
+    async def cleanup(self):
+        """Хук для освобождения ресурсов агента"""
+
+    # ------------------------------------------------------------------------
+    # Рантайм
+    # ------------------------------------------------------------------------
+
+    async def start(self):
+        # В режиме memory (local_pipeline.py) все агенты в одном процессе и Redis не нужен
+        if QUEUE_TRANSPORT != "memory":
+            self.redis_client = aioredis.Redis(**get_redis_config())
+            self.queue_client = aioredis.Redis(**get_redis_config(binary=True))
+            await self.redis_client.ping()
+            self.logger.info("✅ Подключение к Redis успешно")
+
+        self.transport = create_transport(self.queue_client, self.logger, self.agent_id)
+        verdict_cache.bind(self.redis_client)
+        rate_limiter.bind(self.redis_client)
+        metrics.bind(self.redis_client)
+        chat_rules.bind(self.redis_client)
+        if self.per_chat_rules:
+            await chat_rules.listen()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.overload = OverloadMode(self.redis_client)
+        if self.overload_controller:
+            controller = OverloadController(self.transport, self.redis_client, self.logger)
+            self._overload_task = asyncio.create_task(controller.run())
+        self.speculation = Speculation(self.redis_client, self.logger)
+        if self.cancellable and SPECULATIVE_ENABLED:
+            await self.speculation.listen()
+        if self.llm_providers:
+            await llm_client.warmup(self.llm_providers)
+        await self.setup()
+
+    async def handle(self, item: QueueItem):
+        queue_name, payload, _ = item
+        async with self._semaphore:
+            try:
+                output = await self.process(payload)
+
+                outputs: List[Tuple[str, Dict[str, Any]]] = []
+                if output is not None:
+                    outputs = [(queue, output) for queue in self.route(payload, output)]
+
+                # Выходы и подтверждение входа - одной транзакцией
+                await self.transport.send(outputs, processed=[item])
+                await metrics.maybe_flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"❌ Ошибка обработки сообщения из {queue_name}: {e}", exc_info=True)
+                # Повтор позже или, после QUEUE_MAX_DELIVERIES попыток, очередь {очередь}:dead
+                try:
+                    await self.transport.fail(item, str(e))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as fail_error:
+                    self.logger.error(f"❌ Не удалось вернуть сообщение из {queue_name} в очередь: {fail_error}")
+
+    async def run_forever(self):
+        await self.start()
+        self.logger.info(
+            f"⚙️ Рантайм: транспорт={self.transport.mode}, "
+            f"параллельно={self.concurrency}, очереди={self.input_queues}"
+        )
+
+        errors = 0
+        try:
+            while True:
+                try:
+                    free = self.concurrency - len(self._tasks)
+                    if free <= 0:
+                        await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+                        continue
+
+                    items = await self.transport.receive(self.input_queues, count=free)
+                    errors = 0
+                    if not items:
+                        continue
+
+                    self.logger.info(f"📨 Получено сообщений: {len(items)} (в работе: {len(self._tasks)})")
+
+                    for item in items:
+                        task = asyncio.create_task(self.handle(item))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    errors += 1
+                    self.logger.error(f"❌ Ошибка в цикле: {e}")
+                    await asyncio.sleep(backoff_delay(errors, LOOP_BACKOFF_BASE, LOOP_BACKOFF_MAX))
+        finally:
+            if self._tasks:
+                self.logger.info(f"⏳ Дожидаюсь сообщений в работе: {len(self._tasks)}")
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            if self._overload_task:
+                self._overload_task.cancel()
+                await asyncio.gather(self._overload_task, return_exceptions=True)
+            await self.cleanup()
+            if self.speculation:
+                await self.speculation.stop()
+            await chat_rules.stop()
+            await verdict_cache.flush_stats()
+            await metrics.flush()
+            await llm_client.aclose()
+            if self.redis_client is not None:
+                await self.redis_client.aclose()
+                await self.queue_client.aclose()
+
+    def run(self):
+        """Синхронная точка входа: один event loop на всё время работы агента"""
+        asyncio.run(self.run_forever())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🔌 АВТОМАТЫ ЗАЩИТЫ И ПОВТОРЫ
+✅ CircuitBreaker: закрыт -> открыт (после LLM_BREAKER_FAILURES сбоев подряд) -> полуоткрыт (один пробный вызов)
+✅ Пока автомат открыт, вызов не ждёт таймаута провайдера - агент сразу берёт свой fallback
+✅ 429 с Retry-After: короткий - ждём и повторяем, длинный - автомат открывается на этот срок
+✅ RetryBudget: повторы не больше LLM_RETRY_BUDGET на вызов, чтобы сбой провайдера не умножал нагрузку
+✅ backoff_delay: экспоненциальная пауза со случайным разбросом (и для циклов агентов)
+"""
+
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from config import (
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_OPEN_SECONDS,
+    LLM_BREAKER_MAX_OPEN_SECONDS,
+    LLM_RETRY_BUDGET,
+    LLM_RETRY_BURST,
+    setup_logging,
+)
+
+logger = setup_logging("CIRCUIT BREAKER")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_TITLES = {
+    CLOSED: "✅ закрыт",
+    OPEN: "⛔ открыт",
+    HALF_OPEN: "🟡 полуоткрыт",
+}
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Пауза перед попыткой attempt (1, 2, ...): случайная в [0, base * 2^(attempt-1)], не больше cap"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After: секунды или HTTP-дата; None - заголовка нет или он не разобран"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Состояние одного провайдера (или модели) в процессе агента"""
+
+    def __init__(self, name: str, failures: int = LLM_BREAKER_FAILURES, open_seconds: float = LLM_BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.failure_threshold = failures
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_until = 0.0
+        self.probing = False
+        self.stats = {"trips": 0, "short_circuited": 0}
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"🔌 {self.name}: {STATE_TITLES[self.state]} -> {STATE_TITLES[state]}")
+            self.state = state
+
+    def is_open(self) -> bool:
+        """Открыт и срок ещё не вышел (без побочных эффектов)"""
+        return (self.state == OPEN and time.monotonic() < self.opened_until) or (self.state == HALF_OPEN and self.probing)
+
+    def allow(self) -> bool:
+        """Можно ли вызывать провайдера. В полуоткрытом состоянии пропускает один пробный вызов"""
+        if self.state == OPEN and time.monotonic() >= self.opened_until:
+            self._set_state(HALF_OPEN)
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        self.stats["short_circuited"] += 1
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.probing = False
+        self._set_state(CLOSED)
+
+    def release(self):
+        """Вызов прерван (отмена) - пробный слот свободен, вывода о провайдере нет"""
+        self.probing = False
+
+    def failure(self, open_for: Optional[float] = None):
+        """Сбой провайдера. open_for (Retry-After) открывает автомат сразу и на указанный срок"""
+        self.failures += 1
+        self.probing = False
+        if open_for is None and self.state == CLOSED and self.failures < self.failure_threshold:
+            return
+        seconds = min(LLM_BREAKER_MAX_OPEN_SECONDS, max(open_for or 0, self.open_seconds))
+        self.opened_until = time.monotonic() + seconds
+        self.stats["trips"] += 1
+        self._set_state(OPEN)
+
+
+class RetryBudget:
+    """Общий на процесс: каждый вызов добавляет ratio попытки, повтор тратит одну (запас - не больше burst)"""
+
+    def __init__(self, ratio: float = LLM_RETRY_BUDGET, burst: float = LLM_RETRY_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.stats = {"retries": 0, "denied": 0}
+
+    def deposit(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            self.stats["denied"] += 1
+            return False
+        self.tokens -= 1
+        self.stats["retries"] += 1
+        return True
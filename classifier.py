@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🧮 ЛОКАЛЬНЫЙ КЛАССИФИКАТОР
+✅ Признаки: слова, пары слов и символьные 3-5-граммы внутри слов, хэшированные в 2^CLASSIFIER_HASH_BITS
+✅ Логистическая регрессия на NumPy (AdaGrad по мини-пакетам), учится офлайн по журналу решений Агента 5
+✅ Калибровка Платта на отложенной выборке, порог "чисто" - по CLASSIFIER_CLEAN_PRECISION
+✅ Версии моделей: {CLASSIFIER_DIR}/{версия}.npz, текущая - в файле CURRENT;
+   процессы подхватывают новую версию без перезапуска (раз в CLASSIFIER_RELOAD_INTERVAL)
+✅ Скоринг сообщения - доли миллисекунды, без сети
+
+Запуск:
+    python3 classifier.py train                       # обучить по журналу verdicts:log в Redis
+    python3 classifier.py train --file verdicts.jsonl # или по выгрузке JSONL ({"text", "label"})
+    python3 classifier.py score "текст"               # вероятность нарушения текущей моделью
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from config import (
+    CLASSIFIER_DIR,
+    CLASSIFIER_LOG_MAXLEN,
+    CLASSIFIER_HASH_BITS,
+    CLASSIFIER_CLEAN_PRECISION,
+    CLASSIFIER_MIN_EXAMPLES,
+    CLASSIFIER_RELOAD_INTERVAL,
+    setup_logging,
+)
+from lexicon import normalize, LINK_RE
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = setup_logging("CLASSIFIER")
+
+LOG_KEY = "verdicts:log"
+CURRENT_FILE = "CURRENT"
+
+_WORD_RE = re.compile(r"\w+")
+
+# ============================================================================
+# ЖУРНАЛ РЕШЕНИЙ (ОБУЧАЮЩИЕ ПРИМЕРЫ)
+# ============================================================================
+
+
+def verdict_record(results: Dict[int, Dict[str, Any]], output: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Пример для обучения из решения Агента 5: текст, итоговая метка и мнения агентов 2 и 4"""
+    message = next((result.get("message") for result in results.values() if result.get("message")), "")
+    if not message or output.get("decision_source") == "classifier":
+        return None
+    return {
+        "text": message,
+        "label": int(output.get("action", "none") != "none"),
+        "action": output.get("action", "none"),
+        "source": output.get("decision_source", "unknown"),
+        "agent2": results.get(2, {}).get("action"),
+        "agent4": results.get(4, {}).get("action"),
+        "chat_id": output.get("chat_id"),
+        "ts": time.time(),
+    }
+
+
+async def log_verdict(redis_client, record: Optional[Dict[str, Any]]):
+    """Redis-поток verdicts:log; без Redis (режим memory) - файл verdicts.jsonl рядом с моделями"""
+    if record is None:
+        return
+    line = json.dumps(record, ensure_ascii=False)
+    if redis_client is None:
+        os.makedirs(CLASSIFIER_DIR, exist_ok=True)
+        with open(os.path.join(CLASSIFIER_DIR, "verdicts.jsonl"), "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        return
+    await redis_client.xadd(LOG_KEY, {"data": line}, maxlen=CLASSIFIER_LOG_MAXLEN, approximate=True)
+
+
+def read_log_redis(redis_client, chunk: int = 5000) -> List[Dict[str, Any]]:
+    """Весь журнал из Redis (синхронный клиент со строками, для офлайн-обучения)"""
+    records = []
+    start = "-"
+    while True:
+        entries = redis_client.xrange(LOG_KEY, min=start, max="+", count=chunk)
+        for entry_id, fields in entries:
+            try:
+                records.append(json.loads(fields["data"]))
+            except (KeyError, ValueError):
+                continue
+        if len(entries) < chunk:
+            return records
+        start = "(" + entries[-1][0]
+
+
+def read_log_file(path: str) -> List[Dict[str, Any]]:
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+# ============================================================================
+# ПРИЗНАКИ
+# ============================================================================
+
+
+def text_features(text: str) -> List[str]:
+    """Нормализация та же, что у словаря: обход латиницей и растянутыми буквами не меняет признаки"""
+    normalized = normalize(text)
+    words = _WORD_RE.findall(normalized)
+    features = [f"w:{word}" for word in words]
+    features += [f"b:{first} {second}" for first, second in zip(words, words[1:])]
+    for word in words:
+        padded = f" {word} "
+        for size in (3, 4, 5):
+            features += [f"c:{padded[i:i + size]}" for i in range(len(padded) - size + 1)]
+    if LINK_RE.search(normalized):
+        features.append("link")
+    return features
+
+
+def vectorize(text: str, bits: int = CLASSIFIER_HASH_BITS) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Хэширующий векторизатор: (индексы, значения), L2-нормировка.
+    Знак признака - от старшего бита crc32, поэтому коллизии в среднем гасят друг друга
+    """
+    mask = (1 << bits) - 1
+    counts: Dict[int, float] = {}
+    for feature in text_features(text):
+        value = zlib.crc32(feature.encode("utf-8"))
+        index = value & mask
+        counts[index] = counts.get(index, 0.0) + (1.0 if value >> 31 else -1.0)
+
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+    norm = math.sqrt(float(values @ values)) if len(values) else 0.0
+    if norm:
+        values /= norm
+    return indices, values
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -35, 35)))
+
+# ============================================================================
+# МОДЕЛЬ
+# ============================================================================
+
+
+class ClassifierModel:
+    """Веса логистической регрессии + калибровка Платта (a, b) + порог "чисто" и метаданные версии"""
+
+    def __init__(self, weights, bias: float, calibration: Tuple[float, float], threshold: float, meta: Dict[str, Any]):
+        self.weights = weights
+        self.bias = bias
+        self.calibration = calibration
+        self.threshold = threshold
+        self.meta = meta
+        self.bits = int(meta.get("bits", CLASSIFIER_HASH_BITS))
+        self.version = meta.get("version", "unknown")
+
+    def probability(self, text: str) -> float:
+        """Калиброванная вероятность нарушения"""
+        indices, values = vectorize(text, self.bits)
+        logit = float(self.weights[indices] @ values) + self.bias
+        a, b = self.calibration
+        return float(_sigmoid(a * logit + b))
+
+    def save(self, model_dir: str = CLASSIFIER_DIR) -> str:
+        """Пишет {версия}.npz и переключает CURRENT (оба - атомарной заменой файла)"""
+        os.makedirs(model_dir, exist_ok=True)
+        path = os.path.join(model_dir, f"{self.version}.npz")
+        temp = path + ".tmp"
+        with open(temp, "wb") as f:
+            np.savez_compressed(
+                f,
+                weights=self.weights.astype(np.float32),
+                params=np.array([self.bias, self.calibration[0], self.calibration[1], self.threshold]),
+                meta=np.array(json.dumps(self.meta, ensure_ascii=False)),
+            )
+        os.replace(temp, path)
+
+        current = os.path.join(model_dir, CURRENT_FILE)
+        with open(current + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.version)
+        os.replace(current + ".tmp", current)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "ClassifierModel":
+        with np.load(path, allow_pickle=False) as data:
+            bias, a, b, threshold = (float(value) for value in data["params"])
+            meta = json.loads(str(data["meta"]))
+            return cls(data["weights"].astype(np.float64), bias, (a, b), threshold, meta)
+
+
+class TextClassifier:
+    """
+    Текущая модель процесса. Версия перечитывается из CURRENT не чаще CLASSIFIER_RELOAD_INTERVAL,
+    поэтому после train все агенты и бот переходят на новую модель сами
+    """
+
+    def __init__(self, model_dir: str = CLASSIFIER_DIR):
+        self.model_dir = model_dir
+        self.model: Optional[ClassifierModel] = None
+        self._checked = 0.0
+
+    def reload(self) -> bool:
+        """True - загружена новая версия"""
+        try:
+            with open(os.path.join(self.model_dir, CURRENT_FILE), encoding="utf-8") as f:
+                version = f.read().strip()
+        except OSError:
+            return False
+        if not version or (self.model is not None and self.model.version == version):
+            return False
+
+        try:
+            model = ClassifierModel.load(os.path.join(self.model_dir, f"{version}.npz"))
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить модель {version}: {e}")
+            return False
+        self.model = model
+        logger.info(f"🧮 Загружена модель {version}: порог чистоты {model.threshold:.3f}, {model.meta.get('metrics', {})}")
+        return True
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked >= CLASSIFIER_RELOAD_INTERVAL:
+            self._checked = now
+            self.reload()
+
+    def probability(self, text: str) -> Optional[float]:
+        """Вероятность нарушения; None - модели нет (или нет NumPy)"""
+        if not NUMPY_AVAILABLE:
+            return None
+        self.maybe_reload()
+        if self.model is None:
+            return None
+        return self.model.probability(text)
+
+    def is_clean(self, probability: Optional[float]) -> bool:
+        return probability is not None and self.model is not None and probability <= self.model.threshold
+
+
+text_classifier = TextClassifier()
+
+# ============================================================================
+# ОБУЧЕНИЕ
+# ============================================================================
+
+
+def build_matrix(texts: List[str], bits: int):
+    """CSR без scipy: (indptr, indices, values)"""
+    indptr = [0]
+    all_indices, all_values = [], []
+    for text in texts:
+        indices, values = vectorize(text, bits)
+        all_indices.append(indices)
+        all_values.append(values)
+        indptr.append(indptr[-1] + len(indices))
+    return (
+        np.array(indptr, dtype=np.int64),
+        np.concatenate(all_indices) if all_indices else np.zeros(0, dtype=np.int64),
+        np.concatenate(all_values) if all_values else np.zeros(0),
+    )
+
+
+def _take_rows(matrix, rows):
+    """Строки CSR в заданном порядке - без цикла по Python"""
+    indptr, indices, values = matrix
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    new_indptr = np.concatenate([[0], np.cumsum(lengths)])
+    positions = np.repeat(starts - new_indptr[:-1], lengths) + np.arange(new_indptr[-1])
+    return new_indptr, indices[positions], values[positions]
+
+
+def _logits(matrix, weights, bias):
+    indptr, indices, values = matrix
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return np.bincount(rows, weights=weights[indices] * values, minlength=len(indptr) - 1) + bias
+
+
+def fit_logistic(matrix, labels, bits: int, epochs: int = 20, batch_size: int = 256,
+                 learning_rate: float = 0.5, l2: float = 1e-6, seed: int = 42):
+    """Логистическая регрессия: AdaGrad по мини-пакетам, L2 только на задетых весах (ленивая)"""
+    rng = np.random.default_rng(seed)
+    weights = np.zeros(1 << bits)
+    squared = np.zeros(1 << bits)
+    bias, bias_squared = 0.0, 0.0
+    count = len(labels)
+
+    for epoch in range(epochs):
+        order = rng.permutation(count)
+        indptr, indices, values = _take_rows(matrix, order)
+        shuffled = labels[order]
+
+        for start in range(0, count, batch_size):
+            stop = min(start + batch_size, count)
+            begin, end = indptr[start], indptr[stop]
+            batch_indices = indices[begin:end]
+            batch_values = values[begin:end]
+            rows = np.repeat(np.arange(stop - start), np.diff(indptr[start:stop + 1]))
+
+            logits = np.bincount(rows, weights=weights[batch_indices] * batch_values, minlength=stop - start) + bias
+            errors = _sigmoid(logits) - shuffled[start:stop]
+
+            touched, inverse = np.unique(batch_indices, return_inverse=True)
+            gradient = np.bincount(inverse, weights=errors[rows] * batch_values, minlength=len(touched))
+            gradient = gradient / (stop - start) + l2 * weights[touched]
+            squared[touched] += gradient ** 2
+            weights[touched] -= learning_rate * gradient / (np.sqrt(squared[touched]) + 1e-8)
+
+            bias_gradient = float(errors.mean())
+            bias_squared += bias_gradient ** 2
+            bias -= learning_rate * bias_gradient / (math.sqrt(bias_squared) + 1e-8)
+
+    return weights, bias
+
+
+def fit_platt(logits, labels, iterations: int = 50) -> Tuple[float, float]:
+    """Калибровка Платта: p = sigmoid(a * logit + b), метод Ньютона по двум параметрам"""
+    a, b = 1.0, 0.0
+    for _ in range(iterations):
+        p = _sigmoid(a * logits + b)
+        errors = p - labels
+        weight = np.maximum(p * (1 - p), 1e-9)
+        gradient = np.array([errors @ logits, errors.sum()])
+        hessian = np.array([
+            [weight @ (logits * logits), weight @ logits],
+            [weight @ logits, weight.sum()],
+        ]) + np.eye(2) * 1e-6
+        step = np.linalg.solve(hessian, gradient)
+        a, b = a - step[0], b - step[1]
+        if np.abs(step).max() < 1e-6:
+            break
+    return float(a), float(b)
+
+
+def clean_threshold(probabilities, labels, precision: float = CLASSIFIER_CLEAN_PRECISION,
+                    min_count: int = 20) -> Tuple[float, float]:
+    """
+    Наибольший порог, ниже которого доля чистых сообщений не меньше precision.
+    Возвращает (порог, доля сообщений, которые пропускаются без LLM); 0 - модель ничего не пропускает
+    """
+    order = np.argsort(probabilities, kind="stable")
+    sorted_probabilities = probabilities[order]
+    violations = np.cumsum(labels[order])
+    counts = np.arange(1, len(order) + 1)
+    valid = np.nonzero((1 - violations / counts >= precision) & (counts >= min_count))[0]
+    if not len(valid):
+        return 0.0, 0.0
+    last = valid[-1]
+    # Одинаковые вероятности выше last пропускать нельзя: порог - строго до следующего значения
+    while last >= 0 and last + 1 < len(order) and sorted_probabilities[last + 1] == sorted_probabilities[last]:
+        last -= 1
+    if last < min_count - 1:
+        return 0.0, 0.0
+    return float(sorted_probabilities[last]), float((last + 1) / len(order))
+
+
+def train_model(records: List[Dict[str, Any]], bits: int = CLASSIFIER_HASH_BITS, holdout: float = 0.2,
+                epochs: int = 20, seed: int = 42) -> ClassifierModel:
+    """Обучение + калибровка и порог на отложенной выборке; одинаковые тексты - один пример (последняя метка)"""
+    examples: Dict[str, int] = {}
+    for record in records:
+        text = record.get("text")
+        if text and record.get("label") is not None:
+            examples[normalize(text)] = int(record["label"])
+    texts = list(examples)
+    if len(texts) < CLASSIFIER_MIN_EXAMPLES:
+        raise ValueError(f"мало примеров: {len(texts)} < {CLASSIFIER_MIN_EXAMPLES}")
+
+    labels = np.array([examples[text] for text in texts], dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(texts))
+    split = int(len(texts) * (1 - holdout))
+    train_rows, valid_rows = order[:split], order[split:]
+
+    matrix = build_matrix(texts, bits)
+    train_matrix = _take_rows(matrix, train_rows)
+    valid_matrix = _take_rows(matrix, valid_rows)
+
+    started = time.perf_counter()
+    weights, bias = fit_logistic(train_matrix, labels[train_rows], bits, epochs=epochs, seed=seed)
+
+    valid_logits = _logits(valid_matrix, weights, bias)
+    valid_labels = labels[valid_rows]
+    calibration = fit_platt(valid_logits, valid_labels)
+    probabilities = _sigmoid(calibration[0] * valid_logits + calibration[1])
+    threshold, coverage = clean_threshold(probabilities, valid_labels)
+
+    log_loss = float(-np.mean(
+        valid_labels * np.log(np.clip(probabilities, 1e-9, 1)) + (1 - valid_labels) * np.log(np.clip(1 - probabilities, 1e-9, 1))
+    ))
+    metrics = {
+        "examples": len(texts),
+        "violations": round(float(labels.mean()), 3),
+        "accuracy": round(float(np.mean((probabilities >= 0.5) == valid_labels)), 3),
+        "log_loss": round(log_loss, 4),
+        "auto_approve": round(coverage, 3),
+        "train_sec": round(time.perf_counter() - started, 1),
+    }
+    meta = {
+        "version": datetime.now().strftime("%Y%m%d-%H%M%S"),
+        "bits": bits,
+        "precision_target": CLASSIFIER_CLEAN_PRECISION,
+        "metrics": metrics,
+    }
+    return ClassifierModel(weights, bias, calibration, threshold, meta)
+
+# ============================================================================
+# ТОЧКА ВХОДА
+# ============================================================================
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный классификатор TeleGuard")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train_parser = commands.add_parser("train", help="обучить модель по журналу решений")
+    train_parser.add_argument("--file", help="JSONL с полями text и label вместо журнала в Redis")
+    train_parser.add_argument("--epochs", type=int, default=20)
+    score_parser = commands.add_parser("score", help="вероятность нарушения текущей моделью")
+    score_parser.add_argument("text")
+    args = parser.parse_args()
+
+    if not NUMPY_AVAILABLE:
+        logger.error("❌ Нужен NumPy: pip install numpy")
+        exit(1)
+
+    if args.command == "score":
+        probability = text_classifier.probability(args.text)
+        if probability is None:
+            logger.error(f"❌ Модели нет в {CLASSIFIER_DIR} - сначала python3 classifier.py train")
+            exit(1)
+        verdict = "чисто (без LLM)" if text_classifier.is_clean(probability) else "в LLM"
+        logger.info(f"🧮 v{text_classifier.model.version}: P(нарушение)={probability:.4f} → {verdict}")
+        return
+
+    if args.file:
+        records = read_log_file(args.file)
+    else:
+        import redis
+        from config import get_redis_config
+        records = read_log_redis(redis.Redis(**get_redis_config()))
+    logger.info(f"📚 Примеров в журнале: {len(records)}")
+
+    try:
+        model = train_model(records, epochs=args.epochs)
+    except ValueError as e:
+        logger.error(f"❌ Модель не обучена: {e}")
+        exit(1)
+
+    path = model.save()
+    logger.info(f"✅ Модель {model.version} сохранена: {path}")
+    logger.info(f"📊 Порог чистоты {model.threshold:.4f}, метрики: {model.meta['metrics']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -52,12 +52,13 @@ REDIS_PORT = 6379
 REDIS_DB = 0
 REDIS_PASSWORD = None
 
-def get_redis_config():
+def get_redis_config(binary: bool = False):
+    # binary=True - для очередей: конверты msgpack/zstd хранятся как байты
     return {
         "host": REDIS_HOST,
         "port": REDIS_PORT,
         "db": REDIS_DB,
-        "decode_responses": True,
+        "decode_responses": not binary,
         "password": REDIS_PASSWORD
     }
 
@@ -83,6 +84,245 @@ QUEUE_AGENT_5_OUTPUT = "queue:agent5:output"
 QUEUE_AGENT_6_INPUT = "queue:agent6:input"
 QUEUE_AGENT_6_OUTPUT = "queue:agent6:output"
 
+# ============================================================================
+# ТРАНСПОРТ ОЧЕРЕДЕЙ
+# ============================================================================
+
+# "list"   - списки Redis (BLPOP/RPUSH), одна копия каждого агента
+# "stream" - Redis Streams с consumer group на агента (XREADGROUP/XACK),
+#            можно запускать несколько копий агента, записи не теряются при pkill -9
+# "memory" - asyncio.Queue внутри одного процесса (local_pipeline.py), Redis не нужен
+QUEUE_TRANSPORT = os.getenv("QUEUE_TRANSPORT", "list")
+
+STREAM_MAXLEN = 100000          # Примерный лимит длины стрима (MAXLEN ~)
+STREAM_CLAIM_IDLE_MS = 60000    # Через сколько мс неподтверждённая запись считается зависшей
+STREAM_CLAIM_INTERVAL = 5       # Как часто (сек) проверять зависшие записи (XAUTOCLAIM)
+# Сколько раз агент берёт сообщение, обработка которого падает, прежде чем убрать его в {очередь}:dead
+QUEUE_MAX_DELIVERIES = int(os.getenv("QUEUE_MAX_DELIVERIES", "5"))
+
+# ============================================================================
+# КОНВЕРТЫ СООБЩЕНИЙ (CLAIM-CHECK)
+# ============================================================================
+
+# Текст и метаданные сообщения хранятся один раз в хэше msg:{chat_id}:{message_id},
+# в очередях едут только компактные конверты (msgpack, если установлен)
+CLAIM_CHECK_ENABLED = os.getenv("CLAIM_CHECK", "true").lower() == "true"
+CLAIM_CHECK_FIELDS = ("message", "username", "message_link", "caption", "rules")
+CLAIM_CHECK_TTL = 86400         # Сколько секунд хранится хэш сообщения
+CLAIM_CHECK_CACHE_SIZE = 10000  # Сколько сообщений агент держит в памяти (не ходит за ними в Redis)
+QUEUE_COMPRESS_MIN_BYTES = 1024 # С какого размера сжимать zstd (если установлен)
+
+# ============================================================================
+# ПРИОРИТЕТНЫЕ ПОЛОСЫ ОЧЕРЕДЕЙ
+# ============================================================================
+
+# У каждой очереди три полосы (см. routing.py); MEDIUM - исходная очередь
+PRIORITY_LEVELS = ("HIGH", "MEDIUM", "LOW")
+DEFAULT_PRIORITY = "MEDIUM"
+
+# Доли чтений полос, когда заняты все: HIGH идёт первым, но LOW не голодает
+PRIORITY_WEIGHTS = {"HIGH": 8, "MEDIUM": 3, "LOW": 1}
+
+# ============================================================================
+# ПАКЕТНОЕ ЧТЕНИЕ ОЧЕРЕДЕЙ
+# ============================================================================
+
+# batch_size - сколько элементов забираем за один проход (1 = старое поведение)
+# max_wait   - сколько секунд блокируемся в ожидании первого элемента
+QUEUE_BATCH_SETTINGS = {
+    1: {"batch_size": 50, "max_wait": 1},
+    2: {"batch_size": 20, "max_wait": 1},
+    3: {"batch_size": 20, "max_wait": 1},
+    4: {"batch_size": 20, "max_wait": 1},
+    5: {"batch_size": 50, "max_wait": 1},
+    6: {"batch_size": 5, "max_wait": 1},
+    "bot": {"batch_size": 50, "max_wait": 1},
+}
+
+def get_batch_settings(agent_id):
+    settings = QUEUE_BATCH_SETTINGS.get(agent_id, {})
+    return {
+        "batch_size": max(1, min(int(settings.get("batch_size", 1)), MAX_MESSAGES_BATCH)),
+        "max_wait": settings.get("max_wait", 1)
+    }
+
+# ============================================================================
+# ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА В АГЕНТАХ
+# ============================================================================
+
+# Сколько сообщений агент обрабатывает одновременно в одном event loop
+# (LLM-вызовы занимают 1-10 сек и почти не тратят CPU)
+AGENT_CONCURRENCY = {
+    1: 20,
+    2: 16,
+    3: 16,
+    4: 16,
+    5: 32,
+    6: 4,
+}
+
+def get_agent_concurrency(agent_id):
+    return max(1, int(AGENT_CONCURRENCY.get(agent_id, 1)))
+
+# ============================================================================
+# ОБЪЕДИНЕНИЕ РЕШЕНИЙ АГЕНТОВ 3 И 4 (АГЕНТ 5)
+# ============================================================================
+
+# Агент 5 ждёт оба решения по (chat_id, message_id). Если второе не пришло
+# за JOIN_DEADLINE секунд после первого - решает по тому, что есть
+JOIN_DEADLINE = float(os.getenv("JOIN_DEADLINE", "20"))
+JOIN_TTL = 600                  # Сколько секунд хранится состояние join в Redis
+JOIN_CHECK_INTERVAL = 1         # Как часто (сек) проверять просроченные join
+
+# ============================================================================
+# ПЕРЕГРУЗКА И ДЕГРАДАЦИЯ
+# ============================================================================
+
+# Режимы по возрастанию нагрузки:
+#   normal         - полный конвейер
+#   no_arbitration - Агент 5 не вызывает OpenAI при разногласиях
+#   skip_3_4       - Агент 2 отправляет решение сразу Агенту 5, агенты 3 и 4 пропускаются
+#   local_only     - Агент 2 решает локальной эвристикой, без LLM
+OVERLOAD_MODES = ("normal", "no_arbitration", "skip_3_4", "local_only")
+
+# Порог входа в режим: глубина очереди (сообщений) или возраст самого старого сообщения (сек)
+# на любом этапе (вход агентов 2-5)
+OVERLOAD_THRESHOLDS = {
+    "no_arbitration": {"depth": 200, "age": 30},
+    "skip_3_4": {"depth": 1000, "age": 120},
+    "local_only": {"depth": 5000, "age": 300},
+}
+
+OVERLOAD_EXIT_RATIO = 0.5       # Выход из режима, когда нагрузка ниже порога * 0.5 (гистерезис)
+OVERLOAD_MIN_DWELL = 30         # Минимум секунд в режиме перед понижением
+OVERLOAD_CHECK_INTERVAL = 2     # Как часто (сек) контроллер меряет очереди, а агенты перечитывают режим
+
+# ============================================================================
+# КЭШ ВЕРДИКТОВ
+# ============================================================================
+
+# Одинаковый текст (волны спама) не отправляется в LLM повторно: ключ - нормализованный
+# текст + правила + версия модели/промпта (см. verdict_cache.py)
+VERDICT_CACHE_ENABLED = os.getenv("VERDICT_CACHE", "true").lower() == "true"
+VERDICT_CACHE_TTL = 3600            # Сколько секунд вердикт живёт в Redis и в памяти
+VERDICT_CACHE_SIZE = 5000           # Размер LRU в памяти процесса
+VERDICT_CACHE_STATS_INTERVAL = 30   # Как часто (сек) счётчики попаданий сбрасываются в Redis
+
+# Счётчики конвейера (metrics.py): автоматы, хедж, каскад, спекуляция, разбор ответов, фильтры бота
+METRICS_FLUSH_INTERVAL = 30         # Как часто (сек) счётчики процесса сбрасываются в Redis
+
+# ============================================================================
+# СЛОВАРНЫЙ ФИЛЬТР (lexicon.py)
+# ============================================================================
+
+# Категории словаря: тип нарушения (как в determine_action), серьёзность и можно ли решать без LLM.
+# requires_link - категория однозначна только вместе со ссылкой (спам)
+LEXICON_ENABLED = os.getenv("LEXICON", "true").lower() == "true"
+LEXICON_CATEGORIES = {
+    "threat": {"type": "угрозы", "severity": 8, "local": False},
+    "discrimination": {"type": "дискриминация", "severity": 6, "local": True},
+    "profanity": {"type": "мат", "severity": 5, "local": True},
+    "insult": {"type": "оскорбление", "severity": 4, "local": False},
+    "spam": {"type": "спам", "severity": 4, "local": True, "requires_link": True},
+    # Свои слова чата (/lexicon add ...)
+    "custom": {"type": "запрещённое слово", "severity": 5, "local": True},
+}
+LEXICON_LOCAL_CONFIDENCE = 95   # Уверенность (%) однозначного словарного решения
+LEXICON_CHAT_TTL = 60           # Как часто (сек) перечитывать свои слова чата из Redis
+
+# ============================================================================
+# МАРШРУТИЗАЦИЯ АГЕНТА 1
+# ============================================================================
+
+# Агент 1 выбирает путь по локальным признакам (длина, ссылки, словарь, история автора):
+#   SIMPLE  - только Агент 2, его решение сразу Агенту 5
+#   COMPLEX - сразу агенты 3 и 4 (без Агента 2)
+#   BOTH    - полный путь: Агент 2 → агенты 3 и 4 → Агент 5
+# Если уверенность ниже ROUTER_ESCALATE_BELOW и включён ROUTER_LLM - решает Mistral
+ROUTER_LLM_ENABLED = os.getenv("ROUTER_LLM", "false").lower() == "true"
+ROUTER_ESCALATE_BELOW = 0.6     # Уверенность локального маршрута, ниже которой спрашиваем LLM
+ROUTER_LLM_MAX_TOKENS = 20      # Ответ координатора - одна строка "МАРШРУТ ПРИОРИТЕТ УВЕРЕННОСТЬ"
+ROUTER_SIMPLE_MAX_LENGTH = 200  # Короткий текст без ссылок и совпадений словаря - SIMPLE
+ROUTER_COMPLEX_MIN_LENGTH = 600 # Длинный текст - сразу глубокий анализ (COMPLEX)
+ROUTER_REPEAT_OFFENDER = 2      # Нарушений автора в чате, после которых - всегда полный путь
+ROUTER_SIMPLE_MIN_CONFIDENCE = 80  # SIMPLE: нарушение с уверенностью Агента 2 ниже (%) всё же идёт в агенты 3 и 4
+USER_HISTORY_TTL = 7 * 24 * 3600   # Сколько (сек) помнить историю автора в чате
+
+# ============================================================================
+# КАСКАД: РАННИЙ ВЫХОД ПОСЛЕ АГЕНТА 2
+# ============================================================================
+
+# Уверенное решение Агента 2 сразу уходит Агенту 5 (он решает по одному мнению, без LLM),
+# агенты 3 и 4 работают только в спорной зоне. Уверенность - в процентах, как у Агента 2.
+# Эффект: счётчики "cascade" в «📊 Статус» и источники решений в local_pipeline.py --bench
+CASCADE_ENABLED = os.getenv("CASCADE", "true").lower() == "true"
+CASCADE_CLEAN_CONFIDENCE = int(os.getenv("CASCADE_CLEAN_CONFIDENCE", "90"))          # "Чисто" с уверенностью не ниже
+CASCADE_VIOLATION_CONFIDENCE = int(os.getenv("CASCADE_VIOLATION_CONFIDENCE", "90"))  # Нарушение с уверенностью не ниже...
+CASCADE_VIOLATION_SEVERITY = int(os.getenv("CASCADE_VIOLATION_SEVERITY", "8"))       # ...и серьёзностью не ниже
+
+# ============================================================================
+# СПЕКУЛЯТИВНЫЙ ВЕЕР (speculation.py)
+# ============================================================================
+
+# Сообщение уходит агентам 2, 3 и 4 одновременно, а не цепочкой 2 → 3/4: время до решения -
+# самый медленный агент, а не сумма этапов. Агент 5 решает по уверенному Агенту 2 (каскад)
+# или по агентам 3 и 4, а лишние вызовы отменяет
+SPECULATIVE_ENABLED = os.getenv("SPECULATIVE", "false").lower() == "true"
+SPECULATIVE_CANCEL_TTL = 300    # Сколько (сек) помнить отмену: сообщение может быть ещё в очереди
+
+# ============================================================================
+# ЛОКАЛЬНЫЙ КЛАССИФИКАТОР (classifier.py)
+# ============================================================================
+
+# Агент 5 пишет каждое решение в журнал (Redis-поток verdicts:log), из него офлайн учится
+# логистическая регрессия на хэшированных n-граммах: python3 classifier.py train.
+# Бот пропускает без LLM сообщения, которые модель уверенно считает чистыми
+CLASSIFIER_ENABLED = os.getenv("CLASSIFIER", "true").lower() == "true"
+CLASSIFIER_DIR = os.getenv("CLASSIFIER_DIR", str(Path(__file__).resolve().parent / "data" / "classifier"))
+CLASSIFIER_LOG_MAXLEN = 200000      # Сколько последних решений хранить в журнале
+CLASSIFIER_HASH_BITS = 18           # Размер пространства признаков: 2^18 весов
+CLASSIFIER_CLEAN_PRECISION = 0.99   # Доля действительно чистых среди пропущенных без LLM (на отложенной выборке)
+CLASSIFIER_MIN_EXAMPLES = 500       # Меньше примеров - модель не обучается
+CLASSIFIER_AUDIT_RATE = 0.02        # Доля "чистых" сообщений, которые всё равно идут в LLM (контроль и новые примеры)
+CLASSIFIER_RELOAD_INTERVAL = 30     # Как часто (сек) проверять, не появилась ли новая версия модели
+
+# ============================================================================
+# ПОИСК ПОЧТИ-ДУБЛИКАТОВ (ВОЛНЫ СПАМА)
+# ============================================================================
+
+# Бот считает SimHash текста и ищет похожие сообщения чата, уже получившие вердикт
+# за последние NEARDUP_WINDOW секунд (см. neardup.py). Похожие до NEARDUP_MAX_DISTANCE
+# отличающихся бит из 64 получают тот же вердикт без LLM
+NEARDUP_ENABLED = os.getenv("NEARDUP", "true").lower() == "true"
+NEARDUP_WINDOW = 900            # Окно поиска (сек)
+NEARDUP_BANDS = 8               # Полосы LSH: находим всё, что отличается не больше чем на BANDS - 1 бит
+NEARDUP_MAX_DISTANCE = 6        # Максимум отличающихся бит SimHash (не больше BANDS - 1)
+NEARDUP_MIN_LENGTH = 20         # Короче - слишком общий текст, не сравниваем
+
+# ============================================================================
+# ПРОМПТЫ (КОМПИЛЯТОР prompt_compiler.py)
+# ============================================================================
+
+PROMPT_RULES_CACHE_SIZE = 1000  # Сколько собранных блоков правил (наборов правил чатов) держать в памяти
+PROMPT_REPORT_EVERY = 100       # Раз в сколько вызовов писать в лог отчёт об экономии входных токенов
+
+# ============================================================================
+# БЮДЖЕТ ТОКЕНОВ НА ТЕКСТ СООБЩЕНИЯ (token_budget.py)
+# ============================================================================
+
+# Текст сообщения сжимается всегда (растянутые символы, потоки эмодзи, пробелы). Бюджет - по имени
+# шаблона промпта: агенты 2, 3 и 4 режут длинный текст на куски и анализируют их параллельно,
+# остальные (и страховка в компиляторе) обрезают текст до бюджета. Нет в словаре - без ограничения
+TOKEN_BUDGETS = {
+    "agent1": 300,
+    "agent2": 600,
+    "agent3": 600,
+    "agent4": 800,
+    "agent5": 600,
+}
+TOKEN_BUDGET_OVERLAP = 50       # Перекрытие соседних кусков (токенов): фраза на стыке целиком попадёт в один из них
+TOKEN_BUDGET_CONCURRENCY = 4    # Сколько кусков одного текста анализируется одновременно (анализируются все)
+
 # ============================================================================
 # MISTRAL AI
 # ============================================================================
@@ -96,6 +336,105 @@ MISTRAL_GENERATION_PARAMS = {
     "top_p": 0.95
 }
 
+# Микробатчинг Агента 2: до MICROBATCH_SIZE сообщений в одном запросе к Mistral,
+# пакет уходит, когда набран или через MICROBATCH_WAIT_MS после первого сообщения (1 = без пакетов)
+MICROBATCH_SIZE = int(os.getenv("MICROBATCH_SIZE", "8"))
+MICROBATCH_WAIT_MS = int(os.getenv("MICROBATCH_WAIT_MS", "50"))
+
+# ============================================================================
+# DEEPSEEK / OPENAI
+# ============================================================================
+
+DEEPSEEK_TOKEN = os.getenv("DEEPSEEK_TOKEN", "")
+OPENAI_TOKEN = os.getenv("OPENAI_TOKEN", "")
+
+# ============================================================================
+# LLM ПРОВАЙДЕРЫ (ОБЩИЙ КЛИЕНТ llm_client.py)
+# ============================================================================
+
+LLM_PROVIDERS = {
+    "mistral": {
+        "url": "https://api.mistral.ai/v1/chat/completions",
+        "warmup_url": "https://api.mistral.ai/v1/models",
+        "api_key": MISTRAL_API_KEY,
+        "timeout": 30,
+        "json_mode": True,      # response_format={"type": "json_object"} - ответ гарантированно JSON-объект
+    },
+    "deepseek": {
+        "url": "https://api.deepseek.com/chat/completions",
+        "warmup_url": "https://api.deepseek.com/models",
+        "api_key": DEEPSEEK_TOKEN,
+        "timeout": 10,
+        "json_mode": True,
+        "stream_usage": True,   # stream_options.include_usage - usage в последнем событии потока
+    },
+    "openai": {
+        "url": "https://api.openai.com/v1/chat/completions",
+        "warmup_url": "https://api.openai.com/v1/models",
+        "api_key": OPENAI_TOKEN,
+        "timeout": 15,
+        "json_mode": True,
+        "stream_usage": True,
+    },
+}
+
+# Потоковые ответы (chat_stream): агент решает по первым полям JSON, не дожидаясь длинного explanation
+LLM_STREAMING_ENABLED = os.getenv("LLM_STREAMING", "true").lower() == "true"
+
+# Хеджирование (chat_json): если провайдер не ответил за свой наблюдаемый p90, тот же запрос
+# уходит запасному провайдеру/модели, берётся первый валидный JSON, проигравший отменяется.
+# Бюджет: не больше LLM_HEDGE_BUDGET дополнительных вызовов на один обычный (0.05 = +5%)
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE", "true").lower() == "true"
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))
+LLM_HEDGE_BURST = 5             # Сколько хеджей можно накопить про запас (всплеск задержек)
+LLM_HEDGE_PERCENTILE = 0.9      # Задержка хеджа - этот перцентиль недавних задержек провайдера
+LLM_HEDGE_WINDOW = 200          # Сколько последних задержек помнить
+LLM_HEDGE_MIN_SAMPLES = 20      # Пока замеров меньше - не хеджируем
+LLM_HEDGE_MIN_DELAY = 0.5       # Хедж не раньше чем через столько секунд
+LLM_HEDGE_TARGETS = {
+    "deepseek": {"provider": "openai", "model": "gpt-4o-mini"},
+    "openai": {"provider": "deepseek", "model": "deepseek-chat"},
+    "mistral": {"provider": "mistral", "model": "mistral-small-latest"},
+}
+
+# Автоматы защиты (circuit breaker) - отдельный на провайдера, для некоторых моделей - свой
+# (pixtral - другой сервис у того же Mistral). Закрыт -> LLM_BREAKER_FAILURES сбоев подряд -> открыт
+# (вызовы сразу уходят в fallback) -> через LLM_BREAKER_OPEN_SECONDS полуоткрыт (один пробный вызов)
+LLM_BREAKER_FAILURES = 5
+LLM_BREAKER_OPEN_SECONDS = 30
+LLM_BREAKER_MAX_OPEN_SECONDS = 300   # Потолок для Retry-After
+LLM_BREAKER_MODELS = {
+    "pixtral-12b-2409": "pixtral",
+}
+
+# Повторы (RETRY_ATTEMPTS попыток, пауза RETRY_DELAY * 2^n со случайным разбросом) - только для
+# 429, 5xx и сетевых ошибок; таймаут не повторяем. Общий бюджет: LLM_RETRY_BUDGET повторов на вызов
+LLM_RETRY_BUDGET = float(os.getenv("LLM_RETRY_BUDGET", "0.1"))
+LLM_RETRY_BURST = 10
+LLM_RETRY_MAX_DELAY = 8         # Retry-After длиннее - не ждём внутри вызова, а открываем автомат
+
+# Общий для всех процессов лимит провайдера (token bucket в Redis, атомарный Lua-скрипт): запросы и токены
+# в минуту на провайдера/модель/API ключ. Ключ словаря - модель (если у неё свой лимит) или провайдер.
+# Подставьте лимиты своего тарифа. Ждать дольше LLM_RATE_MAX_WAIT не будем - агент возьмёт fallback
+LLM_RATE_LIMIT_ENABLED = os.getenv("LLM_RATE_LIMIT", "true").lower() == "true"
+LLM_RATE_LIMITS = {
+    "mistral": {"rpm": 300, "tpm": 2000000},
+    "pixtral-12b-2409": {"rpm": 60, "tpm": 500000},
+    "deepseek": {"rpm": 600, "tpm": 2000000},
+    "openai": {"rpm": 500, "tpm": 200000},
+}
+LLM_RATE_MAX_WAIT = 10
+
+# Постоянные keep-alive соединения на каждого провайдера
+LLM_POOL_LIMITS = {
+    "max_connections": 64,
+    "max_keepalive_connections": 32,
+    "keepalive_expiry": 120,
+}
+
+# HTTP/2 (нужен пакет h2): много параллельных запросов в одном TLS-соединении
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "false").lower() == "true"
+
 # ============================================================================
 # MODERATORS
 # ============================================================================
@@ -116,6 +455,11 @@ DEFAULT_RULES = [
     "7. Соблюдайте вежливость и уважение к другим участникам"
 ]
 
+# Свои правила чата (rules_cache.py, команда /rules в боте): Redis-ключ rules:chat:{chat_id}
+# и chats.custom_rules в Postgres. Агенты держат их в памяти, изменения приходят по каналу rules:changed
+RULES_CACHE_TTL = 300           # Страховка (сек): правила перечитываются, даже если уведомление потерялось
+RULES_MAX_COUNT = 20            # Больше правил в промпт не идёт
+
 # ============================================================================
 # AGENTS PORTS
 # ============================================================================
@@ -181,8 +525,11 @@ Path(DOWNLOADS_DIR).mkdir(exist_ok=True)
 
 REQUEST_TIMEOUT = 30
 MAX_MESSAGES_BATCH = 100
-RETRY_ATTEMPTS = 3
-RETRY_DELAY = 2
+RETRY_ATTEMPTS = 3              # Попыток на вызов LLM (вместе с первой), см. llm_client
+RETRY_DELAY = 2                 # Базовая пауза перед повтором, сек
+# Пауза цикла чтения после ошибки (Redis недоступен и т.п.): растёт от BASE до MAX, сбрасывается после успеха
+LOOP_BACKOFF_BASE = 0.1
+LOOP_BACKOFF_MAX = 5
 
 # ============================================================================
 # CHECK CONFIG
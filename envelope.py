@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+✉️ КОНВЕРТЫ СООБЩЕНИЙ
+✅ Компактная бинарная сериализация: msgpack (если установлен), иначе JSON
+✅ zstd для длинных значений (если установлен zstandard)
+✅ Claim-check: текст и метаданные сообщения кладутся один раз в msg:{chat_id}:{message_id},
+   в очереди едет конверт со ссылкой _ref
+✅ Читает и старые JSON-строки, поэтому агенты можно обновлять по одному
+"""
+
+import json
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from config import CLAIM_CHECK_FIELDS, CLAIM_CHECK_CACHE_SIZE, QUEUE_COMPRESS_MIN_BYTES
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+    _compressor = zstandard.ZstdCompressor(level=3)
+    _decompressor = zstandard.ZstdDecompressor()
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Первый байт бинарного значения; JSON всегда начинается с печатного символа
+MAGIC_MSGPACK = b"\x01"
+MAGIC_ZSTD = b"\x02"
+
+REF_FIELD = "_ref"
+
+# ============================================================================
+# СЕРИАЛИЗАЦИЯ
+# ============================================================================
+
+
+def pack(value) -> bytes:
+    if not MSGPACK_AVAILABLE:
+        return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+    raw = msgpack.packb(value, use_bin_type=True)
+    if ZSTD_AVAILABLE and len(raw) >= QUEUE_COMPRESS_MIN_BYTES:
+        return MAGIC_ZSTD + _compressor.compress(raw)
+    return MAGIC_MSGPACK + raw
+
+
+def unpack(data):
+    if isinstance(data, str):
+        return json.loads(data)
+
+    magic = data[:1]
+    if magic == MAGIC_MSGPACK:
+        return msgpack.unpackb(data[1:], raw=False)
+    if magic == MAGIC_ZSTD:
+        return msgpack.unpackb(_decompressor.decompress(data[1:]), raw=False)
+    return json.loads(data)
+
+# ============================================================================
+# CLAIM-CHECK
+# ============================================================================
+
+
+def message_ref(payload: Dict[str, Any]) -> Optional[str]:
+    chat_id = payload.get("chat_id")
+    message_id = payload.get("message_id")
+    if chat_id is None or message_id is None:
+        return None
+    return f"{chat_id}:{message_id}"
+
+
+def message_key(ref: str) -> str:
+    return f"msg:{ref}"
+
+
+class ClaimCheck:
+    """
+    Отделяет тяжёлые поля от конверта и возвращает их обратно.
+    Держит LRU сообщений, которые процесс уже сохранял или читал,
+    чтобы не писать и не читать хэш повторно на каждом этапе
+    """
+
+    def __init__(self, cache_size: int = CLAIM_CHECK_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def remember(self, ref: str, fields: Dict[str, Any]):
+        known = self._cache.pop(ref, {})
+        known.update(fields)
+        self._cache[ref] = known
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def known(self, ref: str) -> Optional[Dict[str, Any]]:
+        fields = self._cache.get(ref)
+        if fields is not None:
+            self._cache.move_to_end(ref)
+        return fields
+
+    def check_in(self, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str], Dict[str, Any]]:
+        """
+        Возвращает (конверт, ref, поля для записи в хэш).
+        Поле убирается из конверта, только если в хэше лежит ровно то же значение.
+        Записанные поля отмечаются через remember() после успешной записи
+        """
+        ref = message_ref(payload)
+        heavy = {field: payload[field] for field in CLAIM_CHECK_FIELDS if payload.get(field) not in (None, "")}
+        if ref is None or not heavy:
+            return payload, None, {}
+
+        known = self.known(ref) or {}
+        to_store = {field: value for field, value in heavy.items() if field not in known}
+        stripped = [field for field, value in heavy.items() if field in to_store or known.get(field) == value]
+
+        envelope = {key: value for key, value in payload.items() if key not in stripped}
+        envelope[REF_FIELD] = ref
+        return envelope, ref, to_store
+
+    def check_out(self, envelope: Dict[str, Any], fields: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Возвращает тяжёлые поля в payload (значения из конверта важнее)"""
+        ref = envelope.pop(REF_FIELD, None)
+        if ref is None or not fields:
+            return envelope
+        self.remember(ref, fields)
+        return {**fields, **envelope}
+
+    @staticmethod
+    def decode_hash(raw: Dict) -> Dict[str, Any]:
+        fields = {}
+        for field, value in (raw or {}).items():
+            name = field.decode("utf-8") if isinstance(field, bytes) else field
+            fields[name] = unpack(value)
+        return fields
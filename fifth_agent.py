@@ -8,6 +8,10 @@
 
 ✅ Получает решения от агентов 3 и 4
 
+✅ Сопоставляет их по (chat_id, message_id) и ждёт оба (не дольше JOIN_DEADLINE)
+
+✅ Спекулятивный веер: учитывает и Агента 2, отменяет ставшие лишними вызовы агентов 3 и 4
+
 ✅ Сравнивает их решения
 
 ✅ При разногласиях использует OpenAI для финального вердикта
@@ -20,28 +24,34 @@
 
 import json
 
-import redis
-
 import time
 
 import asyncio
 
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
 from datetime import datetime
 
 import aiohttp
 
-import requests
-
 from config import (
 
-    get_redis_config,
+    QUEUE_AGENT_3_OUTPUT,
 
     QUEUE_AGENT_5_INPUT,
 
     QUEUE_AGENT_5_OUTPUT,
 
+    JOIN_DEADLINE,
+
+    JOIN_TTL,
+
+    JOIN_CHECK_INTERVAL,
+
+    NEARDUP_ENABLED,
+
+    CLASSIFIER_ENABLED,
+
     TELEGRAM_BOT_TOKEN,
 
     setup_logging,
@@ -50,6 +60,26 @@ from config import (
 
 )
 
+from agent_runtime import AsyncAgentWorker
+
+from llm_client import chat_json, LLMError
+
+from verdict_parser import extract_object, confidence_percent, normalize_action, to_int
+
+from overload import mode_level
+
+from verdict_cache import verdict_cache, fingerprint
+
+from neardup import NearDuplicateIndex, simhash
+
+from user_history import UserHistory
+
+from rules_cache import chat_rules
+
+from classifier import verdict_record, log_verdict
+
+from prompt_compiler import PromptTemplate
+
 # ============================================================================
 
 # ЛОГИРОВАНИЕ
@@ -64,12 +94,10 @@ logger = setup_logging("АГЕНТ 5")
 
 # ============================================================================
 
-OPENAI_API_KEY = OPENAI_TOKEN
+# URL и ключ - в LLM_PROVIDERS (config.py)
 
 OPENAI_MODEL = "gpt-4o-mini"
 
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
-
 # ============================================================================
 
 # TELEGRAM API
@@ -178,106 +206,97 @@ async def apply_moderation_action(chat_id: int, user_id: int,
 
 # ============================================================================
 
-def call_openai_for_verdict(message: str, agent3_decision: Dict[str, Any], 
-
-    agent4_decision: Dict[str, Any]) -> Dict[str, Any]:
+# Инструкции и правила - стабильный префикс (system), сообщение и решения модераторов - последними (user)
 
-    try:
-
-        rules_text = "\n".join([f"- {rule}" for rule in DEFAULT_RULES])
-
-        prompt = f"""Ты опытный модератор сообщества. Проанализируй следующее сообщение и два решения от разных модераторов.
-
-ПРАВИЛА СООБЩЕСТВА:
-{rules_text}
-
-СООБЩЕНИЕ ДЛЯ АНАЛИЗА:
-"{message}"
-
-РЕШЕНИЕ МОДЕРАТОРА 3:
-- Действие: {agent3_decision.get('action', 'none')}
-- Серьезность: {agent3_decision.get('severity', 0)}/10
-- Уверенность: {agent3_decision.get('confidence', 0)}%
-
-РЕШЕНИЕ МОДЕРАТОРА 4:
-- Действие: {agent4_decision.get('action', 'none')}
-- Серьезность: {agent4_decision.get('severity', 0)}/10
-- Уверенность: {agent4_decision.get('confidence', 0)}%
+ARBITRATION_PROMPT = PromptTemplate("agent5", """Ты опытный модератор сообщества. Проанализируй сообщение пользователя и два решения от разных модераторов.
 
 Дай финальный вердикт в формате JSON:
-{{
+{
     "final_action": "none|warn|mute|ban",
     "final_severity": число от 0 до 10,
     "final_confidence": число от 0 до 100,
     "reasoning": "краткое объяснение решения",
     "violated_rule": "какое правило нарушено (если есть)"
-}}
+}
 
-Будь объективен и справедлив. Верни ТОЛЬКО JSON без дополнительного текста."""
+Будь объективен и справедлив. Верни ТОЛЬКО JSON без дополнительного текста.""", message_template="""СООБЩЕНИЕ ДЛЯ АНАЛИЗА:
+"{message}"
 
-        headers = {
+РЕШЕНИЕ МОДЕРАТОРА 3:
+- Действие: {agent3[0]}
+- Серьезность: {agent3[1]}/10
+- Уверенность: {agent3[2]}%
 
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
+РЕШЕНИЕ МОДЕРАТОРА 4:
+- Действие: {agent4[0]}
+- Серьезность: {agent4[1]}/10
+- Уверенность: {agent4[2]}%""", rules_title="ПРАВИЛА СООБЩЕСТВА:")
 
-            "Content-Type": "application/json"
+# Смена модели или промпта - новая версия ключей кэша вердиктов
 
-        }
+PROMPT_VERSION = fingerprint(OPENAI_MODEL, ARBITRATION_PROMPT.version)
 
-        payload = {
+def decision_context(decision: Dict[str, Any]) -> List[Any]:
 
-            "model": OPENAI_MODEL,
+    """Часть решения агента, которая попадает в промпт арбитра (и в ключ кэша)"""
 
-            "messages": [
+    return [decision.get('action', 'none'), decision.get('severity', 0), decision.get('confidence', 0)]
 
-                {
+def parse_verdict(content: str) -> Dict[str, Any]:
 
-                    "role": "user",
+    """Ответ без final_action не считается валидным - тогда побеждает второй запрос (хедж)"""
 
-                    "content": prompt
+    verdict = extract_object(content)
 
-                }
+    if "final_action" not in verdict:
 
-            ],
+        raise ValueError("нет поля final_action")
 
-            "temperature": 0.3,
+    verdict["final_action"] = normalize_action(verdict["final_action"], False)
 
-            "max_tokens": 300
+    verdict["final_severity"] = to_int(verdict.get("final_severity"), 0, 0, 10)
 
-        }
+    verdict["final_confidence"] = confidence_percent(verdict.get("final_confidence"))
 
-        logger.info("🤖 Отправляю запрос к OpenAI для арбитража...")
+    return verdict
 
-        response = requests.post(OPENAI_API_URL, json=payload, headers=headers, timeout=15)
+async def call_openai_for_verdict(message: str, agent3_decision: Dict[str, Any], 
 
-        if response.status_code != 200:
+    agent4_decision: Dict[str, Any], rules: List[str] = None) -> Dict[str, Any]:
 
-            logger.error(f"❌ OpenAI API ошибка: {response.status_code}")
+    try:
 
-            raise Exception(f"API error: {response.status_code}")
+        messages = ARBITRATION_PROMPT.messages(
 
-        response_data = response.json()
+            message, rules or DEFAULT_RULES,
 
-        ai_response = response_data["choices"][0]["message"]["content"]
+            agent3=decision_context(agent3_decision),
 
-        try:
+            agent4=decision_context(agent4_decision)
+
+        )
+
+        logger.info("🤖 Отправляю запрос к OpenAI для арбитража...")
+
+        verdict = await chat_json(
 
-            verdict = json.loads(ai_response)
+            "openai", OPENAI_MODEL, messages,
 
-            logger.info(f"✅ Получен вердикт от OpenAI: {verdict['final_action']}")
+            temperature=0.3, max_tokens=300, usage_key=ARBITRATION_PROMPT.name,
 
-            return verdict
+            parse=parse_verdict
 
-        except json.JSONDecodeError:
+        )
 
-            logger.error(f"❌ Не удалось распарсить JSON из ответа OpenAI: {ai_response}")
+        logger.info(f"✅ Получен вердикт от OpenAI: {verdict['final_action']}")
 
-            raise Exception("Failed to parse AI response as JSON")
+        return verdict
 
-    except requests.exceptions.Timeout:
+    except LLMError as e:
 
-        logger.error("❌ Timeout при обращении к OpenAI API")
+        logger.error(f"❌ OpenAI API ошибка: {e}")
 
-        raise Exception("API timeout")
+        raise
 
     except Exception as e:
 
@@ -291,9 +310,51 @@ def call_openai_for_verdict(message: str, agent3_decision: Dict[str, Any],
 
 # ============================================================================
 
-def compare_agent_decisions(agent3_result: Dict[str, Any], 
+def single_agent_decision(result: Dict[str, Any]) -> Dict[str, Any]:
+
+    """
+
+    Решение по мнению одного агента: второе не пришло до дедлайна
+
+    или агенты 3 и 4 пропущены из-за перегрузки (тогда это мнение Агента 2)
+
+    """
+
+    agent_id = result.get("agent_id")
+
+    if result.get("decision_source"):
+
+        # Готовый вердикт (например, почти-дубликат из бота) - принимаем как есть
+
+        logger.info(f"📋 Готовое решение ({result['decision_source']}), принимаю его")
+
+    else:
+
+        logger.warning(f"⏰ Есть только решение Агента {agent_id}, принимаю его")
+
+    return {
+
+        "consensus": False,
+
+        "final_action": result.get("action", "none").lower(),
+
+        "final_severity": result.get("severity", 0),
+
+        "final_confidence": confidence_percent(result.get("confidence", 0), fraction=agent_id == 3),
 
-                           agent4_result: Dict[str, Any]) -> Dict[str, Any]:
+        "reasoning": result.get("reason") or f"Решение только Агента {agent_id}",
+
+        "decision_source": result.get("decision_source") or f"agent{agent_id}_only"
+
+    }
+
+async def compare_agent_decisions(agent3_result: Dict[str, Any],
+
+                           agent4_result: Dict[str, Any],
+
+                           allow_arbitration: bool = True,
+
+                           agent2_result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
 
     """
 
@@ -301,7 +362,9 @@ def compare_agent_decisions(agent3_result: Dict[str, Any],
 
     Если согласны - принимает решение
 
-    Если расходятся - вызывает OpenAI
+    Если расходятся - вызывает OpenAI (allow_arbitration=False - сразу консервативное решение)
+
+    agent2_result - мнение Агента 2 (спекулятивный веер): при расхождении решает большинство без OpenAI
 
     """
 
@@ -315,9 +378,11 @@ def compare_agent_decisions(agent3_result: Dict[str, Any],
 
     agent4_severity = agent4_result.get("severity", 0)
 
-    agent3_confidence = agent3_result.get("confidence", 0)
+    # Агент 3 отдаёт уверенность 0-1, Агент 4 - 0-100
+
+    agent3_confidence = confidence_percent(agent3_result.get("confidence", 0), fraction=True)
 
-    agent4_confidence = agent4_result.get("confidence", 0)
+    agent4_confidence = confidence_percent(agent4_result.get("confidence", 0))
 
     message = agent4_result.get("message", "")
 
@@ -357,67 +422,113 @@ def compare_agent_decisions(agent3_result: Dict[str, Any],
 
     else:
 
-        # Агенты расходятся - вызываем OpenAI
+        # Спекулятивный веер: есть третье мнение - большинство решает без арбитража
 
-        logger.warning("⚠️ Агенты расходятся! Вызываю OpenAI для арбитража...")
+        agent2_action = (agent2_result or {}).get("action", "").lower()
 
-        try:
+        if agent2_action and agent2_action in (agent3_action, agent4_action):
 
-            openai_verdict = call_openai_for_verdict(message, agent3_result, agent4_result)
+            majority = agent3_result if agent2_action == agent3_action else agent4_result
 
-            logger.info(f"✅ OpenAI вынес вердикт: {openai_verdict['final_action']}")
+            logger.info(f"🗳️ Агент 2 согласен с Агентом {majority.get('agent_id')}: {agent2_action}, решает большинство")
 
             return {
 
                 "consensus": False,
 
-                "final_action": openai_verdict.get("final_action", "none"),
+                "final_action": agent2_action,
 
-                "final_severity": openai_verdict.get("final_severity", 0),
+                "final_severity": majority.get("severity", 0),
 
-                "final_confidence": openai_verdict.get("final_confidence", 0),
+                "final_confidence": confidence_percent(majority.get("confidence", 0), fraction=majority is agent3_result),
 
-                "reasoning": openai_verdict.get("reasoning", "OpenAI арбитраж"),
+                "reasoning": "Большинство агентов (2 из 3) согласны с решением",
 
-                "violated_rule": openai_verdict.get("violated_rule", ""),
-
-                "decision_source": "openai_arbitrage"
+                "decision_source": "majority"
 
             }
 
-        except Exception as e:
+        # Агенты расходятся - вызываем OpenAI (если не отключён режимом перегрузки)
 
-            logger.error(f"❌ Ошибка при вызове OpenAI, использую консервативный подход: {e}")
+        if allow_arbitration:
 
-            # Консервативный подход - берем более мягкое решение
+            logger.warning("⚠️ Агенты расходятся! Вызываю OpenAI для арбитража...")
 
-            if agent3_action in ["none", "warn"]:
+            try:
 
-                final_action = agent3_action
+                rules = await chat_rules.get(agent3_result.get("chat_id") or agent4_result.get("chat_id"))
 
-            elif agent4_action in ["none", "warn"]:
+                openai_verdict = await verdict_cache.cached(
 
-                final_action = agent4_action
+                    "agent5", PROMPT_VERSION, message,
 
-            else:
+                    [decision_context(agent3_result), decision_context(agent4_result), rules],
 
-                final_action = agent3_action  # Если оба строгие - берем первого
+                    lambda: call_openai_for_verdict(message, agent3_result, agent4_result, rules)
 
-            return {
+                )
 
-                "consensus": False,
+                logger.info(f"✅ OpenAI вынес вердикт: {openai_verdict['final_action']}")
 
-                "final_action": final_action,
+                return {
 
-                "final_severity": min(agent3_severity, agent4_severity),
+                    "consensus": False,
 
-                "final_confidence": 50,
+                    "final_action": openai_verdict.get("final_action", "none"),
 
-                "reasoning": "Консервативное решение при ошибке OpenAI",
+                    "final_severity": openai_verdict.get("final_severity", 0),
 
-                "decision_source": "fallback"
+                    "final_confidence": openai_verdict.get("final_confidence", 0),
 
-            }
+                    "reasoning": openai_verdict.get("reasoning", "OpenAI арбитраж"),
+
+                    "violated_rule": openai_verdict.get("violated_rule", ""),
+
+                    "decision_source": "openai_arbitrage"
+
+                }
+
+            except Exception as e:
+
+                logger.error(f"❌ Ошибка при вызове OpenAI, использую консервативный подход: {e}")
+
+            reasoning, decision_source = "Консервативное решение при ошибке OpenAI", "fallback"
+
+        else:
+
+            logger.warning("🚨 Агенты расходятся, арбитраж OpenAI отключён (перегрузка) - консервативный подход")
+
+            reasoning, decision_source = "Консервативное решение (перегрузка, без арбитража)", "overload_fallback"
+
+        # Консервативный подход - берем более мягкое решение
+
+        if agent3_action in ["none", "warn"]:
+
+            final_action = agent3_action
+
+        elif agent4_action in ["none", "warn"]:
+
+            final_action = agent4_action
+
+        else:
+
+            final_action = agent3_action  # Если оба строгие - берем первого
+
+        return {
+
+            "consensus": False,
+
+            "final_action": final_action,
+
+            "final_severity": min(agent3_severity, agent4_severity),
+
+            "final_confidence": 50,
+
+            "reasoning": reasoning,
+
+            "decision_source": decision_source
+
+        }
 
 # ============================================================================
 
@@ -425,10 +536,30 @@ def compare_agent_decisions(agent3_result: Dict[str, Any],
 
 # ============================================================================
 
-async def process_moderation_result(result_data: Dict[str, Any]) -> Dict[str, Any]:
+async def process_moderation_result(results: Dict[int, Dict[str, Any]],
+
+                                    allow_arbitration: bool = True) -> Dict[str, Any]:
+
+    """
+
+    Принимает финальное решение по сообщению.
+
+    results - решения по номеру агента: обычно 3 и 4, но одного может не быть (дедлайн),
+
+    а при перегрузке приходит только решение Агента 2
+
+    """
 
     try:
 
+        agent2_result = results.get(2)
+
+        agent3_result = results.get(3)
+
+        agent4_result = results.get(4)
+
+        result_data = agent4_result or agent3_result or next(iter(results.values()))
+
         message = result_data.get("message", "")
 
         chat_id = result_data.get("chat_id", 0)
@@ -441,11 +572,23 @@ async def process_moderation_result(result_data: Dict[str, Any]) -> Dict[str, An
 
         message_link = result_data.get("message_link", "")
 
-        logger.info(f"🔍 Обрабатываю результат от агента 4 для @{username}")
+        logger.info(f"🔍 Обрабатываю решения агентов {sorted(results)} для @{username}")
 
         # Сравниваем решения агентов 3 и 4
 
-        final_decision = compare_agent_decisions(result_data, result_data)
+        if agent3_result and agent4_result:
+
+            final_decision = await compare_agent_decisions(agent3_result, agent4_result, allow_arbitration, agent2_result)
+
+        elif agent2_result and str(agent2_result.get("decision_source", "")).startswith("cascade_"):
+
+            # Спекулятивный веер: уверенный Агент 2 решает, не дожидаясь агентов 3 и 4
+
+            final_decision = single_agent_decision(agent2_result)
+
+        else:
+
+            final_decision = single_agent_decision(result_data)
 
         final_action = final_decision.get("final_action", "none").lower()
 
@@ -519,6 +662,12 @@ async def process_moderation_result(result_data: Dict[str, Any]) -> Dict[str, An
 
                 "message_text": message[:200],
 
+                "priority": result_data.get("priority"),
+
+                # Маршрут Агента 1: по COMPLEX модераторы узнают о решении только от Агента 5
+
+                "route": result_data.get("route"),
+
                 "severity": final_severity,
 
                 "confidence": final_confidence,
@@ -561,6 +710,12 @@ async def process_moderation_result(result_data: Dict[str, Any]) -> Dict[str, An
 
                 "message_text": message[:200],
 
+                "priority": result_data.get("priority"),
+
+                # Маршрут Агента 1: по COMPLEX модераторы узнают о решении только от Агента 5
+
+                "route": result_data.get("route"),
+
                 "severity": 0,
 
                 "confidence": final_confidence,
@@ -595,99 +750,467 @@ async def process_moderation_result(result_data: Dict[str, Any]) -> Dict[str, An
 
 # ============================================================================
 
+# ОБЪЕДИНЕНИЕ РЕШЕНИЙ АГЕНТОВ 3 И 4
+
+# ============================================================================
+
+# Записывает решение агента и возвращает все решения по сообщению.
+# Если решение по сообщению уже принято (done) - возвращает false
+JOIN_ADD_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'done') == 1 then
+    return false
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('ZADD', KEYS[2], 'NX', ARGV[4], ARGV[5])
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# Забирает join для принятия решения ровно один раз (по полноте или по дедлайну)
+JOIN_CLAIM_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 0 or redis.call('HEXISTS', KEYS[1], 'done') == 1 then
+    return false
+end
+redis.call('HSET', KEYS[1], 'done', '1')
+return redis.call('HGETALL', KEYS[1])
+"""
+
+class ResultJoin:
+
+    """Общая часть join: ключ сообщения и проверка, что пришли все ожидаемые решения"""
+
+    EXPECTED_AGENTS = (3, 4)
+
+    @staticmethod
+
+    def member(result: Dict[str, Any]) -> str:
+
+        return f"{result.get('chat_id')}:{result.get('message_id')}"
+
+    def is_complete(self, results: Dict[int, Dict[str, Any]]) -> bool:
+
+        # Спекулятивный веер: уверенному Агенту 2 (каскад) агенты 3 и 4 не нужны
+
+        if 2 in results and str(results[2].get("decision_source", "")).startswith("cascade_"):
+
+            return True
+
+        return all(agent in results for agent in self.EXPECTED_AGENTS)
+
+    async def add(self, result: Dict[str, Any]) -> Optional[Dict[int, Dict[str, Any]]]:
+
+        """Сохраняет решение. Возвращает все решения, если пришли оба, иначе None"""
+
+        raise NotImplementedError
+
+    async def claim(self, member: str) -> Optional[Dict[int, Dict[str, Any]]]:
+
+        """Забирает решения по сообщению ровно один раз"""
+
+        raise NotImplementedError
+
+    async def expired(self, limit: int) -> List[str]:
+
+        """Сообщения, дедлайн которых прошёл"""
+
+        raise NotImplementedError
+
+class RedisResultJoin(ResultJoin):
+
+    """
+
+    Решения лежат в хэше join:{chat_id}:{message_id} с TTL, дедлайны - в ZSET join:deadlines.
+
+    Флаг done ставится атомарно, поэтому решение принимается один раз даже при нескольких копиях Агента 5
+
+    """
+
+    DEADLINES_KEY = "join:deadlines"
+
+    def __init__(self, redis_client):
+
+        self.redis_client = redis_client
+
+        self._add = redis_client.register_script(JOIN_ADD_SCRIPT)
+
+        self._claim = redis_client.register_script(JOIN_CLAIM_SCRIPT)
+
+    @staticmethod
+
+    def hash_key(member: str) -> str:
+
+        return f"join:{member}"
+
+    @staticmethod
+
+    def decode(fields) -> Dict[int, Dict[str, Any]]:
+
+        results = {}
+
+        for name, value in zip(fields[::2], fields[1::2]):
+
+            if name.startswith("agent"):
+
+                results[int(name[5:])] = json.loads(value)
+
+        return results
+
+    async def add(self, result: Dict[str, Any]) -> Optional[Dict[int, Dict[str, Any]]]:
+
+        agent_id = result.get("agent_id")
+
+        member = self.member(result)
+
+        fields = await self._add(
+
+            keys=[self.hash_key(member), self.DEADLINES_KEY],
+
+            args=[f"agent{agent_id}", json.dumps(result, ensure_ascii=False), JOIN_TTL, time.time() + JOIN_DEADLINE, member]
+
+        )
+
+        if not fields:
+
+            logger.info(f"⌛ Решение Агента {agent_id} по {member} пришло после дедлайна, пропускаю")
+
+            return None
+
+        if not self.is_complete(self.decode(fields)):
+
+            logger.info(f"⏳ Решение Агента {agent_id} по {member} сохранено, жду второе")
+
+            return None
+
+        return await self.claim(member)
+
+    async def claim(self, member: str) -> Optional[Dict[int, Dict[str, Any]]]:
+
+        fields = await self._claim(keys=[self.hash_key(member), self.DEADLINES_KEY], args=[member])
+
+        return self.decode(fields) if fields else None
+
+    async def expired(self, limit: int) -> List[str]:
+
+        return await self.redis_client.zrangebyscore(self.DEADLINES_KEY, "-inf", time.time(), start=0, num=limit)
+
+class MemoryResultJoin(ResultJoin):
+
+    """Join в памяти процесса - для однопроцессного режима без Redis (local_pipeline.py)"""
+
+    def __init__(self):
+
+        self._results: Dict[str, Dict[int, Dict[str, Any]]] = {}
+
+        self._deadlines: Dict[str, float] = {}
+
+        # Сообщения, по которым решение уже принято: member -> когда забыть
+
+        self._done: Dict[str, float] = {}
+
+    async def add(self, result: Dict[str, Any]) -> Optional[Dict[int, Dict[str, Any]]]:
+
+        now = time.time()
+
+        self._done = {member: until for member, until in self._done.items() if until > now}
+
+        agent_id = result.get("agent_id")
+
+        member = self.member(result)
+
+        if member in self._done:
+
+            logger.info(f"⌛ Решение Агента {agent_id} по {member} пришло после дедлайна, пропускаю")
+
+            return None
+
+        results = self._results.setdefault(member, {})
+
+        results[agent_id] = result
+
+        self._deadlines.setdefault(member, now + JOIN_DEADLINE)
+
+        if not self.is_complete(results):
+
+            logger.info(f"⏳ Решение Агента {agent_id} по {member} сохранено, жду второе")
+
+            return None
+
+        return await self.claim(member)
+
+    async def claim(self, member: str) -> Optional[Dict[int, Dict[str, Any]]]:
+
+        self._deadlines.pop(member, None)
+
+        if member in self._done or member not in self._results:
+
+            return None
+
+        self._done[member] = time.time() + JOIN_TTL
+
+        return self._results.pop(member)
+
+    async def expired(self, limit: int) -> List[str]:
+
+        now = time.time()
+
+        return [member for member, deadline in self._deadlines.items() if deadline <= now][:limit]
+
+# ============================================================================
+
 # REDIS WORKER
 
 # ============================================================================
 
-class Agent5Worker:
+class Agent5Worker(AsyncAgentWorker):
+
+    agent_id = 5
+
+    # Решения Агента 4 приходят во вход Агента 5, решения Агента 3 - в его выход
+
+    input_queues = [QUEUE_AGENT_5_INPUT, QUEUE_AGENT_3_OUTPUT]
+
+    output_queues = [QUEUE_AGENT_5_OUTPUT]
+
+    llm_providers = ["openai"]
+
+    # Арбитр OpenAI решает по правилам чата
+
+    per_chat_rules = True
 
     def __init__(self):
 
+        super().__init__(logger)
+
+        self.join = None
+
+        self.neardup = None
+
+        self.history = None
+
+        self._deadline_task = None
+
+    async def setup(self):
+
+        if self.redis_client is not None:
+
+            self.join = RedisResultJoin(self.redis_client)
+
+        else:
+
+            self.join = MemoryResultJoin()
+
+        self.neardup = NearDuplicateIndex(self.redis_client)
+
+        self.history = UserHistory(self.redis_client)
+
+        self._deadline_task = asyncio.create_task(self.watch_deadlines())
+
+    async def cleanup(self):
+
+        if self._deadline_task:
+
+            self._deadline_task.cancel()
+
+            await asyncio.gather(self._deadline_task, return_exceptions=True)
+
+    async def decide(self, results: Dict[int, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+
+        # Ошибка агента равносильна отсутствию его решения
+
+        results = {
+
+            agent_id: result for agent_id, result in results.items()
+
+            if result and result.get("status") != "error"
+
+        }
+
+        if not results:
+
+            logger.warning("⚠️ Нет ни одного валидного решения агентов")
+
+            return None
+
+        # С режима no_arbitration и выше OpenAI не вызываем
+
+        allow_arbitration = await self.overload.level() < mode_level("no_arbitration")
+
+        if results.get(2, {}).get("speculative") and not all(agent in results for agent in self.join.EXPECTED_AGENTS):
+
+            await self.cancel_speculation(results[2])
+
+        output = await process_moderation_result(results, allow_arbitration)
+
+        action = output.get("action", "none")
+
+        source = output.get("decision_source", "unknown")
+
+        logger.info(f"📤 ✅ Результат в Redis: action={action}, source={source}")
+
+        if output.get("status") in ("processed", "ok") and source != "neardup":
+
+            await self.remember_verdict(results, output)
+
+        if output.get("status") in ("processed", "ok"):
+
+            await self.record_history(output)
+
+            await self.log_example(results, output)
+
+        return output
+
+    async def log_example(self, results: Dict[int, Dict[str, Any]], output: Dict[str, Any]):
+
+        """Решение - обучающий пример локального классификатора (classifier.py)"""
+
+        if not CLASSIFIER_ENABLED:
+
+            return
+
         try:
 
-            redis_config = get_redis_config()
+            await log_verdict(self.redis_client, verdict_record(results, output))
+
+        except Exception as e:
 
-            self.redis_client = redis.Redis(**redis_config)
+            logger.warning(f"⚠️ Не удалось записать решение в журнал: {e}")
 
-            self.redis_client.ping()
+    async def cancel_speculation(self, result: Dict[str, Any]):
 
-            logger.info("✅ Подключение к Redis успешно")
+        """Решение принято без агентов 3 или 4 - их вызовы по сообщению больше не нужны"""
+
+        try:
+
+            await self.speculation.cancel(result.get("chat_id"), result.get("message_id"))
 
         except Exception as e:
 
-            logger.error(f"❌ Не удалось подключиться к Redis: {e}")
+            logger.warning(f"⚠️ Не удалось отменить спекулятивные вызовы: {e}")
 
-            raise
+    async def record_history(self, output: Dict[str, Any]):
 
-    def run(self):
+        """История автора для маршрутизации Агента 1 (user_history.py)"""
 
-        logger.info("✅ Агент 5 запущен (Арбитр + OpenAI + Модератор)")
+        try:
 
-        logger.info(f"📬 Слушаю очередь: {QUEUE_AGENT_5_INPUT}")
+            await self.history.record(output.get("chat_id"), output.get("user_id"), output.get("action", "none") != "none")
 
-        logger.info(f"📤 Результаты в очередь: {QUEUE_AGENT_5_OUTPUT}")
+        except Exception as e:
 
-        logger.info("🤖 Использую OpenAI для арбитража при разногласиях")
+            logger.warning(f"⚠️ Не удалось обновить историю автора: {e}")
 
-        logger.info("⏱️ Нажмите Ctrl+C для остановки\n")
+    async def remember_verdict(self, results: Dict[int, Dict[str, Any]], output: Dict[str, Any]):
+
+        """Индексирует вердикт для почти-дубликатов: бот переиспользует его для похожих сообщений (neardup.py)"""
+
+        if not NEARDUP_ENABLED:
+
+            return
+
+        message = next((result.get("message") for result in results.values() if result.get("message")), "")
+
+        signature = simhash(message)
+
+        if signature is None:
+
+            return
 
         try:
 
-            while True:
+            await self.neardup.add(output.get("chat_id"), signature, {
+
+                **output,
+
+                "type": next((result.get("type") for result in results.values() if result.get("type")), "none"),
+
+                "is_violation": output.get("action", "none") != "none"
+
+            })
+
+        except Exception as e:
 
-                try:
+            logger.warning(f"⚠️ Не удалось сохранить подпись сообщения: {e}")
 
-                    result = self.redis_client.blpop(QUEUE_AGENT_5_INPUT, timeout=1)
+    async def process(self, input_data):
 
-                    if result is None:
+        speculative = input_data.get("speculative")
 
-                        continue
+        if input_data.get("message_id") is None or (input_data.get("agent_id") not in self.join.EXPECTED_AGENTS and not speculative):
 
-                    queue_name, message_data = result
+            # Сопоставлять не с чем (нет ключа или это решение Агента 2 при перегрузке) - решаем сразу
 
-                    logger.info("📨 Получено решение для обработки")
+            return await self.decide({input_data.get("agent_id"): input_data})
 
-                    # Парсим JSON
+        results = await self.join.add(input_data)
 
-                    try:
+        if results is None:
 
-                        input_data = json.loads(message_data)
+            return None
 
-                    except json.JSONDecodeError as e:
+        return await self.decide(results)
 
-                        logger.error(f"❌ Невалидный JSON: {e}")
+    async def expire(self, member: str):
 
-                        continue
+        async with self._semaphore:
 
-                    # Обрабатываем асинхронно
+            results = await self.join.claim(member)
 
-                    output = asyncio.run(process_moderation_result(input_data))
+            if not results:
 
-                    # ✅ ПИШЕМ РЕЗУЛЬТАТ В REDIS для БОТа
+                return
 
-                    try:
+            logger.warning(f"⏰ Дедлайн {JOIN_DEADLINE} сек по {member}: решаю по {len(results)} из 2 решений")
 
-                        result_json = json.dumps(output, ensure_ascii=False)
+            output = await self.decide(results)
 
-                        self.redis_client.rpush(QUEUE_AGENT_5_OUTPUT, result_json)
+            if output is not None:
 
-                        action = output.get("action", "none")
+                await self.transport.send([(QUEUE_AGENT_5_OUTPUT, output)])
 
-                        source = output.get("decision_source", "unknown")
+    async def watch_deadlines(self):
 
-                        logger.info(f"📤 ✅ Результат в Redis: action={action}, source={source}")
+        """Принимает решения по сообщениям, второе решение по которым не пришло вовремя"""
 
-                    except Exception as e:
+        while True:
 
-                        logger.error(f"❌ Ошибка отправки результата в Redis: {e}")
+            try:
 
-                    logger.info("✅ Обработка завершена\n")
+                expired = await self.join.expired(self.concurrency)
 
-                except Exception as e:
+                if expired:
 
-                    logger.error(f"❌ Ошибка в цикле: {e}")
+                    await asyncio.gather(*[self.expire(member) for member in expired])
+
+                    continue
+
+            except asyncio.CancelledError:
+
+                raise
+
+            except Exception as e:
+
+                logger.error(f"❌ Ошибка проверки дедлайнов: {e}")
+
+            await asyncio.sleep(JOIN_CHECK_INTERVAL)
+
+    def run(self):
+
+        logger.info("✅ Агент 5 запущен (Арбитр + OpenAI + Модератор)")
+
+        logger.info(f"📬 Слушаю очереди: {QUEUE_AGENT_5_INPUT}, {QUEUE_AGENT_3_OUTPUT}")
+
+        logger.info(f"⏱️ Жду оба решения не дольше {JOIN_DEADLINE} сек")
+
+        logger.info(f"📤 Результаты в очередь: {QUEUE_AGENT_5_OUTPUT}")
+
+        logger.info("🤖 Использую OpenAI для арбитража при разногласиях")
+
+        logger.info("⏱️ Нажмите Ctrl+C для остановки\n")
+
+        try:
 
-                    time.sleep(1)
+            super().run()
 
         except KeyboardInterrupt:
 
@@ -2,14 +2,13 @@
 # -*- coding: utf-8 -*-
 
 """
-🤖 АГЕНТ №1 — КООРДИНАТОР
-✅ ВСЕ сообщения → ТОЛЬКО В АГЕНТА 2
-✅ Минимальное изменение (одна строка!)
+🤖 АГЕНТ №1 — КООРДИНАТОР (МАРШРУТИЗАТОР)
+✅ Маршрут выбирается локально по признакам: длина, ссылки, словарь, история автора (routing.py)
+✅ SIMPLE → Агент 2 → Агент 5, COMPLEX → агенты 3 и 4, BOTH → полный путь
+✅ Mistral - только эскалация спорных случаев (ROUTER_LLM), его решение меняет маршрут
+✅ Перегрузка (skip_3_4 и выше): агенты 3 и 4 не вызываются (и веер тоже), сообщение проверяет только Агент 2
 """
 
-import json
-import redis
-import time
 import threading
 from datetime import datetime
 from typing import Dict, Any, List
@@ -17,104 +16,79 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
-try:
-    from mistralai.client import MistralClient
-    from mistralai.models.chat_completion import ChatMessage
-    MISTRAL_IMPORT_SUCCESS = True
-    MISTRAL_IMPORT_VERSION = "v0.4.2 (legacy)"
-except ImportError:
-    try:
-        from mistralai import Mistral as MistralClient
-        from mistralai import UserMessage, SystemMessage
-        def ChatMessage(role, content):
-            return role, content, role == "user"
-        MISTRAL_IMPORT_SUCCESS = True
-        MISTRAL_IMPORT_VERSION = "v1.0+ (новый SDK)"
-    except Exception as e:
-        MISTRAL_IMPORT_SUCCESS = False
-        MISTRAL_IMPORT_VERSION = "none"
-        class MistralClient:
-            def __init__(self, api_key=None): 
-                pass
-            def chat(self, **kwargs):
-                raise ImportError("Mistral AI не установлен")
-
 from config import (
     MISTRAL_API_KEY, MISTRAL_MODEL, MISTRAL_GENERATION_PARAMS,
-    get_redis_config, QUEUE_AGENT_1_OUTPUT, QUEUE_AGENT_2_INPUT,
+    QUEUE_AGENT_1_INPUT, QUEUE_AGENT_2_INPUT, QUEUE_AGENT_3_INPUT, QUEUE_AGENT_4_INPUT,
+    ROUTER_LLM_ENABLED, ROUTER_ESCALATE_BELOW, ROUTER_LLM_MAX_TOKENS, SPECULATIVE_ENABLED,
     AGENT_PORTS, DEFAULT_RULES, setup_logging
 )
+from agent_runtime import AsyncAgentWorker
+from llm_client import chat
+from routing import score_priority, raise_priority, route_features, local_route
+from overload import mode_level
+from prompt_compiler import PromptTemplate
+from verdict_cache import verdict_cache, fingerprint
+from user_history import UserHistory
+from speculation import SPECULATIVE_QUEUES
+from rules_cache import chat_rules
 
 logger = setup_logging("АГЕНТ 1")
 
-if MISTRAL_IMPORT_SUCCESS:
-    logger.info(f"✅ Mistral AI импортирован ({MISTRAL_IMPORT_VERSION})")
+if not ROUTER_LLM_ENABLED:
+    logger.info("✅ Маршрут выбирается локально, Mistral не вызывается (ROUTER_LLM=false)")
+elif MISTRAL_API_KEY:
+    logger.info("✅ Mistral AI доступен через общий клиент llm_client (эскалация спорных маршрутов)")
 else:
-    logger.error("❌ Mistral AI не импортирован")
+    logger.warning("⚠️ MISTRAL_API_KEY не установлен")
 
 # ============================================================================
-# ИНИЦИАЛИЗАЦИЯ MISTRAL
+# ФУНКЦИЯ КООРДИНАЦИИ (ЭСКАЛАЦИЯ В LLM)
 # ============================================================================
 
-if MISTRAL_IMPORT_SUCCESS and MISTRAL_API_KEY:
-    try:
-        mistral_client = MistralClient(api_key=MISTRAL_API_KEY)
-        logger.info("✅ Mistral AI клиент создан")
-    except Exception as e:
-        logger.error(f"❌ Ошибка создания Mistral AI клиента: {e}")
-        mistral_client = None
-else:
-    mistral_client = None
-    logger.warning("⚠️ Mistral AI клиент не создан")
+COORDINATOR_PROMPT = PromptTemplate(
+    "agent1",
+    """Telegram чат модератор. Выбери путь проверки сообщения:
+1. SIMPLE - быстрая проверка одним агентом
+2. COMPLEX - сразу глубокий AI анализ контекста
+3. BOTH - обе проверки
 
-# ============================================================================
-# ФУНКЦИЯ КООРДИНАЦИИ
-# ============================================================================
+Приоритет: HIGH/MEDIUM/LOW
+Уверенность: 0-100
 
-def coordinate_with_mistral(message: str, rules: List[str]) -> Dict[str, Any]:
+Ответь одной строкой: МАРШРУТ ПРИОРИТЕТ УВЕРЕННОСТЬ (например: BOTH MEDIUM 70)""",
+    message_template="Сообщение: '{message}'",
+    rules_title="Правила:"
+)
+
+# Ответ короткий: большой max_tokens не нужен
+COORDINATOR_PARAMS = {**MISTRAL_GENERATION_PARAMS, "max_tokens": ROUTER_LLM_MAX_TOKENS}
+
+PROMPT_VERSION = fingerprint(MISTRAL_MODEL, COORDINATOR_PROMPT.version, COORDINATOR_PARAMS)
+
+
+async def coordinate_with_mistral(message: str, rules: List[str]) -> Dict[str, Any]:
     """Координирует сообщение через Mistral"""
     
-    if not MISTRAL_IMPORT_SUCCESS or not mistral_client:
+    if not MISTRAL_API_KEY:
         logger.warning("⚠️ Mistral недоступен, используется fallback")
         return {
             "route": "BOTH",
             "priority": "MEDIUM",
             "strategy": "BOTH",
             "confidence": 0.5,
-            "reasoning": "Mistral недоступен"
+            "reasoning": "Mistral недоступен",
+            "fallback": True
         }
     
     try:
-        if not rules:
-            rules = DEFAULT_RULES
-        
-        rules_text = "\n".join([f"- {rule}" for rule in rules])
-        
-        system_message = f"""Telegram чат модератор. Правила:
-{rules_text}
-
-Определи:
-1. SIMPLE - 4 короткие проверки (эвристика)
-2. COMPLEX - 3 сложные проверки (AI анализ)
-3. BOTH - обе проверки
-
-Приоритет: HIGH/MEDIUM/LOW
-Уверенность: 0-100"""
-
-        user_message = f"Сообщение: '{message}'"
+        messages = COORDINATOR_PROMPT.messages(message, rules or DEFAULT_RULES)
         
-        messages = [
-            ChatMessage(role="system", content=system_message),
-            ChatMessage(role="user", content=user_message)
-        ]
-        
-        response = mistral_client.chat(
-            model=MISTRAL_MODEL,
-            messages=messages,
-            **MISTRAL_GENERATION_PARAMS
+        response = await chat(
+            "mistral", MISTRAL_MODEL, messages,
+            usage_key=COORDINATOR_PROMPT.name, **COORDINATOR_PARAMS
         )
         
-        content = response.choices[0].message.content.lower()
+        content = response.lower()
         
         # Определяем маршрут
         route = "BOTH"
@@ -152,86 +126,128 @@ def coordinate_with_mistral(message: str, rules: List[str]) -> Dict[str, Any]:
             "priority": "MEDIUM",
             "strategy": "BOTH",
             "confidence": 0.5,
-            "reasoning": f"Ошибка: {str(e)[:50]}"
+            "reasoning": f"Ошибка: {str(e)[:50]}",
+            "fallback": True
         }
 
 # ============================================================================
 # ОСНОВНОЙ WORKER
 # ============================================================================
 
-class Agent1Worker:
+class Agent1Worker(AsyncAgentWorker):
+    agent_id = 1
+    # Вход конвейера: сюда бот пишет каждое сообщение
+    input_queues = [QUEUE_AGENT_1_INPUT]
+    # SIMPLE и BOTH идут в Агента 2, COMPLEX - сразу в агентов 3 и 4 (см. route)
+    output_queues = [QUEUE_AGENT_2_INPUT]
+    llm_providers = ["mistral"] if ROUTER_LLM_ENABLED else []
+    per_chat_rules = ROUTER_LLM_ENABLED
+
     def __init__(self):
+        super().__init__(logger)
+        self.history = None
+
+    async def setup(self):
+        self.history = UserHistory(self.redis_client)
+
+    async def choose_route(self, input_data) -> Dict[str, Any]:
+        """Локальный маршрут; спорный - в Mistral, если эскалация включена"""
+        message = input_data.get("message", "")
+        
         try:
-            redis_config = get_redis_config()
-            self.redis_client = redis.Redis(**redis_config)
-            self.redis_client.ping()
-            logger.info("✅ Подключение к Redis успешно")
+            history = await self.history.get(input_data.get("chat_id"), input_data.get("user_id"))
         except Exception as e:
-            logger.error(f"❌ Не удалось подключиться к Redis: {e}")
-            raise
+            logger.warning(f"⚠️ История автора недоступна: {e}")
+            history = None
+        
+        features = route_features(message, input_data.get("lexicon_hits"), history)
+        decision = local_route(features)
+        
+        if ROUTER_LLM_ENABLED and decision["confidence"] < ROUTER_ESCALATE_BELOW:
+            # Правила чата нужны только координатору (из памяти процесса, см. rules_cache.py)
+            rules = await chat_rules.for_payload(input_data)
+            coord_result = await verdict_cache.cached(
+                "agent1", PROMPT_VERSION, message, rules,
+                lambda: coordinate_with_mistral(message, rules),
+                lambda result: not result.get("fallback")
+            )
+            if not coord_result.get("fallback"):
+                logger.info(f"🧭 Эскалация: {decision['route']} → {coord_result['route']} ({decision['reasoning']})")
+                # Приоритет координатора, но не ниже локальной оценки (угрозы не должны ждать из-за ошибки LLM)
+                decision = {**coord_result, "priority": raise_priority(coord_result["priority"], decision["priority"])}
+        
+        return decision
 
-    def send_to_agents(self, original_data):
-        """✅ ИСПРАВКА: ВСЕ сообщения → ТОЛЬКО в Агента 2"""
+    def build_agent_input(self, original_data, coord_result):
+        """Вход следующего этапа: маршрут едет дальше, Агент 2 по нему решает, нужны ли агенты 3 и 4"""
+        
+        priority = raise_priority(
+            coord_result.get("priority"),
+            score_priority(original_data.get("message", ""), original_data.get("lexicon_hits"))
+        )
         
         agent_input = {
             "message": original_data.get("message"),
-            "rules": original_data.get("rules", DEFAULT_RULES),
             "user_id": original_data.get("user_id"),
             "username": original_data.get("username"),
             "chat_id": original_data.get("chat_id"),
             "message_id": original_data.get("message_id"),
             "message_link": original_data.get("message_link", ""),
-            "media_type": original_data.get("media_type", "")
+            "media_type": original_data.get("media_type", ""),
+            "priority": priority,
+            "route": coord_result.get("route", "BOTH"),
+            # Возраст сообщения в следующей очереди (queue_transport.payload_age, контроль перегрузки)
+            "timestamp": datetime.now().isoformat()
         }
+        if original_data.get("rules"):
+            # Правила едут дальше, только если их передал вызывающий; иначе агенты берут правила чата сами
+            agent_input["rules"] = original_data["rules"]
+        if original_data.get("lexicon_hits"):
+            agent_input["lexicon_hits"] = original_data["lexicon_hits"]
+        if SPECULATIVE_ENABLED and agent_input["route"] == "BOTH":
+            # Полный путь веером: агенты 2, 3 и 4 начинают одновременно
+            agent_input["speculative"] = True
+        return agent_input
+
+    async def process(self, input_data):
+        coord_result = await self.choose_route(input_data)
+        output = self.build_agent_input(input_data, coord_result)
+        mode = await self.overload.get()
+        if mode != "normal":
+            output["overload_mode"] = mode
+        if mode_level(mode) >= mode_level("skip_3_4") and output.pop("speculative", None):
+            # Веер - лишние вызовы LLM: при перегрузке только путь через Агента 2
+            logger.info(f"🚦 Перегрузка ({mode}): спекулятивный веер отменён")
         
-        agent_input_json = json.dumps(agent_input, ensure_ascii=False)
-        
-        # ✅ ИСПРАВКА: ТОЛЬКО в Агента 2 (вместо 3 и 4)
-        self.redis_client.rpush(QUEUE_AGENT_2_INPUT, agent_input_json)
-        logger.info(f"📤 Сообщение отправлено В АГЕНТА 2")
+        logger.info(
+            f"🧭 Маршрут {output['route']} (приоритет {output['priority']}, "
+            f"уверенность {coord_result.get('confidence', 0):.0%}): {coord_result.get('reasoning', '')[:80]}"
+        )
+        return output
+
+    def route(self, payload, output):
+        if mode_level(output.get("overload_mode", "normal")) >= mode_level("skip_3_4"):
+            # Перегрузка: агенты 3 и 4 пропускаются, Агент 5 решит по мнению Агента 2
+            logger.info(f"📤 Перегрузка ({output['overload_mode']}): маршрут {output['route']} → только Агент 2")
+            return self.output_queues
+        if output["route"] == "COMPLEX":
+            return [QUEUE_AGENT_3_INPUT, QUEUE_AGENT_4_INPUT]
+        if output.get("speculative"):
+            return SPECULATIVE_QUEUES
+        return self.output_queues
 
     def run(self):
         """Главный цикл"""
         logger.info("="*80)
-        logger.info("✅ АГЕНТ 1 ЗАПУЩЕН (Координатор v1.8)")
-        logger.info(f"📊 Модель: {MISTRAL_MODEL}")
-        logger.info(f"📥 Импорт: {MISTRAL_IMPORT_VERSION}")
-        logger.info(f"🔔 Очередь входа: {QUEUE_AGENT_1_OUTPUT}")
-        logger.info(f"📤 Отправляю ТОЛЬКО в: {QUEUE_AGENT_2_INPUT}")
+        logger.info("✅ АГЕНТ 1 ЗАПУЩЕН (Маршрутизатор v1.9)")
+        logger.info(f"📊 Эскалация в LLM: {MISTRAL_MODEL if ROUTER_LLM_ENABLED else 'выключена'}")
+        logger.info(f"🔔 Очередь входа: {QUEUE_AGENT_1_INPUT}")
+        logger.info(f"📤 SIMPLE/BOTH → {QUEUE_AGENT_2_INPUT}, COMPLEX → {QUEUE_AGENT_3_INPUT}, {QUEUE_AGENT_4_INPUT}")
         logger.info("⏱️  Нажмите Ctrl+C для остановки")
         logger.info("="*80 + "\n")
         
         try:
-            while True:
-                try:
-                    result = self.redis_client.blpop(QUEUE_AGENT_1_OUTPUT, timeout=1)
-                    
-                    if result is None:
-                        continue
-                    
-                    queue_name, message_data = result
-                    
-                    try:
-                        input_data = json.loads(message_data)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"❌ Невалидный JSON: {e}")
-                        continue
-                    
-                    logger.info(f"📨 Получено сообщение")
-                    
-                    # Координируем через Mistral
-                    message = input_data.get("message", "")
-                    rules = input_data.get("rules", DEFAULT_RULES)
-                    coord_result = coordinate_with_mistral(message, rules)
-                    
-                    # Отправляем в Агента 2
-                    self.send_to_agents(input_data)
-                    logger.info(f"✅ Маршрутизация завершена\n")
-                    
-                except Exception as e:
-                    logger.error(f"❌ Ошибка в цикле: {e}")
-                    time.sleep(1)
-        
+            super().run()
         except KeyboardInterrupt:
             logger.info("\n🛑 Агент 1 остановлен (Ctrl+C)")
         finally:
@@ -244,7 +260,7 @@ class Agent1Worker:
 app = FastAPI(
     title="🤖 Агент №1 - Координатор",
     description="Координирует многоагентную систему модерации",
-    version="1.8"
+    version="1.9"
 )
 
 app.add_middleware(
@@ -262,9 +278,9 @@ async def health_check():
         "status": "online",
         "agent_id": 1,
         "name": "Агент 1 (Координатор)",
-        "version": "1.8",
-        "ai_provider": f"Mistral AI ({MISTRAL_MODEL})" if mistral_client else "Mistral AI (недоступен)",
-        "import_version": MISTRAL_IMPORT_VERSION,
+        "version": "1.9",
+        "router": "local + LLM" if ROUTER_LLM_ENABLED else "local",
+        "ai_provider": f"Mistral AI ({MISTRAL_MODEL})" if MISTRAL_API_KEY else "Mistral AI (недоступен)",
         "timestamp": datetime.now().isoformat()
     }
 
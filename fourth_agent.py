@@ -9,7 +9,7 @@
 ================================================
 
 Роль: Анализирует сообщения с помощью DeepSeek ИИ-модели
-- Использует AI для определения нарушений правил (DEFAULT_RULES и другие)
+- Использует AI для определения нарушений правил чата (rules_cache.py; нет своих - DEFAULT_RULES)
 - Возвращает оценку серьезности и рекомендуемое действие
 - Заменяет старый алгоритм обнаружения плохих слов на интеллектуальный анализ
 
@@ -17,30 +17,30 @@
 
 """
 
-import json
-import redis
-import time
 from typing import Dict, Any, List
 from datetime import datetime
-import requests
 
 from config import (
-    get_redis_config,
     QUEUE_AGENT_4_INPUT,
     QUEUE_AGENT_5_INPUT,
     DEFAULT_RULES,
     setup_logging,
     determine_action,
-    DEEPSEEK_TOKEN,
 )
+from agent_runtime import AsyncAgentWorker
+from llm_client import chat_json, LLMError
+from verdict_parser import extract_object, to_verdict
+from verdict_cache import verdict_cache, fingerprint
+from metrics import metrics
+from prompt_compiler import PromptTemplate
+from token_budget import analyze_chunked
+from rules_cache import chat_rules
 
 
 logger = setup_logging("АГЕНТ 4")
 
-# Конфигурация DeepSeek
-DEEPSEEK_API_URL = "https://api.deepseek.com/chat/completions"
+# Конфигурация DeepSeek (URL и ключ - в LLM_PROVIDERS, config.py)
 DEEPSEEK_MODEL = "deepseek-chat"
-DEEPSEEK_API_KEY = DEEPSEEK_TOKEN  # Замените на реальный ключ
 
 
 # ============================================================================
@@ -49,20 +49,13 @@ DEEPSEEK_API_KEY = DEEPSEEK_TOKEN  # Замените на реальный кл
 
 # ============================================================================
 
-def build_moderation_prompt(message: str, rules: str) -> str:
-    """
-    Строит промпт для DeepSeek для анализа нарушений правил
-    """
-    prompt = f"""Ты модератор контента. Проанализируй следующее сообщение на предмет нарушений правил сообщества.
+# Инструкции и правила - стабильный префикс (system), сообщение - последним (user)
+MODERATION_PROMPT = PromptTemplate("agent4", """Ты помощник по модерации контента. Анализируй сообщения на основе правил и возвращай результаты в JSON формате.
 
-ПРАВИЛА СООБЩЕСТВА:
-{rules}
-
-СООБЩЕНИЕ ДЛЯ АНАЛИЗА:
-"{message}"
+Проанализируй сообщение пользователя на предмет нарушений правил сообщества (они ниже).
 
 Дай ответ в формате JSON со следующей структурой:
-{{
+{
     "is_violation": true/false,
     "type": "спам|оскорбления|hate_speech|nsfw|мошенничество|none",
     "severity": число от 0 до 10,
@@ -70,11 +63,14 @@ def build_moderation_prompt(message: str, rules: str) -> str:
     "action": "none|warn|mute|ban",
     "explanation": "краткое объяснение решения",
     "violated_rules": ["правило1", "правило2"]
-}}
+}
 
-Будь точен и объективен. Вернул ТОЛЬКО JSON без дополнительного текста."""
-    
-    return prompt
+Будь точен и объективен. Верни ТОЛЬКО JSON без дополнительного текста.""",
+    message_template='СООБЩЕНИЕ ДЛЯ АНАЛИЗА:\n"{message}"',
+    rules_title="ПРАВИЛА СООБЩЕСТВА:")
+
+# Смена модели или промпта - новая версия ключей кэша вердиктов
+PROMPT_VERSION = fingerprint(DEEPSEEK_MODEL, MODERATION_PROMPT.version)
 
 
 # ============================================================================
@@ -83,56 +79,45 @@ def build_moderation_prompt(message: str, rules: str) -> str:
 
 # ============================================================================
 
-def call_deepseek_api(message: str, rules: str) -> Dict[str, Any]:
+def parse_analysis(content: str) -> Dict[str, Any]:
+    """
+    Ответ без поля type не считается валидным - тогда побеждает второй запрос (хедж).
+    Типы приводятся к формату агента: severity 0-10, confidence 0-100, известное действие
+    """
+    data = extract_object(content)
+    if "type" not in data:
+        raise ValueError("нет поля type")
+    violated_rules = data.get("violated_rules")
+    return {
+        **to_verdict(data).as_dict(),
+        "violated_rules": violated_rules if isinstance(violated_rules, list) else [],
+    }
+
+
+async def call_deepseek_api(message: str, rules: List[str]) -> Dict[str, Any]:
     """
     Отправляет запрос к DeepSeek API и получает анализ сообщения
     """
     try:
-        prompt = build_moderation_prompt(message, rules)
-        
-        payload = {
-            "model": DEEPSEEK_MODEL,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "Ты помощник по модерации контента. Анализируй сообщения на основе правил и возвращай результаты в JSON формате."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.3,  # Низкая температура для более консистентных результатов
-            "max_tokens": 500
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-            "Content-Type": "application/json"
-        }
+        messages = MODERATION_PROMPT.messages(message, rules)
         
         logger.info("🤖 Отправляю запрос к DeepSeek...")
-        response = requests.post(DEEPSEEK_API_URL, json=payload, headers=headers, timeout=10)
-        
-        if response.status_code != 200:
-            logger.error(f"❌ DeepSeek API ошибка: {response.status_code}")
-            raise Exception(f"API error: {response.status_code}")
-        
-        response_data = response.json()
-        ai_response = response_data["choices"][0]["message"]["content"]
-        
-        # Парсим JSON из ответа
-        try:
-            analysis = json.loads(ai_response)
-            logger.info(f"✅ Получен анализ от DeepSeek: {analysis['type']}")
-            return analysis
-        except json.JSONDecodeError:
-            logger.error(f"❌ Не удалось распарсить JSON из ответа DeepSeek: {ai_response}")
-            raise Exception("Failed to parse AI response as JSON")
+        # Первый валидный JSON: от DeepSeek или от хеджа, если DeepSeek задерживается (llm_client.chat_json)
+        analysis = await chat_json(
+            "deepseek",
+            DEEPSEEK_MODEL,
+            messages,
+            temperature=0.3,  # Низкая температура для более консистентных результатов
+            max_tokens=500,
+            usage_key=MODERATION_PROMPT.name,
+            parse=parse_analysis
+        )
+        logger.info(f"✅ Получен анализ от DeepSeek: {analysis['type']}")
+        return analysis
             
-    except requests.exceptions.Timeout:
-        logger.error("❌ Timeout при обращении к DeepSeek API")
-        raise Exception("API timeout")
+    except LLMError as e:
+        logger.error(f"❌ DeepSeek API ошибка: {e}")
+        raise
     except Exception as e:
         logger.error(f"❌ Ошибка при вызове DeepSeek: {e}")
         raise
@@ -144,15 +129,19 @@ def call_deepseek_api(message: str, rules: str) -> Dict[str, Any]:
 
 # ============================================================================
 
-def apply_ai_moderation(message: str, rules: str) -> Dict[str, Any]:
+async def apply_ai_moderation(message: str, rules: List[str]) -> Dict[str, Any]:
     """
     Применяет ИИ-модель DeepSeek для анализа нарушений правил.
     
     Заменяет старый алгоритм обнаружения плохих слов на интеллектуальный анализ.
     """
     try:
-        # Вызываем DeepSeek API
-        ai_analysis = call_deepseek_api(message, rules)
+        # Вызываем DeepSeek API (одинаковый текст при тех же правилах - из кэша, длинный - по кускам)
+        ai_analysis = await verdict_cache.cached(
+            "agent4", PROMPT_VERSION, message, rules,
+            lambda: analyze_chunked("agent4", message, lambda text: call_deepseek_api(text, rules)),
+            lambda result: not result.get("partial")
+        )
         
         # Извлекаем данные из анализа
         is_violation = ai_analysis.get("is_violation", False)
@@ -222,9 +211,9 @@ def apply_ai_moderation(message: str, rules: str) -> Dict[str, Any]:
 
 # ============================================================================
 
-def moderation_agent_4(message: str, user_id: int = None, username: str = "unknown",
+async def moderation_agent_4(message: str, user_id: int = None, username: str = "unknown",
                        chat_id: int = None, message_id: int = None, 
-                       message_link: str = "") -> Dict[str, Any]:
+                       message_link: str = "", rules: List[str] = None) -> Dict[str, Any]:
     """
     АГЕНТ 4 — Модератор на основе DeepSeek ИИ
     
@@ -233,11 +222,8 @@ def moderation_agent_4(message: str, user_id: int = None, username: str = "unkno
     
     logger.info(f"📋 ИИ анализ от @{username}: '{message[:50]}...'")
     
-    # Формируем правила в строковый формат
-    rules_text = "\n".join([f"- {rule}" for rule in DEFAULT_RULES])
-    
-    # Применяем ИИ анализ
-    ai_result = apply_ai_moderation(message, rules_text)
+    # Применяем ИИ анализ по правилам чата (блок правил собирается компилятором промптов один раз на набор)
+    ai_result = await apply_ai_moderation(message, rules or DEFAULT_RULES)
     
     # Формируем выход
     output = {
@@ -276,22 +262,21 @@ def moderation_agent_4(message: str, user_id: int = None, username: str = "unkno
 
 # ============================================================================
 
-class Agent4Worker:
+class Agent4Worker(AsyncAgentWorker):
+    agent_id = 4
+    input_queues = [QUEUE_AGENT_4_INPUT]
+    output_queues = [QUEUE_AGENT_5_INPUT]
+    llm_providers = ["deepseek"]
+    # Спекулятивный веер: Агент 5 может решить без нас и отменить вызов
+    cancellable = True
+    per_chat_rules = True
+    
     def __init__(self):
-        try:
-            redis_config = get_redis_config()
-            self.redis_client = redis.Redis(**redis_config)
-            self.redis_client.ping()
-            logger.info("✅ Подключение к Redis успешно")
-        except Exception as e:
-            logger.error(f"❌ Не удалось подключиться к Redis: {e}")
-            raise
+        super().__init__(logger)
     
-    def process_message(self, message_data: str) -> Dict[str, Any]:
+    async def process_message(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Обрабатывает данные о сообщении"""
         try:
-            data = json.loads(message_data)
-            
             # Извлекаем необходимые данные
             message = data.get("message", "")
             user_id = data.get("user_id")
@@ -301,34 +286,37 @@ class Agent4Worker:
             message_link = data.get("message_link", "")
             
             # Вызываем основную функцию
-            result = moderation_agent_4(
+            result = await moderation_agent_4(
                 message=message,
                 user_id=user_id,
                 username=username,
                 chat_id=chat_id,
                 message_id=message_id,
-                message_link=message_link
+                message_link=message_link,
+                rules=await chat_rules.for_payload(data)
             )
+            result["priority"] = data.get("priority")
+            result["route"] = data.get("route")
             
             return result
             
-        except json.JSONDecodeError as e:
-            logger.error(f"❌ Невалидный JSON: {e}")
-            return {"agent_id": 4, "status": "json_error", "error": str(e)}
         except Exception as e:
             logger.error(f"❌ Ошибка обработки: {e}")
             return {"agent_id": 4, "status": "error", "error": str(e)}
     
-    def send_result(self, result: Dict[str, Any]) -> bool:
-        """Отправляет результат в Агента 5"""
-        try:
-            result_json = json.dumps(result, ensure_ascii=False)
-            self.redis_client.rpush(QUEUE_AGENT_5_INPUT, result_json)
-            logger.info("📤 Результат отправлен в Агента 5")
-            return True
-        except Exception as e:
-            logger.error(f"❌ Ошибка отправки: {e}")
-            return False
+    async def process(self, input_data):
+        output = await self.speculation.run(input_data, lambda: self.process_message(input_data))
+        if output is None:
+            logger.info("🏁 Решение уже принято без Агента 4, вызов отменён")
+            metrics.count("speculation", "cancelled")
+            return None
+        if input_data.get("speculative"):
+            metrics.count("speculation", "completed")
+        if output.get("status") == "error":
+            return None
+        
+        logger.info("📤 Результат отправлен в Агента 5")
+        return output
     
     def run(self):
         """Главный цикл"""
@@ -337,26 +325,7 @@ class Agent4Worker:
         logger.info(" Нажмите Ctrl+C для остановки\n")
         
         try:
-            while True:
-                try:
-                    result = self.redis_client.blpop(QUEUE_AGENT_4_INPUT, timeout=1)
-                    if result is None:
-                        continue
-                    
-                    queue_name, message_data = result
-                    logger.info("📨 Получено сообщение для анализа")
-                    
-                    output = self.process_message(message_data)
-                    
-                    if output.get("status") != "error":
-                        self.send_result(output)
-                    
-                    logger.info("✅ ИИ анализ завершен\n")
-                    
-                except Exception as e:
-                    logger.error(f"❌ Ошибка в цикле: {e}")
-                    time.sleep(1)
-                    
+            super().run()
         except KeyboardInterrupt:
             logger.info("\n❌ Агент 4 остановлен (Ctrl+C)")
 
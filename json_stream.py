@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🌊 ПОТОКОВЫЙ РАЗБОР JSON
+✅ Ответ модели приходит кусками (SSE) - поля верхнего уровня отдаются, как только значение дописано
+✅ Объект: ("ключ", значение) по мере готовности; массив: (номер, элемент) - например вердикты пакета
+✅ Текст до первой { или [ пропускается (модель иногда пишет вступление)
+✅ Битый JSON не роняет разбор: поля просто перестают приходить, ответ целиком разбирается в конце
+"""
+
+import json
+from typing import Any, List, Tuple
+
+_WHITESPACE = " \t\r\n"
+
+# strict=False: модели пишут переводы строк прямо внутри строк
+_decoder = json.JSONDecoder(strict=False)
+
+
+class JSONStreamScanner:
+    """feed(кусок) -> список готовых (ключ или номер, значение) верхнего уровня"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.container = None
+        self.index = 0
+        self.done = False
+
+    def _skip(self, pos: int, chars: str = _WHITESPACE) -> int:
+        while pos < len(self.buffer) and self.buffer[pos] in chars:
+            pos += 1
+        return pos
+
+    def feed(self, text: str) -> List[Tuple[Any, Any]]:
+        self.buffer += text
+        ready = []
+        if self.done:
+            return ready
+
+        if self.container is None:
+            starts = [pos for pos in (self.buffer.find("{", self.pos), self.buffer.find("[", self.pos)) if pos >= 0]
+            if not starts:
+                self.pos = len(self.buffer)
+                return ready
+            self.pos = min(starts)
+            self.container = self.buffer[self.pos]
+            self.pos += 1
+
+        while True:
+            pos = self._skip(self.pos, _WHITESPACE + ",")
+            if pos >= len(self.buffer):
+                break
+            if self.buffer[pos] in "}]":
+                self.done = True
+                break
+
+            try:
+                if self.container == "{":
+                    key, pos = _decoder.raw_decode(self.buffer, pos)
+                    pos = self._skip(pos)
+                    if pos >= len(self.buffer):
+                        break
+                    if not isinstance(key, str) or self.buffer[pos] != ":":
+                        self.done = True
+                        break
+                    pos = self._skip(pos + 1)
+                    if pos >= len(self.buffer):
+                        break
+                else:
+                    key = self.index
+                value, end = _decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                # Значение ещё не дописано (или JSON битый - тогда дождёмся конца ответа)
+                break
+
+            # Число или литерал у самого конца могут продолжиться в следующем куске
+            if end >= len(self.buffer):
+                break
+            ready.append((key, value))
+            self.pos = end
+            if self.container == "[":
+                self.index += 1
+
+        return ready
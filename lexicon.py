@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🔤 СЛОВАРНЫЙ ФИЛЬТР (TIER-0)
+✅ Мат, оскорбления, дискриминация, угрозы, спам и слова чата - в одном автомате Ахо-Корасик
+✅ Один проход по тексту, без LLM: микросекунды на сообщение
+✅ Разметка терминов: "слово" - целое слово, "осно*" - начало слова (основа), "*корень*" - где угодно в слове
+✅ Нормализация против обхода: ё→е, латиница и цифры в русских словах (x→х, 0→о), растянутые буквы
+✅ Однозначные совпадения решаются сразу (LEXICON_CATEGORIES), спорный текст идёт в LLM
+✅ Свои слова чата - Redis-множество lexicon:chat:{chat_id}, команда /lexicon в боте
+"""
+
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional, Iterable, Tuple, NamedTuple
+
+from config import (
+    LEXICON_CATEGORIES,
+    LEXICON_LOCAL_CONFIDENCE,
+    LEXICON_CHAT_TTL,
+    determine_action,
+)
+
+# ============================================================================
+# СЛОВАРИ
+# ============================================================================
+
+BASE_TERMS = {
+    # Угрозы и насилие - всегда спорно (контекст), но срочно
+    "threat": [
+        "убью", "убить", "убей", "зарежу", "застрелю", "взорв*", "бомб*", "теракт*",
+        "сдохни", "сдохнешь", "kill", "bomb*", "shoot*",
+    ],
+    # Мат: корни часто внутри слова, но короткие корни - только с начала слова
+    # ("бля" есть в "корабля", "хуе" - в "страхуется", "ебан" - в "колебания")
+    "profanity": [
+        "*хуй*", "хуе*", "хуя*", "хуи", "*пизд*", "бля", "бляд*", "блять",
+        "еба*", "ебу*", "ебл*", "выеб*", "заеб*", "наеб*", "уеб*", "поеб*", "доеб*", "съеб*", "отъеб*",
+        "сука", "суки", "сучк*", "fuck*", "shit*",
+    ],
+    "insult": [
+        "мудак*", "мудил*", "долбоеб*", "долбаеб*", "идиот*", "дебил*", "урод*", "тупой", "тупая",
+        "даун*", "чмо", "лох", "лохи",
+    ],
+    "discrimination": [
+        "пидор*", "пидар*", "педик*", "чурк*", "хачик*", "жидов*", "нигер*", "ниггер*",
+    ],
+    # Спам: сами по себе слова безобидны - однозначно только вместе со ссылкой
+    "spam": [
+        "заработ*", "казино", "ставки", "ставок", "крипт*", "инвестиц*", "промокод*",
+        "без вложений", "пассивный доход", "пиши в лич*", "пишите в лич*",
+    ],
+}
+
+LINK_RE = re.compile(r"(https?://|t\.me/|www\.)", re.IGNORECASE)
+
+# ============================================================================
+# НОРМАЛИЗАЦИЯ
+# ============================================================================
+
+# Латиница и цифры, которыми подменяют русские буквы (только в словах, где уже есть кириллица)
+_HOMOGLYPHS = str.maketrans({
+    "a": "а", "e": "е", "o": "о", "p": "р", "c": "с", "x": "х", "y": "у", "k": "к",
+    "m": "м", "t": "т", "h": "н", "b": "в", "u": "и", "0": "о", "3": "з", "4": "ч", "6": "б",
+})
+_WORD_RE = re.compile(r"\w+")
+_CYRILLIC_RE = re.compile(r"[а-я]")
+_STRETCH_RE = re.compile(r"(\w)\1{2,}")
+
+
+def _fix_word(match: re.Match) -> str:
+    word = match.group(0)
+    return word.translate(_HOMOGLYPHS) if _CYRILLIC_RE.search(word) else word
+
+
+def normalize(text: str) -> str:
+    """Длина может измениться - совпадения ищутся и проверяются на нормализованном тексте"""
+    text = (text or "").lower().replace("ё", "е")
+    text = _STRETCH_RE.sub(r"\1", text)
+    return _WORD_RE.sub(_fix_word, text)
+
+# ============================================================================
+# АВТОМАТ АХО-КОРАСИК
+# ============================================================================
+
+
+class Automaton:
+    """Все шаблоны за один проход по тексту: переходы - словари, выходы собраны по суффиксным ссылкам"""
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Tuple[int, Any]]] = [[]]
+
+        for pattern, payload in patterns:
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = next_state
+            self.out[state].append((len(pattern), payload))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.out[next_state] = self.out[next_state] + self.out[self.fail[next_state]]
+
+    def search(self, text: str):
+        """(начало, конец, payload) каждого вхождения"""
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, payload in self.out[state]:
+                yield index - length + 1, index + 1, payload
+
+# ============================================================================
+# СЛОВАРЬ
+# ============================================================================
+
+
+class LexiconHit(NamedTuple):
+    category: str
+    term: str
+
+
+def parse_term(term: str) -> Tuple[str, str]:
+    """Разметка -> (нормализованный текст, режим: word/prefix/sub)"""
+    term = term.strip()
+    if term.startswith("*") and term.endswith("*") and len(term) > 2:
+        return normalize(term[1:-1]), "sub"
+    if term.endswith("*"):
+        return normalize(term[:-1]), "prefix"
+    return normalize(term), "word"
+
+
+def _is_boundary(text: str, index: int) -> bool:
+    return index <= 0 or index >= len(text) or not text[index].isalnum()
+
+
+class Lexicon:
+    """Скомпилированный словарь: {категория: [термины с разметкой]}"""
+
+    def __init__(self, terms: Dict[str, List[str]]):
+        patterns = []
+        for category, category_terms in terms.items():
+            for term in category_terms:
+                pattern, mode = parse_term(term)
+                if pattern:
+                    patterns.append((pattern, (category, term, mode)))
+        self.automaton = Automaton(patterns)
+
+    def match(self, text: str) -> List[LexiconHit]:
+        normalized = normalize(text)
+        hits = []
+        seen = set()
+        for start, end, (category, term, mode) in self.automaton.search(normalized):
+            if mode != "sub" and not _is_boundary(normalized, start - 1):
+                continue
+            if mode == "word" and not _is_boundary(normalized, end):
+                continue
+            if (category, term) not in seen:
+                seen.add((category, term))
+                hits.append(LexiconHit(category, term))
+        return hits
+
+    def categories(self, text: str) -> Dict[str, List[str]]:
+        found: Dict[str, List[str]] = {}
+        for hit in self.match(text):
+            found.setdefault(hit.category, []).append(hit.term)
+        return found
+
+
+base_lexicon = Lexicon(BASE_TERMS)
+
+# ============================================================================
+# РЕШЕНИЕ ПО СОВПАДЕНИЯМ
+# ============================================================================
+
+
+def category_settings(category: str) -> Dict[str, Any]:
+    return LEXICON_CATEGORIES.get(category, LEXICON_CATEGORIES["custom"])
+
+
+def is_decisive(category: str, text: str) -> bool:
+    """Однозначно ли совпадение категории в этом тексте"""
+    settings = category_settings(category)
+    if not settings.get("local"):
+        return False
+    return not settings.get("requires_link") or bool(LINK_RE.search(text or ""))
+
+
+def lexicon_verdict(text: str, found: Dict[str, List[str]], decisive_only: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Вердикт в формате Агента 2 по совпадениям (categories()).
+    decisive_only - только однозначные случаи: если есть спорная категория серьёзнее (угроза) - решает LLM
+    """
+    if not found:
+        return None
+
+    ranked = sorted(found, key=lambda category: category_settings(category)["severity"], reverse=True)
+    if decisive_only:
+        top = ranked[0]
+        if not is_decisive(top, text):
+            return None
+    else:
+        # Без LLM (перегрузка): спам без ссылки не считаем нарушением
+        ranked = [category for category in ranked if not category_settings(category).get("requires_link") or is_decisive(category, text)]
+        if not ranked:
+            return None
+        top = ranked[0]
+
+    settings = category_settings(top)
+    confidence = LEXICON_LOCAL_CONFIDENCE if decisive_only else 60
+    action = determine_action(settings["type"], settings["severity"], confidence / 100)
+    return {
+        "is_violation": True,
+        "type": settings["type"],
+        "severity": settings["severity"],
+        "confidence": confidence,
+        "action": action["action"],
+        "reason": f"Словарь: {settings['type']} ({', '.join(found[top][:3])})",
+        "explanation": "Решение словарного фильтра без LLM",
+        "category": top,
+    }
+
+# ============================================================================
+# СЛОВА ЧАТОВ
+# ============================================================================
+
+# Для режима memory (без Redis): {chat_id: set(термины)}
+_local_terms: Dict[str, set] = {}
+
+
+def terms_key(chat_id) -> str:
+    return f"lexicon:chat:{chat_id}"
+
+
+class ChatLexicons:
+    """
+    Словарь чата = базовый + свои слова чата (категория custom).
+    Скомпилированные автоматы кэшируются по набору слов, сами слова перечитываются раз в LEXICON_CHAT_TTL
+    """
+
+    def __init__(self, redis_client, cache_size: int = 256):
+        self.redis_client = redis_client
+        self.cache_size = cache_size
+        self._terms: Dict[str, Tuple[float, Tuple[str, ...]]] = {}
+        self._compiled: "OrderedDict[Tuple[str, ...], Lexicon]" = OrderedDict()
+
+    async def terms(self, chat_id) -> Tuple[str, ...]:
+        key = str(chat_id)
+        cached = self._terms.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        if self.redis_client is None:
+            terms = _local_terms.get(key, set())
+        else:
+            terms = await self.redis_client.smembers(terms_key(chat_id))
+        terms = tuple(sorted(terms))
+        self._terms[key] = (time.monotonic() + LEXICON_CHAT_TTL, terms)
+        return terms
+
+    async def get(self, chat_id) -> Lexicon:
+        terms = await self.terms(chat_id)
+        if not terms:
+            return base_lexicon
+
+        lexicon = self._compiled.get(terms)
+        if lexicon is None:
+            lexicon = Lexicon({**BASE_TERMS, "custom": list(terms)})
+            self._compiled[terms] = lexicon
+            while len(self._compiled) > self.cache_size:
+                self._compiled.popitem(last=False)
+        else:
+            self._compiled.move_to_end(terms)
+        return lexicon
+
+    async def update(self, chat_id, add: Iterable[str] = (), remove: Iterable[str] = ()):
+        add = [term.strip().lower() for term in add if term.strip()]
+        remove = [term.strip().lower() for term in remove if term.strip()]
+        if self.redis_client is None:
+            terms = _local_terms.setdefault(str(chat_id), set())
+            terms.update(add)
+            terms.difference_update(remove)
+        else:
+            if add:
+                await self.redis_client.sadd(terms_key(chat_id), *add)
+            if remove:
+                await self.redis_client.srem(terms_key(chat_id), *remove)
+        self._terms.pop(str(chat_id), None)
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🌐 ОБЩИЙ АСИНХРОННЫЙ КЛИЕНТ LLM (MISTRAL, DEEPSEEK, OPENAI)
+✅ Один пул keep-alive соединений на провайдера (без DNS/TCP/TLS на каждый вызов)
+✅ HTTP/2 по желанию (LLM_HTTP2=true и установлен h2)
+✅ Прогрев соединений при старте агента
+✅ Единая точка входа: await chat(provider, model, messages, **params)
+✅ Учёт входных токенов и токенов из кэша промптов провайдера (usage_key - обычно имя шаблона промпта)
+✅ Автомат защиты на провайдера (circuit_breaker.py): при открытом - сразу LLMError, агент берёт fallback
+✅ Повторы 429/5xx/сетевых ошибок с экспоненциальной паузой, Retry-After и общим бюджетом повторов
+✅ Общий для всех процессов лимит запросов и токенов провайдера (rate_limiter.py) - перед каждой попыткой
+✅ Потоковые ответы (SSE): await chat_stream(...) отдаёт поля JSON по мере готовности, агент решает
+   по первым полям, остаток ответа дочитывается в фоне (on_complete) или обрывается
+✅ Хеджирование: await chat_json(...) - если провайдер не ответил за свой p90, тот же запрос уходит
+   запасному (LLM_HEDGE_TARGETS), берётся первый валидный JSON, проигравший отменяется
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
+
+import httpx
+
+from config import (
+    LLM_PROVIDERS,
+    LLM_POOL_LIMITS,
+    LLM_HTTP2,
+    LLM_STREAMING_ENABLED,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_BUDGET,
+    LLM_HEDGE_BURST,
+    LLM_HEDGE_PERCENTILE,
+    LLM_HEDGE_WINDOW,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_HEDGE_TARGETS,
+    LLM_BREAKER_MODELS,
+    LLM_RETRY_MAX_DELAY,
+    RETRY_ATTEMPTS,
+    RETRY_DELAY,
+    setup_logging,
+)
+from circuit_breaker import CLOSED, CircuitBreaker, RetryBudget, backoff_delay, parse_retry_after
+from rate_limiter import rate_limiter
+from json_stream import JSONStreamScanner
+from verdict_parser import extract_object, json_mode_params, parse_counted
+from metrics import metrics
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = setup_logging("LLM CLIENT")
+
+
+# Повторяем только то, что может пройти со второй попытки
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Грубая оценка для русского текста: токен ≈ 3 символа
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text or "") // CHARS_PER_TOKEN)
+
+
+def estimate_request_tokens(messages: List[Dict[str, Any]], max_tokens: Optional[int]) -> int:
+    """Входные токены (текстовые части сообщений) + весь запрошенный ответ - для лимита TPM"""
+    text = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            text.extend(part.get("text", "") for part in content if isinstance(part, dict))
+        else:
+            text.append(content or "")
+    return estimate_tokens("".join(text)) + (max_tokens or 0)
+
+
+class LLMError(Exception):
+    """Ошибка вызова провайдера (HTTP статус, таймаут, пустой ответ)"""
+
+    def __init__(self, provider: str, message: str, status: Optional[int] = None,
+                 retry_after: Optional[float] = None, retryable: bool = False):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status = status
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+
+class CircuitOpenError(LLMError):
+    """Автомат провайдера открыт - вызов не отправлялся"""
+
+
+class RateLimitError(LLMError):
+    """Общий лимит провайдера исчерпан дольше, чем на LLM_RATE_MAX_WAIT - вызов не отправлялся"""
+
+
+class LLMClient:
+    """Пул httpx.AsyncClient по провайдерам. Создаётся лениво внутри event loop"""
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        # {usage_key: {"calls", "prompt_tokens", "cached_tokens", "completion_tokens"}}
+        self.usage: Dict[str, Dict[str, int]] = {}
+        # Недавние задержки успешных ответов: {(provider, model): deque секунд}
+        self.latencies: Dict[Tuple[str, str], deque] = {}
+        # Бюджет хеджей: каждый chat_json добавляет LLM_HEDGE_BUDGET, хедж тратит 1
+        self.hedge_tokens = 0.0
+        # {provider: {"calls", "hedged", "hedge_wins", "primary_wins"}}
+        self.hedge_stats: Dict[str, Dict[str, int]] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.retry_budget = RetryBudget()
+        # Дочитывание потоков после раннего решения (держим ссылки, чтобы задачи не собрал GC)
+        self._background = set()
+
+    def _get_client(self, provider: str) -> httpx.AsyncClient:
+        client = self._clients.get(provider)
+        if client is None or client.is_closed:
+            settings = LLM_PROVIDERS[provider]
+            client = httpx.AsyncClient(
+                http2=LLM_HTTP2 and HTTP2_AVAILABLE,
+                limits=httpx.Limits(**LLM_POOL_LIMITS),
+                timeout=httpx.Timeout(settings["timeout"], connect=5),
+                headers={
+                    "Authorization": f"Bearer {settings['api_key']}",
+                    "Content-Type": "application/json"
+                }
+            )
+            self._clients[provider] = client
+        return client
+
+    async def warmup(self, providers: List[str]):
+        """Открывает соединения заранее, чтобы первый вызов не платил за TLS-рукопожатие"""
+        if LLM_HTTP2 and not HTTP2_AVAILABLE:
+            logger.warning("⚠️ LLM_HTTP2 включён, но пакет h2 не установлен - используется HTTP/1.1")
+
+        # Запасные провайдеры хеджей тоже держим прогретыми
+        targets = [self.hedge_target(provider, None) for provider in providers]
+        providers = list(dict.fromkeys(providers + [target["provider"] for target in targets if target]))
+
+        async def _warm(provider):
+            try:
+                response = await self._get_client(provider).get(LLM_PROVIDERS[provider]["warmup_url"])
+                logger.info(f"🔥 Соединение с {provider} прогрето ({response.http_version}, статус {response.status_code})")
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось прогреть {provider}: {e}")
+
+        await asyncio.gather(*[_warm(provider) for provider in providers])
+
+    def breaker(self, provider: str, model: Optional[str]) -> CircuitBreaker:
+        name = LLM_BREAKER_MODELS.get(model, provider)
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = CircuitBreaker(name)
+        return breaker
+
+    async def chat(self, provider: str, model: str, messages: List[Dict[str, Any]], **params) -> str:
+        """Отправляет chat completion и возвращает текст ответа"""
+        return await self._call(provider, model, messages, params, self._post)
+
+    async def chat_stream(self, provider: str, model: str, messages: List[Dict[str, Any]],
+                          on_value: Callable[[Any, Any], bool],
+                          on_complete: Optional[Callable[[str], Awaitable[None]]] = None, **params) -> Optional[str]:
+        """
+        Потоковый chat completion. on_value(ключ или номер, значение) вызывается для каждого готового поля
+        JSON верхнего уровня; вернул True - решения достаточно: метод сразу возвращает None,
+        а остаток ответа дочитывается в фоне и отдаётся в on_complete(полный текст) (без on_complete поток обрывается).
+        Иначе возвращает полный текст ответа. LLM_STREAMING=false - обычный вызов с теми же on_value
+        """
+        if not LLM_STREAMING_ENABLED:
+            content = await self.chat(provider, model, messages, **params)
+            for key, value in JSONStreamScanner().feed(content):
+                if on_value(key, value):
+                    break
+            return content
+
+        async def send(provider, model, messages, params):
+            return await self._stream(provider, model, messages, params, on_value, on_complete)
+
+        return await self._call(provider, model, messages, params, send)
+
+    async def _call(self, provider: str, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any], send):
+        """
+        Автомат открыт - CircuitOpenError сразу; 429/5xx/сеть - до RETRY_ATTEMPTS попыток в рамках бюджета повторов.
+        Каждая попытка сначала резервирует запрос и токены в общем лимите провайдера (RateLimitError - лимит исчерпан)
+        """
+        if provider not in LLM_PROVIDERS:
+            raise LLMError(provider, "неизвестный провайдер")
+        if not LLM_PROVIDERS[provider]["api_key"]:
+            raise LLMError(provider, "API ключ не установлен")
+
+        breaker = self.breaker(provider, model)
+        if not breaker.allow():
+            # Сколько бы ждали таймаута провайдера - видно в «📊 Статус»
+            metrics.count("breaker", "fast_fails")
+            metrics.count("breaker", "timeout_ms", LLM_PROVIDERS[provider]["timeout"] * 1000)
+            raise CircuitOpenError(provider, f"автомат {breaker.name} открыт - сразу fallback")
+
+        self.retry_budget.deposit()
+        tokens = estimate_request_tokens(messages, params.get("max_tokens"))
+        attempt = 1
+        while True:
+            try:
+                if await rate_limiter.acquire(provider, model, LLM_PROVIDERS[provider]["api_key"], tokens) is None:
+                    raise RateLimitError(provider, f"лимит запросов {model} исчерпан - сразу fallback")
+                content = await send(provider, model, messages, dict(params))
+            except (asyncio.CancelledError, RateLimitError):
+                breaker.release()
+                raise
+            except LLMError as e:
+                if e.status is not None and e.status not in RETRYABLE_STATUSES:
+                    # Провайдер отвечает, ошибка в запросе или в ответе
+                    breaker.success()
+                    raise
+                long_wait = e.retry_after is not None and e.retry_after > LLM_RETRY_MAX_DELAY
+                breaker.failure(e.retry_after if long_wait else None)
+                if (not e.retryable or long_wait or attempt >= RETRY_ATTEMPTS
+                        or breaker.state != CLOSED or not self.retry_budget.withdraw()):
+                    metrics.count("breaker", "gave_up")
+                    raise
+                delay = max(backoff_delay(attempt, RETRY_DELAY, LLM_RETRY_MAX_DELAY), e.retry_after or 0)
+                logger.warning(f"🔁 {e} - повтор {attempt + 1}/{RETRY_ATTEMPTS} через {delay:.1f} сек")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            breaker.success()
+            return content
+
+    async def _post(self, provider: str, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+        """Одна попытка запроса"""
+        timeout = params.pop("timeout", None)
+        usage_key = params.pop("usage_key", provider)
+        payload = {"model": model, "messages": messages, **params}
+
+        try:
+            response = await self._get_client(provider).post(
+                LLM_PROVIDERS[provider]["url"],
+                json=payload,
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+            )
+        except httpx.TimeoutException:
+            raise LLMError(provider, "timeout")
+        except httpx.HTTPError as e:
+            raise LLMError(provider, f"сетевая ошибка: {e}", retryable=True)
+
+        if response.status_code != 200:
+            raise LLMError(
+                provider, f"API error: {response.status_code} {response.text[:200]}", response.status_code,
+                retry_after=parse_retry_after(response.headers.get("retry-after")),
+                retryable=response.status_code in RETRYABLE_STATUSES
+            )
+
+        try:
+            data = response.json()
+            content = data["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError) as e:
+            raise LLMError(provider, f"неожиданный формат ответа: {e}", response.status_code)
+
+        self.record_usage(usage_key, data.get("usage") or {})
+        return content
+
+    async def _stream(self, provider: str, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any],
+                      on_value: Callable[[Any, Any], bool],
+                      on_complete: Optional[Callable[[str], Awaitable[None]]]) -> Optional[str]:
+        """Одна попытка потокового запроса (SSE, формат OpenAI: data: {...choices[0].delta.content...})"""
+        timeout = params.pop("timeout", None)
+        usage_key = params.pop("usage_key", provider)
+        payload = {"model": model, "messages": messages, **params, "stream": True}
+        if LLM_PROVIDERS[provider].get("stream_usage"):
+            payload["stream_options"] = {"include_usage": True}
+
+        client = self._get_client(provider)
+        request = client.build_request(
+            "POST", LLM_PROVIDERS[provider]["url"], json=payload,
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        )
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.TimeoutException:
+            raise LLMError(provider, "timeout")
+        except httpx.HTTPError as e:
+            raise LLMError(provider, f"сетевая ошибка: {e}", retryable=True)
+
+        state = {"parts": [], "usage": {}}
+        lines = response.aiter_lines()
+        handed_off = False
+        try:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", "replace")
+                raise LLMError(
+                    provider, f"API error: {response.status_code} {body[:200]}", response.status_code,
+                    retry_after=parse_retry_after(response.headers.get("retry-after")),
+                    retryable=response.status_code in RETRYABLE_STATUSES
+                )
+
+            scanner = JSONStreamScanner()
+            try:
+                async for text in self._sse_text(lines, state):
+                    if any(on_value(key, value) for key, value in scanner.feed(text)):
+                        if on_complete is not None:
+                            task = asyncio.create_task(self._finish_stream(response, lines, state, usage_key, on_complete))
+                            self._background.add(task)
+                            task.add_done_callback(self._background.discard)
+                            handed_off = True
+                        return None
+            except httpx.TimeoutException:
+                raise LLMError(provider, "timeout")
+            except httpx.HTTPError as e:
+                raise LLMError(provider, f"сетевая ошибка: {e}", retryable=True)
+
+            self.record_usage(usage_key, state["usage"])
+            return "".join(state["parts"])
+        finally:
+            if not handed_off:
+                await response.aclose()
+
+    @staticmethod
+    async def _sse_text(lines, state: Dict[str, Any]):
+        """Куски текста ответа из строк SSE; usage (последнее событие) - в state"""
+        async for line in lines:
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                return
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            if chunk.get("usage"):
+                state["usage"] = chunk["usage"]
+            choices = chunk.get("choices") or []
+            text = (choices[0].get("delta") or {}).get("content") if choices else None
+            if text:
+                state["parts"].append(text)
+                yield text
+
+    async def _finish_stream(self, response: httpx.Response, lines, state: Dict[str, Any], usage_key: str,
+                             on_complete: Callable[[str], Awaitable[None]]):
+        """Дочитывает поток после раннего решения (соединение остаётся в пуле) и отдаёт полный текст"""
+        try:
+            async for _ in self._sse_text(lines, state):
+                pass
+            self.record_usage(usage_key, state["usage"])
+            await on_complete("".join(state["parts"]))
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось дочитать поток в фоне: {e}")
+        finally:
+            await response.aclose()
+
+    def record_usage(self, usage_key: str, usage: Dict[str, Any]):
+        # OpenAI: prompt_tokens_details.cached_tokens, DeepSeek: prompt_cache_hit_tokens
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0
+        counters = self.usage.setdefault(usage_key, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        counters["calls"] += 1
+        counters["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        counters["cached_tokens"] += cached
+        counters["completion_tokens"] += usage.get("completion_tokens") or 0
+
+    # ========================================================================
+    # ХЕДЖИРОВАНИЕ
+    # ========================================================================
+
+    def record_latency(self, provider: str, model: str, seconds: float):
+        window = self.latencies.setdefault((provider, model), deque(maxlen=LLM_HEDGE_WINDOW))
+        window.append(seconds)
+
+    def hedge_delay(self, provider: str, model: str) -> Optional[float]:
+        """Через сколько секунд без ответа слать хедж: p90 недавних задержек; None - замеров мало"""
+        window = self.latencies.get((provider, model))
+        if not window or len(window) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(window)
+        index = min(len(ordered) - 1, int(len(ordered) * LLM_HEDGE_PERCENTILE))
+        return max(LLM_HEDGE_MIN_DELAY, ordered[index])
+
+    def hedge_target(self, provider: str, model: str) -> Optional[Dict[str, str]]:
+        target = LLM_HEDGE_TARGETS.get(provider) if LLM_HEDGE_ENABLED else None
+        if not target or (target["provider"], target["model"]) == (provider, model):
+            return None
+        if not LLM_PROVIDERS.get(target["provider"], {}).get("api_key"):
+            return None
+        return target
+
+    async def chat_json(self, provider: str, model: str, messages: List[Dict[str, Any]],
+                        parse: Optional[Callable[[str], Any]] = None, **params) -> Any:
+        """
+        chat() + разбор JSON (parse, по умолчанию verdict_parser.extract_object) с хеджированием.
+        JSON-режим провайдера (response_format) включается сам, если провайдер его поддерживает.
+        Невалидный JSON - такая же ошибка (LLMError), как сбой провайдера.
+        Оба запроса упали - поднимается ошибка основного
+        """
+        parse = parse or extract_object
+        stats = self.hedge_stats.setdefault(provider, {"calls": 0, "hedged": 0, "hedge_wins": 0, "primary_wins": 0})
+        stats["calls"] += 1
+        self.hedge_tokens = min(LLM_HEDGE_BURST, self.hedge_tokens + LLM_HEDGE_BUDGET)
+
+        async def attempt(attempt_provider: str, attempt_model: str):
+            started = time.monotonic()
+            content = await self.chat(attempt_provider, attempt_model, messages, **{**json_mode_params(attempt_provider), **params})
+            self.record_latency(attempt_provider, attempt_model, time.monotonic() - started)
+            try:
+                return parse_counted(attempt_provider, attempt_model, parse, content)
+            except (ValueError, KeyError, TypeError) as e:
+                raise LLMError(attempt_provider, f"невалидный JSON: {e}")
+
+        target = self.hedge_target(provider, model)
+        if target and self.breaker(provider, model).is_open() and not self.breaker(target["provider"], target["model"]).is_open():
+            # Основной провайдер отключён автоматом - это не лишний вызов, бюджет хеджей не тратим
+            return await attempt(target["provider"], target["model"])
+        delay = self.hedge_delay(provider, model) if target else None
+        if delay is None:
+            return await attempt(provider, model)
+
+        started = time.monotonic()
+        primary = asyncio.ensure_future(attempt(provider, model))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or self.hedge_tokens < 1:
+                return await primary
+
+            self.hedge_tokens -= 1
+            stats["hedged"] += 1
+            logger.info(f"🪝 {provider} молчит {delay:.1f} сек (p{LLM_HEDGE_PERCENTILE * 100:.0f}) - хедж в {target['provider']}/{target['model']}")
+            hedge = asyncio.ensure_future(attempt(target["provider"], target["model"]))
+
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Если готовы оба - предпочитаем основной
+                for task in sorted(done, key=lambda task: task is not primary):
+                    if task.exception() is not None:
+                        continue
+                    if task is primary:
+                        stats["primary_wins"] += 1
+                        metrics.count("hedge", "primary_wins")
+                    else:
+                        stats["hedge_wins"] += 1
+                        metrics.count("hedge", "hedge_wins")
+                        # Основной так и не ответил: его задержка не меньше прошедшего времени
+                        self.record_latency(provider, model, time.monotonic() - started)
+                    return task.result()
+
+            raise primary.exception()
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def hedge_report(self) -> Dict[str, Dict[str, Any]]:
+        """Для каждого провайдера: вызовы, доля хеджей, победы хеджа и основного, текущая задержка хеджа"""
+        report = {}
+        for provider, stats in self.hedge_stats.items():
+            delays = [self.hedge_delay(p, m) for p, m in self.latencies if p == provider]
+            delays = [delay for delay in delays if delay is not None]
+            report[provider] = {
+                **stats,
+                "hedge_rate": stats["hedged"] / stats["calls"] if stats["calls"] else 0,
+                "delay": min(delays) if delays else None,
+            }
+        return report
+
+    def breaker_report(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {"state": breaker.state, "failures": breaker.failures, **breaker.stats}
+            for name, breaker in self.breakers.items()
+        }
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+# Один клиент на процесс
+llm_client = LLMClient()
+
+
+async def chat(provider: str, model: str, messages: List[Dict[str, Any]], **params) -> str:
+    return await llm_client.chat(provider, model, messages, **params)
+
+
+async def chat_json(provider: str, model: str, messages: List[Dict[str, Any]], **params) -> Any:
+    return await llm_client.chat_json(provider, model, messages, **params)
+
+
+async def chat_stream(provider: str, model: str, messages: List[Dict[str, Any]],
+                      on_value: Callable[[Any, Any], bool], **params) -> Optional[str]:
+    return await llm_client.chat_stream(provider, model, messages, on_value, **params)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🧩 ОДНОПРОЦЕССНЫЙ РЕЖИМ TELEGUARD (БЕЗ REDIS)
+✅ Бот и агенты 1-6 в одном asyncio процессе
+✅ Очереди - asyncio.Queue с теми же именами, что QUEUE_AGENT_* (транспорт memory)
+✅ Агенты те же: маршрутизатор Агента 1, moderation_agent_2, process_contextual_analysis, moderation_agent_4, process_moderation_result
+✅ Без сериализации и похода в Redis на каждом этапе, без sleep'ов start_all.sh
+
+Запуск:
+    python3 local_pipeline.py               # бот + все агенты
+    python3 local_pipeline.py --bench 100   # без бота: прогнать 100 тестовых сообщений и замерить время
+"""
+
+import os
+
+# Транспорт выбирается при импорте config - до импорта агентов
+os.environ["QUEUE_TRANSPORT"] = "memory"
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from config import (
+    QUEUE_AGENT_1_INPUT,
+    QUEUE_AGENT_2_OUTPUT,
+    QUEUE_AGENT_5_OUTPUT,
+    QUEUE_AGENT_6_OUTPUT,
+    setup_logging,
+)
+from queue_transport import get_memory_queue, QueueTransport
+from routing import score_priority, priority_queue
+from first_agent import Agent1Worker
+from second_agent import Agent2Worker
+from third_agent import Agent3Worker
+from fourth_agent import Agent4Worker
+from fifth_agent import Agent5Worker
+from sixth_agent import Agent6Worker
+
+logger = setup_logging("LOCAL PIPELINE")
+
+# Как в боте: каждое сообщение - во вход Агента 1, дальше по его маршруту
+WORKERS = [Agent1Worker, Agent2Worker, Agent3Worker, Agent4Worker, Agent5Worker, Agent6Worker]
+
+BENCH_MESSAGES = [
+    "Всем привет! Кто идёт на встречу в субботу?",
+    "Ты идиот и ничего не понимаешь",
+    "Заработок от 5000$ в день, пиши в личку https://t.me/spam",
+    "Спасибо за помощь, всё заработало",
+]
+
+# ============================================================================
+# СЛИВ РЕЗУЛЬТАТОВ
+# ============================================================================
+
+async def drain(queue_names, on_result=None):
+    """Забирает результаты из очередей, которые в этом режиме никто не читает"""
+    queues = [get_memory_queue(lane) for name in queue_names for lane in QueueTransport.all_lanes(name)]
+    while True:
+        for queue in queues:
+            while not queue.empty():
+                result = queue.get_nowait()
+                if on_result:
+                    on_result(result)
+        await asyncio.sleep(0.05)
+
+# ============================================================================
+# БЕНЧМАРК
+# ============================================================================
+
+async def run_bench(count: int):
+    done = asyncio.Event()
+    sources = {}
+    # Время до решения по источникам: видно, сколько экономит ранний выход (каскад, кэш и т.п.)
+    latencies = {}
+
+    def on_verdict(result):
+        source = result.get("decision_source", "unknown")
+        sources[source] = sources.get(source, 0) + 1
+        latencies.setdefault(source, []).append(time.perf_counter() - started)
+        if sum(sources.values()) >= count:
+            done.set()
+
+    started = time.perf_counter()
+    for i in range(count):
+        message = BENCH_MESSAGES[i % len(BENCH_MESSAGES)]
+        priority = score_priority(message)
+        payload = {
+            "message": message,
+            "priority": priority,
+            "user_id": 1000 + i,
+            "username": f"bench{i}",
+            "chat_id": -1,
+            "message_id": i + 1,
+            "message_link": "",
+            "timestamp": datetime.now().isoformat()
+        }
+        # Как в боте: маршрут выбирает Агент 1
+        get_memory_queue(priority_queue(QUEUE_AGENT_1_INPUT, priority)).put_nowait(payload)
+
+    drainer = asyncio.create_task(drain([QUEUE_AGENT_5_OUTPUT], on_verdict))
+    outputs = asyncio.create_task(drain([QUEUE_AGENT_2_OUTPUT, QUEUE_AGENT_6_OUTPUT]))
+    try:
+        await done.wait()
+    finally:
+        drainer.cancel()
+        outputs.cancel()
+
+    elapsed = time.perf_counter() - started
+    logger.info("=" * 80)
+    logger.info(f"📊 Сообщений: {count}, время: {elapsed:.2f} сек, {count / elapsed:.1f} сообщ/сек")
+    logger.info(f"📊 Источники решений: {sources}")
+    for source, values in sorted(latencies.items()):
+        values.sort()
+        logger.info(
+            f"⏱️ {source}: p50={values[len(values) // 2]:.2f} сек, "
+            f"p95={values[min(len(values) - 1, int(len(values) * 0.95))]:.2f} сек"
+        )
+    logger.info("=" * 80)
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+async def main(bench: int = 0):
+    workers = [worker_class() for worker_class in WORKERS]
+    tasks = [asyncio.create_task(worker.run_forever()) for worker in workers]
+    logger.info(f"✅ Запущено агентов: {len(workers)} (транспорт memory)")
+
+    try:
+        if bench:
+            await run_bench(bench)
+        else:
+            # Бот импортируется только здесь: для него нужны токен Telegram и БД
+            import teleguard_bot
+            await teleguard_bot.main()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TeleGuard в одном процессе без Redis")
+    parser.add_argument("--bench", type=int, default=0, help="прогнать N тестовых сообщений без бота")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(main(args.bench))
+    except KeyboardInterrupt:
+        logger.info("🛑 Остановлено (Ctrl+C)")
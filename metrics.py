@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📈 СЧЁТЧИКИ КОНВЕЙЕРА
+✅ Всё, что не кэш вердиктов и не лимит провайдеров: автоматы, хедж, каскад, спекуляция, разбор ответов,
+   фильтры бота (почти-дубликаты, классификатор, словарь)
+✅ У каждой метрики свои поля и подписи (METRICS) - попадания/промахи подходят не всем
+✅ Копятся в памяти процесса, раз в METRICS_FLUSH_INTERVAL прибавляются к хэшу metrics:stats в Redis (HINCRBY)
+✅ Видны в «📊 Статус» отдельным разделом
+"""
+
+import time
+from typing import Dict, Tuple
+
+from config import METRICS_FLUSH_INTERVAL
+
+STATS_KEY = "metrics:stats"
+
+# Метрика -> (название в «📊 Статус», (поле, подпись), ...). Поля *_ms показываются в секундах.
+# parse:{провайдер}/{модель} - метрика "parse" отдельно на каждую модель
+METRICS: Dict[str, Tuple[str, Tuple[Tuple[str, str], ...]]] = {
+    "breaker": ("Автоматы", (
+        ("fast_fails", "сразу в fallback"),
+        ("gave_up", "сдались после повторов"),
+        ("timeout_ms", "не ждали таймаутов до"),
+    )),
+    "hedge": ("Хедж", (("hedge_wins", "выиграл хедж"), ("primary_wins", "выиграл основной"))),
+    "cascade": ("Каскад", (("early_exits", "ранних решений"), ("escalated", "спорных"))),
+    "speculation": ("Спекуляция", (("cancelled", "отменено"), ("completed", "досчитано"))),
+    "parse": ("Разбор", (("parsed", "разобрано"), ("rejected", "выброшено"))),
+    "neardup": ("Почти-дубликаты", (("reused", "вердикт повторён"), ("unique", "новых"))),
+    "classifier": ("Классификатор", (("clean", "чистых без LLM"), ("suspicious", "в LLM"))),
+    "lexicon": ("Словарь", (("decided", "решено без LLM"), ("passed", "дальше"))),
+}
+
+
+def metric_kind(name: str) -> str:
+    return name.split(":", 1)[0]
+
+
+def format_metric(name: str, bucket: Dict[str, int]) -> str:
+    """Строка «📊 Статус»: «Хедж: выиграл хедж 3, выиграл основной 40»"""
+    kind = metric_kind(name)
+    title, fields = METRICS.get(kind, (kind, tuple((field, field) for field in bucket)))
+    if ":" in name:
+        title = f"{title} {name.split(':', 1)[1]}"
+    values = [
+        f"{label} ~{bucket.get(field, 0) / 1000:.0f} сек" if field.endswith("_ms") else f"{label} {bucket.get(field, 0)}"
+        for field, label in fields
+    ]
+    return f"{title}: {', '.join(values)}"
+
+
+class Metrics:
+    """redis_client со строками; None - счётчики только этого процесса (режим memory)"""
+
+    def __init__(self):
+        self.redis_client = None
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._unflushed: Dict[str, Dict[str, int]] = {}
+        self._flushed = time.monotonic()
+
+    def bind(self, redis_client):
+        self.redis_client = redis_client
+
+    def count(self, name: str, field: str, value: int = 1):
+        for counters in (self.stats, self._unflushed):
+            bucket = counters.setdefault(name, {})
+            bucket[field] = bucket.get(field, 0) + int(value)
+
+    async def maybe_flush(self):
+        if time.monotonic() - self._flushed >= METRICS_FLUSH_INTERVAL:
+            await self.flush()
+
+    async def flush(self):
+        """Прибавляет накопленные счётчики к общим в Redis (HINCRBY по метрика:поле)"""
+        self._flushed = time.monotonic()
+        if self.redis_client is None or not self._unflushed:
+            return
+        unflushed, self._unflushed = self._unflushed, {}
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for name, bucket in unflushed.items():
+                for field, value in bucket.items():
+                    if value:
+                        pipe.hincrby(STATS_KEY, f"{name}:{field}", value)
+            await pipe.execute()
+        except Exception:
+            # Счётчики не должны ронять модерацию
+            pass
+
+
+# Одни счётчики на процесс
+metrics = Metrics()
+
+
+async def read_stats(redis_client) -> Dict[str, Dict[str, int]]:
+    """{метрика: {поле: n}} для «📊 Статус». Без Redis - счётчики этого процесса"""
+    if redis_client is None:
+        return {name: dict(bucket) for name, bucket in metrics.stats.items()}
+
+    stats: Dict[str, Dict[str, int]] = {}
+    for key, value in (await redis_client.hgetall(STATS_KEY)).items():
+        name, _, field = key.rpartition(":")
+        stats.setdefault(name, {})[field] = int(value)
+    return stats
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🧬 ПОИСК ПОЧТИ-ДУБЛИКАТОВ (ВОЛНЫ СПАМА)
+✅ SimHash (64 бит) по символьным 4-граммам нормализованного текста
+✅ Ссылки сводятся к домену, цифры - к 0, эмодзи и пунктуация отбрасываются
+✅ LSH: подпись режется на NEARDUP_BANDS полос, кандидаты ищутся по совпавшей полосе
+✅ Индекс в Redis: neardup:{chat_id}:{полоса}:{значение} - ZSET подписей по времени, окно NEARDUP_WINDOW
+✅ Вердикт пишет Агент 5, ищет бот при приёме сообщения (handle_text)
+"""
+
+import hashlib
+import json
+import re
+import time
+from typing import Dict, Any, Optional, List
+
+from config import (
+    NEARDUP_WINDOW,
+    NEARDUP_BANDS,
+    NEARDUP_MAX_DISTANCE,
+    NEARDUP_MIN_LENGTH,
+)
+from verdict_cache import normalize_text
+
+SIGNATURE_BITS = 64
+BAND_BITS = SIGNATURE_BITS // NEARDUP_BANDS
+SHINGLE_SIZE = 4
+
+# Поля вердикта, которые переиспользуются для похожего сообщения
+VERDICT_FIELDS = ("action", "severity", "confidence", "reason", "type", "is_violation")
+
+_LINK_RE = re.compile(r"(?:https?://|www\.)?((?:[\w-]+\.)+[a-zа-я]{2,})(?:/\S*)?", re.IGNORECASE)
+_DIGITS_RE = re.compile(r"\d+")
+_NOISE_RE = re.compile(r"[^\w\s]|_")
+_SPACES_RE = re.compile(r"\s+")
+
+# ============================================================================
+# ПОДПИСЬ
+# ============================================================================
+
+
+def normalize_for_signature(text: str) -> str:
+    """Убирает то, что спамеры меняют от копии к копии"""
+    text = normalize_text(text)
+    text = _LINK_RE.sub(lambda match: f" {match.group(1)} ", text)
+    text = _DIGITS_RE.sub("0", text)
+    text = _NOISE_RE.sub(" ", text)
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(text: str) -> Optional[int]:
+    """64-битная подпись текста; None - текст слишком короткий для сравнения"""
+    normalized = normalize_for_signature(text)
+    if len(normalized) < NEARDUP_MIN_LENGTH:
+        return None
+
+    weights = [0] * SIGNATURE_BITS
+    for i in range(len(normalized) - SHINGLE_SIZE + 1):
+        value = _feature_hash(normalized[i:i + SHINGLE_SIZE])
+        for bit in range(SIGNATURE_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+
+    signature = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            signature |= 1 << bit
+    return signature
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def bands(signature: int) -> List[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [signature >> (band * BAND_BITS) & mask for band in range(NEARDUP_BANDS)]
+
+# ============================================================================
+# ИНДЕКС
+# ============================================================================
+
+# Индекс для режима memory (бот и Агент 5 в одном процессе): {band_key: {подпись: время}}
+_local_bands: Dict[str, Dict[str, float]] = {}
+_local_verdicts: Dict[str, tuple] = {}
+
+
+def band_key(chat_id, band: int, value: int) -> str:
+    return f"neardup:{chat_id}:{band}:{value:04x}"
+
+
+def verdict_key(chat_id, signature: str) -> str:
+    return f"neardup:{chat_id}:verdict:{signature}"
+
+
+class NearDuplicateIndex:
+    """
+    Подписи сообщений с вердиктом за последние NEARDUP_WINDOW секунд, отдельно по чатам
+    (правила у чатов разные). redis_client со строками; None - индекс в памяти процесса
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    async def find(self, chat_id, signature: int) -> Optional[Dict[str, Any]]:
+        """Вердикт самого похожего сообщения или None"""
+        keys = [band_key(chat_id, band, value) for band, value in enumerate(bands(signature))]
+        since = time.time() - NEARDUP_WINDOW
+
+        if self.redis_client is None:
+            candidates = {member for key in keys for member, seen in _local_bands.get(key, {}).items() if seen >= since}
+        else:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.zrangebyscore(key, since, "+inf")
+            candidates = {member for members in await pipe.execute() for member in members}
+
+        best, best_distance = None, NEARDUP_MAX_DISTANCE + 1
+        for member in candidates:
+            distance = hamming(signature, int(member, 16))
+            if distance < best_distance:
+                best, best_distance = member, distance
+        if best is None:
+            return None
+
+        if self.redis_client is None:
+            stored = _local_verdicts.get(verdict_key(chat_id, best))
+            verdict = stored[1] if stored and stored[0] >= since else None
+        else:
+            raw = await self.redis_client.get(verdict_key(chat_id, best))
+            verdict = json.loads(raw) if raw else None
+        if verdict is None:
+            return None
+        return {**verdict, "distance": best_distance}
+
+    async def add(self, chat_id, signature: int, verdict: Dict[str, Any]):
+        member = f"{signature:016x}"
+        verdict = {field: verdict.get(field) for field in VERDICT_FIELDS}
+        keys = [band_key(chat_id, band, value) for band, value in enumerate(bands(signature))]
+        now = time.time()
+
+        if self.redis_client is None:
+            for key in keys:
+                members = _local_bands.setdefault(key, {})
+                members[member] = now
+                for old in [old for old, seen in members.items() if seen < now - NEARDUP_WINDOW]:
+                    del members[old]
+                    _local_verdicts.pop(verdict_key(chat_id, old), None)
+            _local_verdicts[verdict_key(chat_id, member)] = (now, verdict)
+            return
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.zadd(key, {member: now})
+            pipe.zremrangebyscore(key, "-inf", now - NEARDUP_WINDOW)
+            pipe.expire(key, NEARDUP_WINDOW)
+        pipe.set(verdict_key(chat_id, member), json.dumps(verdict, ensure_ascii=False), ex=NEARDUP_WINDOW)
+        await pipe.execute()
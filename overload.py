@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🚨 КОНТРОЛЬ ПЕРЕГРУЗКИ
+✅ Следит за глубиной и возрастом очередей на входе агентов 1-5
+✅ При превышении порогов переключает конвейер в режим деградации (OVERLOAD_MODES)
+✅ Возвращается обратно с гистерезисом: ниже порога * OVERLOAD_EXIT_RATIO и не раньше OVERLOAD_MIN_DWELL
+✅ Режим хранится в Redis (overload:state) и виден всем агентам и боту
+"""
+
+import asyncio
+import time
+from typing import Dict, Any
+
+from config import (
+    QUEUE_AGENT_1_INPUT,
+    QUEUE_AGENT_2_INPUT,
+    QUEUE_AGENT_3_INPUT,
+    QUEUE_AGENT_3_OUTPUT,
+    QUEUE_AGENT_4_INPUT,
+    QUEUE_AGENT_5_INPUT,
+    OVERLOAD_MODES,
+    OVERLOAD_THRESHOLDS,
+    OVERLOAD_EXIT_RATIO,
+    OVERLOAD_MIN_DWELL,
+    OVERLOAD_CHECK_INTERVAL,
+)
+
+OVERLOAD_KEY = "overload:state"
+
+# Очереди, за которыми следим: (очередь, кто её читает)
+WATCHED_QUEUES = [
+    # Вход конвейера: бот пишет каждое сообщение Агенту 1
+    (QUEUE_AGENT_1_INPUT, 1),
+    (QUEUE_AGENT_2_INPUT, 2),
+    (QUEUE_AGENT_3_INPUT, 3),
+    (QUEUE_AGENT_4_INPUT, 4),
+    (QUEUE_AGENT_5_INPUT, 5),
+    # Решения Агента 3 Агент 5 читает из выхода Агента 3
+    (QUEUE_AGENT_3_OUTPUT, 5),
+]
+
+MODE_TITLES = {
+    "normal": "✅ Обычный",
+    "no_arbitration": "⚠️ Без арбитража OpenAI",
+    "skip_3_4": "⚠️ Без агентов 3 и 4",
+    "local_only": "🚨 Только локальная проверка",
+}
+
+# Состояние для режима memory (один процесс, без Redis)
+_local_state: Dict[str, Any] = {"mode": "normal", "since": 0, "depth": 0, "age": 0}
+
+
+def mode_level(mode: str) -> int:
+    return OVERLOAD_MODES.index(mode) if mode in OVERLOAD_MODES else 0
+
+
+async def read_state(redis_client) -> Dict[str, Any]:
+    """Текущий режим и последние замеры"""
+    if redis_client is None:
+        return dict(_local_state)
+
+    state = await redis_client.hgetall(OVERLOAD_KEY)
+    return {
+        "mode": state.get("mode", "normal"),
+        "since": float(state.get("since", 0)),
+        "depth": int(state.get("depth", 0)),
+        "age": float(state.get("age", 0)),
+    }
+
+
+async def write_state(redis_client, state: Dict[str, Any]):
+    if redis_client is None:
+        _local_state.update(state)
+        return
+    await redis_client.hset(OVERLOAD_KEY, mapping={key: str(value) for key, value in state.items()})
+
+
+class OverloadMode:
+    """Кэш режима для агентов: перечитывается не чаще OVERLOAD_CHECK_INTERVAL"""
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self._mode = "normal"
+        self._checked = 0.0
+
+    async def get(self) -> str:
+        now = time.monotonic()
+        if now - self._checked >= OVERLOAD_CHECK_INTERVAL:
+            self._checked = now
+            try:
+                self._mode = (await read_state(self.redis_client))["mode"]
+            except Exception:
+                # Нет связи с Redis - остаёмся в последнем известном режиме
+                pass
+        return self._mode
+
+    async def level(self) -> int:
+        return mode_level(await self.get())
+
+
+class OverloadController:
+    """
+    Меряет очереди и переключает режим. Запускается в Агенте 2 (см. AsyncAgentWorker.overload_controller).
+    Текущий режим и время входа в него берутся из Redis, поэтому несколько копий агента решают согласованно
+    """
+
+    def __init__(self, transport, redis_client, logger):
+        self.transport = transport
+        self.redis_client = redis_client
+        self.logger = logger
+
+    async def measure(self):
+        """Худшая глубина и худший возраст по всем этапам"""
+        depth, age = 0, 0.0
+        for queue_name, consumer in WATCHED_QUEUES:
+            depth = max(depth, await self.transport.depth(queue_name, consumer))
+            age = max(age, await self.transport.oldest_age(queue_name, consumer))
+        return depth, age
+
+    @staticmethod
+    def target_level(level: int, since: float, depth: int, age: float, now: float) -> int:
+        # Вверх - сразу до самого тяжёлого режима, чей порог превышен
+        crossed = 0
+        for index, mode in enumerate(OVERLOAD_MODES[1:], start=1):
+            threshold = OVERLOAD_THRESHOLDS[mode]
+            if depth >= threshold["depth"] or age >= threshold["age"]:
+                crossed = index
+        if crossed > level:
+            return crossed
+
+        # Вниз - на одну ступень, когда нагрузка заметно ниже порога текущего режима
+        if level > 0 and now - since >= OVERLOAD_MIN_DWELL:
+            threshold = OVERLOAD_THRESHOLDS[OVERLOAD_MODES[level]]
+            if depth < threshold["depth"] * OVERLOAD_EXIT_RATIO and age < threshold["age"] * OVERLOAD_EXIT_RATIO:
+                return level - 1
+        return level
+
+    async def check(self) -> str:
+        depth, age = await self.measure()
+        state = await read_state(self.redis_client)
+        now = time.time()
+
+        level = mode_level(state["mode"])
+        new_level = self.target_level(level, state["since"], depth, age, now)
+        mode = OVERLOAD_MODES[new_level]
+
+        if new_level != level:
+            log = self.logger.warning if new_level > level else self.logger.info
+            log(f"🚨 Режим перегрузки: {state['mode']} → {mode} (глубина={depth}, возраст={age:.0f} сек)")
+            state["since"] = now
+
+        await write_state(self.redis_client, {"mode": mode, "since": state["since"], "depth": depth, "age": round(age, 1)})
+        return mode
+
+    async def run(self):
+        while True:
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"❌ Ошибка контроля перегрузки: {e}")
+            await asyncio.sleep(OVERLOAD_CHECK_INTERVAL)
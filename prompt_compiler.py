@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🧱 КОМПИЛЯТОР ПРОМПТОВ
+✅ Статичные инструкции и блок правил идут первыми и не меняются от вызова к вызову (system)
+✅ Текст сообщения - последним (user), поэтому префикс попадает в кэш промптов провайдера
+✅ Блок правил собирается один раз на набор правил чата и хранится в LRU
+✅ Версия шаблона - хэш его текста: меняется промпт - меняются ключи кэша вердиктов
+✅ Отчёт по агенту: сколько входных токенов в стабильном префиксе и сколько из них провайдер взял из кэша
+✅ Текст сообщения сжимается и укладывается в бюджет агента (token_budget.fit), экономия - в отчёте
+"""
+
+from collections import OrderedDict
+from typing import Dict, Any, List, Union
+
+from config import PROMPT_RULES_CACHE_SIZE, PROMPT_REPORT_EVERY, setup_logging
+from llm_client import llm_client, estimate_tokens
+from token_budget import fit, report as budget_report
+from verdict_cache import fingerprint
+
+logger = setup_logging("PROMPTS")
+
+
+def format_rules(rules: Union[List[str], str, None]) -> str:
+    if isinstance(rules, str):
+        return rules.strip() or "- Никаких правил"
+    return "\n".join(f"- {rule}" for rule in rules) if rules else "- Никаких правил"
+
+
+class PromptTemplate:
+    """
+    Шаблон промпта агента: instructions + rules_title + правила (префикс) и message_template (хвост).
+    message_template форматируется полями вызова: message и всем, что передано в messages()
+    """
+
+    def __init__(self, name: str, instructions: str, message_template: str, rules_title: str = "ПРАВИЛА ЧАТА:"):
+        self.name = name
+        self.instructions = instructions.strip()
+        self.message_template = message_template
+        self.rules_title = rules_title
+        self.version = fingerprint(name, self.instructions, message_template, rules_title)
+        self._prefixes: "OrderedDict[str, str]" = OrderedDict()
+        self.stats = {"calls": 0, "prefix_tokens": 0, "tail_tokens": 0}
+
+    def prefix(self, rules) -> str:
+        """Префикс для набора правил: один раз на набор, дальше - из LRU (байт в байт тот же)"""
+        key = fingerprint(rules)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            prefix = f"{self.instructions}\n\n{self.rules_title}\n{format_rules(rules)}"
+            self._prefixes[key] = prefix
+            while len(self._prefixes) > PROMPT_RULES_CACHE_SIZE:
+                self._prefixes.popitem(last=False)
+        else:
+            self._prefixes.move_to_end(key)
+        return prefix
+
+    def messages(self, message: str, rules=None, **fields) -> List[Dict[str, str]]:
+        system = self.prefix(rules)
+        user = self.message_template.format(message=fit(self.name, message), **fields)
+
+        self.stats["calls"] += 1
+        self.stats["prefix_tokens"] += estimate_tokens(system)
+        self.stats["tail_tokens"] += estimate_tokens(user)
+        if self.stats["calls"] % PROMPT_REPORT_EVERY == 0:
+            logger.info(self.report_line())
+
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ]
+
+    def report(self) -> Dict[str, Any]:
+        """Оценка по шаблону + фактические токены провайдера (llm_client.usage по имени шаблона)"""
+        usage = llm_client.usage.get(self.name, {})
+        total = self.stats["prefix_tokens"] + self.stats["tail_tokens"]
+        return {
+            "version": self.version,
+            "calls": self.stats["calls"],
+            "prefix_tokens": self.stats["prefix_tokens"],
+            "prefix_share": self.stats["prefix_tokens"] / total if total else 0,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "budget": budget_report(self.name),
+        }
+
+    def report_line(self) -> str:
+        report = self.report()
+        line = (
+            f"📉 Промпт {self.name} v{report['version'][:8]}: вызовов {report['calls']}, "
+            f"стабильный префикс ~{report['prefix_tokens']} ток. ({report['prefix_share']:.0%} входа)"
+        )
+        if report["prompt_tokens"]:
+            line += (
+                f", провайдер: {report['cached_tokens']} из {report['prompt_tokens']} "
+                f"входных токенов из кэша ({report['cached_tokens'] / report['prompt_tokens']:.0%})"
+            )
+        budget = report["budget"]
+        if budget["saved_tokens"] or budget["chunked"] or budget["truncated"]:
+            line += (
+                f", бюджет текста: сэкономлено ~{budget['saved_tokens']} ток., "
+                f"на куски {budget['chunked']}, обрезано {budget['truncated']}"
+            )
+        return line
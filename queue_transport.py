@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📬 ТРАНСПОРТ ОЧЕРЕДЕЙ REDIS
+✅ Два режима: списки (BLPOP) и Redis Streams с consumer groups
+✅ Пакетное чтение: ждём первый элемент, остальные добираем без ожидания
+✅ Все выходы пакета уходят одним pipeline (MULTI/EXEC)
+✅ Streams: XACK в той же транзакции, что и запись выходов; зависшие записи забираем через XAUTOCLAIM
+✅ Асинхронный: работает поверх redis.asyncio в общем event loop агента
+✅ Режим memory: asyncio.Queue в одном процессе, без Redis и сериализации
+✅ Приоритетные полосы: выход пишется в полосу по payload["priority"], чтение - взвешенно (routing.py)
+✅ Конверты (envelope.py): текст сообщения хранится один раз, в очереди - компактный msgpack
+✅ Сообщение, на котором агент падает QUEUE_MAX_DELIVERIES раз, уходит в {очередь}:dead
+"""
+
+import asyncio
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Tuple, Optional
+
+import redis
+
+from config import (
+    QUEUE_TRANSPORT,
+    STREAM_MAXLEN,
+    STREAM_CLAIM_IDLE_MS,
+    STREAM_CLAIM_INTERVAL,
+    CLAIM_CHECK_ENABLED,
+    CLAIM_CHECK_TTL,
+    QUEUE_MAX_DELIVERIES,
+    get_batch_settings,
+)
+from envelope import pack, unpack, ClaimCheck, REF_FIELD, message_key
+from routing import PriorityScheduler, priority_queue, base_queue, LANE_SUFFIXES
+
+# (полоса очереди, payload, id записи) - id нужен только для подтверждения в режиме streams.
+# Исходное имя очереди по полосе - routing.base_queue()
+QueueItem = Tuple[str, Dict[str, Any], Optional[str]]
+
+# Сколько раз сообщение уже брали (режимы list и memory: сообщение снято с очереди, счётчик едет в нём)
+ATTEMPTS_FIELD = "delivery_attempts"
+
+
+def consumer_group_name(consumer) -> str:
+    """Имя consumer group для агента (1..6) или бота ("bot")"""
+    return f"agent{consumer}" if isinstance(consumer, int) else str(consumer)
+
+
+def dead_queue(queue_name: str) -> str:
+    """Куда уходят сообщения, которые агент так и не смог обработать (одна на все полосы очереди)"""
+    return f"{base_queue(queue_name)}:dead"
+
+
+def as_text(value) -> str:
+    """Клиент очередей работает с байтами (get_redis_config(binary=True)) - имена и id приводим к str"""
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class QueueTransport:
+    """Общая часть транспортов: сериализация, конверты и группировка выходов"""
+
+    mode = "base"
+
+    def __init__(self, redis_client, logger, batch_size: int = 1, max_wait: float = 1):
+        self.redis_client = redis_client
+        self.logger = logger
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.scheduler = PriorityScheduler()
+        # Разбирать конверты умеют все; отправлять их - только при CLAIM_CHECK_ENABLED
+        self.claim_check = ClaimCheck()
+
+    def decode(self, queue_name: str, raw) -> Optional[Dict[str, Any]]:
+        try:
+            payload = unpack(raw)
+        except Exception as e:
+            self.logger.error(f"❌ Невалидное сообщение в {queue_name}: {e}")
+            return None
+        if not isinstance(payload, dict):
+            self.logger.error(f"❌ Невалидное сообщение в {queue_name}: ожидался объект")
+            return None
+        return payload
+
+    def encode_outputs(self, outputs: List[Tuple[str, Dict[str, Any]]]):
+        """
+        Возвращает (значения по полосам, хэши сообщений для записи).
+        Один и тот же payload (например, выход Агента 2) упаковываем один раз
+        """
+        encoded = {}
+        by_queue: Dict[str, List[bytes]] = {}
+        stores: Dict[str, Dict[str, Any]] = {}
+        for queue_name, payload in outputs:
+            key = id(payload)
+            if key not in encoded:
+                envelope = payload
+                if CLAIM_CHECK_ENABLED:
+                    envelope, ref, fields = self.claim_check.check_in(payload)
+                    if fields:
+                        stores.setdefault(ref, {}).update(fields)
+                encoded[key] = pack(envelope)
+            lane = priority_queue(queue_name, payload.get("priority"))
+            by_queue.setdefault(lane, []).append(encoded[key])
+        return by_queue, stores
+
+    @staticmethod
+    def store_messages(pipe, stores: Dict[str, Dict[str, Any]]):
+        """Хэши сообщений пишутся в той же транзакции, что и конверты"""
+        for ref, fields in stores.items():
+            key = message_key(ref)
+            pipe.hset(key, mapping={field: pack(value) for field, value in fields.items()})
+            pipe.expire(key, CLAIM_CHECK_TTL)
+
+    def stored(self, stores: Dict[str, Dict[str, Any]]):
+        """Транзакция прошла - следующие этапы этого процесса не пишут поля повторно"""
+        for ref, fields in stores.items():
+            self.claim_check.remember(ref, fields)
+
+    async def restore(self, items: List[QueueItem]) -> List[QueueItem]:
+        """Возвращает в конверты текст и метаданные: неизвестные процессу сообщения читаются одним pipeline"""
+        missing = sorted({
+            payload[REF_FIELD] for _, payload, _ in items
+            if REF_FIELD in payload and self.claim_check.known(payload[REF_FIELD]) is None
+        })
+        if missing:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for ref in missing:
+                pipe.hgetall(message_key(ref))
+            for ref, raw in zip(missing, await pipe.execute()):
+                if raw:
+                    self.claim_check.remember(ref, self.claim_check.decode_hash(raw))
+                else:
+                    self.logger.warning(f"⚠️ Сообщение {ref} не найдено в Redis (истёк TTL?)")
+
+        restored = []
+        for queue_name, payload, entry_id in items:
+            fields = self.claim_check.known(payload[REF_FIELD]) if REF_FIELD in payload else None
+            restored.append((queue_name, self.claim_check.check_out(payload, fields), entry_id))
+        return restored
+
+    @staticmethod
+    def all_lanes(queue_name: str) -> List[str]:
+        return [queue_name + suffix for suffix in LANE_SUFFIXES.values()]
+
+    def limit(self, count: Optional[int]) -> int:
+        return max(1, min(self.batch_size, count or self.batch_size))
+
+    async def receive(self, queues: List[str], count: Optional[int] = None) -> List[QueueItem]:
+        raise NotImplementedError
+
+    async def send(self, outputs: List[Tuple[str, Dict[str, Any]]], processed: List[QueueItem] = None):
+        raise NotImplementedError
+
+    async def depth(self, queue_name: str, consumer) -> int:
+        raise NotImplementedError
+
+    async def fail(self, item: QueueItem, error: str):
+        """
+        Обработка сообщения упала. Сообщение уже снято с очереди: возвращаем его в конец очереди
+        со счётчиком попыток, а после QUEUE_MAX_DELIVERIES попыток - в {очередь}:dead
+        """
+        queue_name, payload, _ = item
+        payload = {**payload, ATTEMPTS_FIELD: int(payload.get(ATTEMPTS_FIELD, 0)) + 1}
+        if payload[ATTEMPTS_FIELD] < QUEUE_MAX_DELIVERIES:
+            await self.send([(base_queue(queue_name), payload)])
+            return
+        self.logger.error(
+            f"☠️ Сообщение из {queue_name} не обработано за {payload[ATTEMPTS_FIELD]} попыток, "
+            f"перенесено в {dead_queue(queue_name)}: {error}"
+        )
+        await self.bury(queue_name, {**payload, "error": error})
+
+    async def bury(self, queue_name: str, payload: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def oldest_age(self, queue_name: str, consumer) -> float:
+        """Сколько секунд ждёт самое старое сообщение очереди (по всем полосам)"""
+        raise NotImplementedError
+
+    @staticmethod
+    def payload_age(payload) -> float:
+        """Возраст по полю timestamp (его ставят бот и агенты); 0, если поля нет"""
+        try:
+            return max(0.0, (datetime.now() - datetime.fromisoformat(payload["timestamp"])).total_seconds())
+        except (KeyError, TypeError, ValueError):
+            return 0.0
+
+
+class ListQueueTransport(QueueTransport):
+    """Пакетный транспорт поверх списков Redis"""
+
+    mode = "list"
+
+    async def receive(self, queues: List[str], count: Optional[int] = None) -> List[QueueItem]:
+        """
+        Блокируется до первого элемента в любой из полос (BLPOP проверяет их по порядку планировщика),
+        затем без ожидания забирает ещё до limit - 1 элементов из той же полосы
+        """
+        first = await self.redis_client.blpop(self.scheduler.lanes(queues), timeout=self.max_wait)
+        if first is None:
+            return []
+
+        queue_name, data = first
+        queue_name = as_text(queue_name)
+        raw_items = [data]
+
+        limit = self.limit(count)
+        if limit > 1:
+            rest = await self.redis_client.lpop(queue_name, limit - 1)
+            if rest:
+                raw_items.extend(rest)
+
+        items = []
+        for raw in raw_items:
+            payload = self.decode(queue_name, raw)
+            if payload is not None:
+                items.append((queue_name, payload, None))
+
+        return await self.restore(items)
+
+    async def send(self, outputs: List[Tuple[str, Dict[str, Any]]], processed: List[QueueItem] = None):
+        """Отправляет все выходы одной транзакцией (подтверждать в списках нечего)"""
+        if not outputs:
+            return
+
+        by_queue, stores = self.encode_outputs(outputs)
+        pipe = self.redis_client.pipeline(transaction=True)
+        self.store_messages(pipe, stores)
+        for queue_name, values in by_queue.items():
+            pipe.rpush(queue_name, *values)
+        await pipe.execute()
+        self.stored(stores)
+
+    async def depth(self, queue_name: str, consumer) -> int:
+        pipe = self.redis_client.pipeline(transaction=False)
+        for lane in self.all_lanes(queue_name):
+            pipe.llen(lane)
+        return sum(await pipe.execute())
+
+    async def oldest_age(self, queue_name: str, consumer) -> float:
+        pipe = self.redis_client.pipeline(transaction=False)
+        for lane in self.all_lanes(queue_name):
+            pipe.lindex(lane, 0)
+        ages = [self.payload_age(self.decode(queue_name, raw)) for raw in await pipe.execute() if raw]
+        return max(ages, default=0.0)
+
+    async def bury(self, queue_name: str, payload: Dict[str, Any]):
+        # Без конверта: сообщение в dead должно пережить TTL хэша сообщения
+        await self.redis_client.rpush(dead_queue(queue_name), pack(payload))
+
+
+class StreamQueueTransport(QueueTransport):
+    """
+    Транспорт поверх Redis Streams.
+    Каждый агент читает свою consumer group, несколько копий агента делят работу.
+    Запись подтверждается (XACK) только вместе с записью её выходов,
+    поэтому при pkill -9 необработанные записи остаются в PEL и забираются другими копиями.
+    """
+
+    mode = "stream"
+
+    def __init__(self, redis_client, logger, group: str, batch_size: int = 1, max_wait: float = 1):
+        super().__init__(redis_client, logger, batch_size, max_wait)
+        self.group = group
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._ready_streams = set()
+        self._last_claim: Dict[str, float] = {}
+
+    async def ensure_group(self, stream: str):
+        if stream in self._ready_streams:
+            return
+        try:
+            await self.redis_client.xgroup_create(stream, self.group, id="0", mkstream=True)
+            self.logger.info(f"✅ Создана consumer group {self.group} для {stream}")
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._ready_streams.add(stream)
+
+    async def _to_items(self, stream: str, entries) -> List[QueueItem]:
+        items = []
+        poison = []
+        for entry_id, fields in entries:
+            entry_id = as_text(entry_id)
+            # Запись могла быть удалена тримингом, пока висела в PEL
+            if not fields:
+                poison.append(entry_id)
+                continue
+            payload = self.decode(stream, fields.get(b"data", fields.get("data")))
+            if payload is None:
+                poison.append(entry_id)
+                continue
+            items.append((stream, payload, entry_id))
+
+        # Битые записи подтверждаем сразу, иначе они будут переклеймиться бесконечно
+        if poison:
+            await self.redis_client.xack(stream, self.group, *poison)
+        return items
+
+    async def claim_stuck(self, stream: str, count: int) -> List[QueueItem]:
+        """Забирает записи, которые другой consumer взял, но не подтвердил за STREAM_CLAIM_IDLE_MS"""
+        now = time.monotonic()
+        if now - self._last_claim.get(stream, 0) < STREAM_CLAIM_INTERVAL:
+            return []
+        self._last_claim[stream] = now
+
+        response = await self.redis_client.xautoclaim(
+            stream, self.group, self.consumer,
+            min_idle_time=STREAM_CLAIM_IDLE_MS,
+            start_id="0-0",
+            count=count
+        )
+        entries = response[1] if len(response) > 1 else []
+        if entries:
+            self.logger.warning(f"♻️ Забрано зависших записей из {stream}: {len(entries)}")
+        return await self._to_items(stream, entries)
+
+    async def receive(self, queues: List[str], count: Optional[int] = None) -> List[QueueItem]:
+        lanes = self.scheduler.lanes(queues)
+        for stream in lanes:
+            await self.ensure_group(stream)
+
+        limit = self.limit(count)
+        items = []
+        for stream in lanes:
+            items.extend(await self.claim_stuck(stream, limit))
+        if items:
+            return await self.restore(items)
+
+        # Без ожидания - по полосам в порядке планировщика
+        for stream in lanes:
+            response = await self.redis_client.xreadgroup(self.group, self.consumer, {stream: ">"}, count=limit)
+            for _, entries in response or []:
+                items.extend(await self._to_items(stream, entries))
+            if items:
+                return await self.restore(items)
+
+        # Все полосы пусты - ждём первую запись в любой
+        response = await self.redis_client.xreadgroup(
+            self.group, self.consumer,
+            {stream: ">" for stream in lanes},
+            count=limit,
+            block=int(self.max_wait * 1000)
+        )
+        for stream, entries in response or []:
+            items.extend(await self._to_items(as_text(stream), entries))
+        return await self.restore(items)
+
+    async def send(self, outputs: List[Tuple[str, Dict[str, Any]]], processed: List[QueueItem] = None):
+        """XADD всех выходов и XACK обработанных записей в одной транзакции"""
+        acks: Dict[str, List[str]] = {}
+        for stream, _, entry_id in processed or []:
+            if entry_id:
+                acks.setdefault(stream, []).append(entry_id)
+
+        if not outputs and not acks:
+            return
+
+        by_queue, stores = self.encode_outputs(outputs)
+        pipe = self.redis_client.pipeline(transaction=True)
+        self.store_messages(pipe, stores)
+        for stream, values in by_queue.items():
+            for value in values:
+                pipe.xadd(stream, {"data": value}, maxlen=STREAM_MAXLEN, approximate=True)
+        for stream, ids in acks.items():
+            pipe.xack(stream, self.group, *ids)
+        await pipe.execute()
+        self.stored(stores)
+
+    async def fail(self, item: QueueItem, error: str):
+        """
+        Обработка записи упала. Пока доставок меньше QUEUE_MAX_DELIVERIES, запись остаётся в PEL
+        (её снова заберёт XAUTOCLAIM), потом подтверждается и уходит в стрим {очередь}:dead
+        """
+        stream, payload, entry_id = item
+        if not entry_id:
+            return
+        pending = await self.redis_client.xpending_range(stream, self.group, min=entry_id, max=entry_id, count=1)
+        deliveries = int(pending[0]["times_delivered"]) if pending else 1
+        if deliveries < QUEUE_MAX_DELIVERIES:
+            return
+
+        dead = dead_queue(stream)
+        pipe = self.redis_client.pipeline(transaction=True)
+        # Без конверта: запись в dead должна пережить TTL хэша сообщения
+        pipe.xadd(dead, {"data": pack(payload), "error": error, "stream": stream, "deliveries": deliveries},
+                  maxlen=STREAM_MAXLEN, approximate=True)
+        pipe.xack(stream, self.group, entry_id)
+        await pipe.execute()
+        self.logger.error(f"☠️ Запись {entry_id} из {stream} не обработана за {deliveries} доставок, перенесена в {dead}: {error}")
+
+    async def depth(self, queue_name: str, consumer) -> int:
+        """Непрочитанные + неподтверждённые записи для consumer group получателя (по всем полосам)"""
+        total = 0
+        for lane in self.all_lanes(queue_name):
+            total += await self._lane_depth(lane, consumer)
+        return total
+
+    async def oldest_age(self, queue_name: str, consumer) -> float:
+        """Возраст первой непрочитанной группой записи (время берём из её id)"""
+        group = consumer_group_name(consumer)
+        oldest = None
+        for lane in self.all_lanes(queue_name):
+            try:
+                groups = await self.redis_client.xinfo_groups(lane)
+            except redis.exceptions.ResponseError:
+                continue
+            for info in groups:
+                if as_text(info.get("name")) != group:
+                    continue
+                last_id = as_text(info.get("last-delivered-id"))
+                entries = await self.redis_client.xrange(lane, min=f"({last_id}", max="+", count=1)
+                if entries:
+                    millis = int(as_text(entries[0][0]).split("-")[0])
+                    oldest = millis if oldest is None else min(oldest, millis)
+        return max(0.0, time.time() - oldest / 1000) if oldest is not None else 0.0
+
+    async def _lane_depth(self, queue_name: str, consumer) -> int:
+        group = consumer_group_name(consumer)
+        try:
+            for info in await self.redis_client.xinfo_groups(queue_name):
+                if as_text(info.get("name")) == group:
+                    lag = info.get("lag")
+                    if lag is None:
+                        return await self.redis_client.xlen(queue_name)
+                    return int(lag) + int(info.get("pending", 0))
+        except redis.exceptions.ResponseError:
+            return 0
+        return await self.redis_client.xlen(queue_name)
+
+
+# Очереди режима memory: общие для всех агентов процесса, имена - как у QUEUE_AGENT_*
+_memory_queues: Dict[str, asyncio.Queue] = {}
+
+
+def get_memory_queue(queue_name: str) -> asyncio.Queue:
+    queue = _memory_queues.get(queue_name)
+    if queue is None:
+        queue = _memory_queues[queue_name] = asyncio.Queue()
+    return queue
+
+
+class MemoryQueueTransport(QueueTransport):
+    """
+    Транспорт для однопроцессного режима (local_pipeline.py).
+    Payload передаётся объектом, без сериализации и конвертов; подтверждать нечего
+    """
+
+    mode = "memory"
+
+    def _drain(self, queues: List[str], limit: int) -> List[QueueItem]:
+        items = []
+        for queue_name in queues:
+            queue = get_memory_queue(queue_name)
+            while len(items) < limit and not queue.empty():
+                items.append((queue_name, queue.get_nowait(), None))
+        return items
+
+    async def receive(self, queues: List[str], count: Optional[int] = None) -> List[QueueItem]:
+        limit = self.limit(count)
+        lanes = self.scheduler.lanes(queues)
+        items = self._drain(lanes, limit)
+        if items:
+            return items
+
+        # Ждём первый элемент в любой из полос не дольше max_wait
+        getters = {asyncio.ensure_future(get_memory_queue(name).get()): name for name in lanes}
+        done, pending = await asyncio.wait(getters, timeout=self.max_wait, return_when=asyncio.FIRST_COMPLETED)
+        for getter in pending:
+            getter.cancel()
+        for getter in done:
+            items.append((getters[getter], getter.result(), None))
+
+        items.extend(self._drain(lanes, limit - len(items)))
+        return items
+
+    async def send(self, outputs: List[Tuple[str, Dict[str, Any]]], processed: List[QueueItem] = None):
+        for queue_name, payload in outputs:
+            # Копия на очередь: получатели не должны видеть изменения друг друга
+            lane = priority_queue(queue_name, payload.get("priority"))
+            get_memory_queue(lane).put_nowait(dict(payload))
+
+    async def bury(self, queue_name: str, payload: Dict[str, Any]):
+        get_memory_queue(dead_queue(queue_name)).put_nowait(payload)
+
+    async def depth(self, queue_name: str, consumer) -> int:
+        return sum(get_memory_queue(lane).qsize() for lane in self.all_lanes(queue_name))
+
+    async def oldest_age(self, queue_name: str, consumer) -> float:
+        ages = []
+        for lane in self.all_lanes(queue_name):
+            queue = get_memory_queue(lane)
+            if not queue.empty():
+                # asyncio.Queue не умеет peek - смотрим во внутренний deque
+                ages.append(self.payload_age(queue._queue[0]))
+        return max(ages, default=0.0)
+
+
+def create_transport(redis_client, logger, agent_id) -> QueueTransport:
+    """
+    Создаёт транспорт (list/stream/memory по QUEUE_TRANSPORT) с настройками пакета для агента.
+    redis_client должен работать с байтами: aioredis.Redis(**get_redis_config(binary=True))
+    """
+    settings = get_batch_settings(agent_id)
+    if QUEUE_TRANSPORT == "memory":
+        return MemoryQueueTransport(
+            redis_client,
+            logger,
+            batch_size=settings["batch_size"],
+            max_wait=settings["max_wait"]
+        )
+    if QUEUE_TRANSPORT == "stream":
+        return StreamQueueTransport(
+            redis_client,
+            logger,
+            group=consumer_group_name(agent_id),
+            batch_size=settings["batch_size"],
+            max_wait=settings["max_wait"]
+        )
+    return ListQueueTransport(
+        redis_client,
+        logger,
+        batch_size=settings["batch_size"],
+        max_wait=settings["max_wait"]
+    )
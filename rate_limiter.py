@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🚦 ОБЩИЙ ЛИМИТ ЗАПРОСОВ К ПРОВАЙДЕРАМ
+✅ Token bucket в Redis: два ведра на провайдера/модель/API ключ - запросы в минуту и токены в минуту
+✅ Один атомарный Lua-скрипт на вызов, время - часы Redis (одинаковые для всех процессов и серверов)
+✅ Резервирование: скрипт списывает сразу и говорит, сколько подождать - без повторных опросов
+✅ Ожидание дольше LLM_RATE_MAX_WAIT не резервируется - вызов уходит в fallback агента
+✅ Счётчики (вызовы, сколько ждали, суммарное ожидание, отказы) - хэш ratelimit:stats, видны в «📊 Статус»
+"""
+
+import asyncio
+import hashlib
+import math
+import time
+from typing import Dict, Optional
+
+from config import (
+    LLM_RATE_LIMIT_ENABLED,
+    LLM_RATE_LIMITS,
+    LLM_RATE_MAX_WAIT,
+    setup_logging,
+)
+
+logger = setup_logging("RATE LIMIT")
+
+STATS_KEY = "ratelimit:stats"
+STATS_FIELDS = ("calls", "waited", "wait_ms", "rejected")
+
+# Ведро наполняется за минуту; ключ живёт две минуты без вызовов (потом ведро снова полное)
+BUCKET_TTL_MS = 120000
+
+# KEYS[1] - ведро, KEYS[2] - счётчики; ARGV: rpm, tpm, токены вызова, макс. ожидание (мс), имя ведра
+ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local rpm, tpm = tonumber(ARGV[1]), tonumber(ARGV[2])
+local cost = math.min(tonumber(ARGV[3]), tpm)
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'ts')
+local requests = tonumber(state[1]) or rpm
+local tokens = tonumber(state[2]) or tpm
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+requests = math.min(rpm, requests + elapsed * rpm / 60000)
+tokens = math.min(tpm, tokens + elapsed * tpm / 60000)
+local wait = math.ceil(math.max(0, (1 - requests) * 60000 / rpm, (cost - tokens) * 60000 / tpm))
+if wait > tonumber(ARGV[4]) then
+    redis.call('HINCRBY', KEYS[2], ARGV[5] .. ':rejected', 1)
+    return -wait
+end
+redis.call('HSET', KEYS[1], 'requests', tostring(requests - 1), 'tokens', tostring(tokens - cost), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ARGV[6])
+redis.call('HINCRBY', KEYS[2], ARGV[5] .. ':calls', 1)
+if wait > 0 then
+    redis.call('HINCRBY', KEYS[2], ARGV[5] .. ':waited', 1)
+    redis.call('HINCRBY', KEYS[2], ARGV[5] .. ':wait_ms', wait)
+end
+return wait
+"""
+
+
+def bucket_name(provider: str, model: str, api_key: str) -> str:
+    """Ключ - хэш API ключа, а не сам ключ"""
+    key_id = hashlib.sha1((api_key or "").encode("utf-8")).hexdigest()[:8]
+    return f"{provider}:{model}:{key_id}"
+
+
+def bucket_key(name: str) -> str:
+    return f"ratelimit:{name}"
+
+
+def limits_for(provider: str, model: str) -> Optional[Dict[str, int]]:
+    return LLM_RATE_LIMITS.get(model) or LLM_RATE_LIMITS.get(provider)
+
+
+class RateLimiter:
+    """redis_client со строками; None - вёдра в памяти процесса (режим memory)"""
+
+    def __init__(self):
+        self.redis_client = None
+        self._script = None
+        # {имя ведра: [запросы, токены, время]} и {"имя:поле": n} для режима memory
+        self._local: Dict[str, list] = {}
+        self._local_stats: Dict[str, int] = {}
+
+    def bind(self, redis_client):
+        self.redis_client = redis_client
+        self._script = redis_client.register_script(ACQUIRE_SCRIPT) if redis_client is not None else None
+
+    def _reserve_local(self, name: str, rpm: int, tpm: int, cost: int, max_wait_ms: int) -> int:
+        now = time.monotonic() * 1000
+        requests, tokens, seen = self._local.get(name, (rpm, tpm, now))
+        elapsed = max(0, now - seen)
+        requests = min(rpm, requests + elapsed * rpm / 60000)
+        tokens = min(tpm, tokens + elapsed * tpm / 60000)
+        cost = min(cost, tpm)
+        wait = math.ceil(max(0, (1 - requests) * 60000 / rpm, (cost - tokens) * 60000 / tpm))
+        if wait > max_wait_ms:
+            self._count(name, "rejected", 1)
+            return -wait
+        self._local[name] = [requests - 1, tokens - cost, now]
+        self._count(name, "calls", 1)
+        if wait > 0:
+            self._count(name, "waited", 1)
+            self._count(name, "wait_ms", wait)
+        return wait
+
+    def _count(self, name: str, field: str, value: int):
+        key = f"{name}:{field}"
+        self._local_stats[key] = self._local_stats.get(key, 0) + value
+
+    async def acquire(self, provider: str, model: str, api_key: str, tokens: int) -> Optional[float]:
+        """
+        Резервирует один запрос и tokens токенов. Возвращает, сколько секунд пришлось подождать;
+        None - ждать пришлось бы дольше LLM_RATE_MAX_WAIT (ничего не списано)
+        """
+        limits = limits_for(provider, model)
+        if not LLM_RATE_LIMIT_ENABLED or not limits:
+            return 0.0
+
+        name = bucket_name(provider, model, api_key)
+        max_wait_ms = int(LLM_RATE_MAX_WAIT * 1000)
+        if self._script is None:
+            wait = self._reserve_local(name, limits["rpm"], limits["tpm"], tokens, max_wait_ms)
+        else:
+            try:
+                wait = int(await self._script(
+                    keys=[bucket_key(name), STATS_KEY],
+                    args=[limits["rpm"], limits["tpm"], tokens, max_wait_ms, name, BUCKET_TTL_MS],
+                ))
+            except Exception as e:
+                # Redis недоступен - не блокируем вызовы, лимит провайдера защитит себя сам (429)
+                logger.warning(f"⚠️ Лимитер недоступен, вызов без лимита: {e}")
+                return 0.0
+
+        if wait < 0:
+            return None
+        if wait:
+            logger.info(f"⏳ {provider}/{model}: жду {wait} мс до лимита провайдера")
+            await asyncio.sleep(wait / 1000)
+        return wait / 1000
+
+
+async def read_stats(redis_client) -> Dict[str, Dict[str, int]]:
+    """{имя ведра: {calls, waited, wait_ms, rejected}} для «📊 Статус»"""
+    if redis_client is None:
+        raw = rate_limiter._local_stats
+    else:
+        raw = await redis_client.hgetall(STATS_KEY)
+    stats: Dict[str, Dict[str, int]] = {}
+    for key, value in raw.items():
+        name, _, field = key.rpartition(":")
+        if field in STATS_FIELDS:
+            stats.setdefault(name, dict.fromkeys(STATS_FIELDS, 0))[field] = int(value)
+    return stats
+
+
+# Один лимитер на процесс
+rate_limiter = RateLimiter()
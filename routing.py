@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🚦 ПРИОРИТЕТЫ СООБЩЕНИЙ
+✅ Дешёвая локальная оценка приоритета (HIGH/MEDIUM/LOW) без LLM
+✅ Полосы очередей: queue:agent2:input:high, queue:agent2:input (MEDIUM), queue:agent2:input:low
+✅ Взвешенный round-robin по полосам: HIGH обслуживается первым, LOW не голодает
+✅ Локальный вердикт по словарю (lexicon.py) - для режима перегрузки local_only
+✅ Маршрут Агента 1 (SIMPLE/COMPLEX/BOTH) по признакам сообщения без LLM; кто по маршруту докладывает модераторам
+✅ Каскад: ранний выход после уверенного решения Агента 2
+"""
+
+from typing import Dict, Any, List, Optional
+
+from config import (
+    PRIORITY_LEVELS,
+    PRIORITY_WEIGHTS,
+    DEFAULT_PRIORITY,
+    ROUTER_SIMPLE_MAX_LENGTH,
+    ROUTER_COMPLEX_MIN_LENGTH,
+    ROUTER_REPEAT_OFFENDER,
+    CASCADE_CLEAN_CONFIDENCE,
+    CASCADE_VIOLATION_CONFIDENCE,
+    CASCADE_VIOLATION_SEVERITY,
+)
+from lexicon import base_lexicon, lexicon_verdict, is_decisive, LINK_RE
+
+# ============================================================================
+# ПОЛОСЫ ОЧЕРЕДЕЙ
+# ============================================================================
+
+# MEDIUM живёт в исходной очереди: отправители, не знающие о приоритетах, пишут туда же
+LANE_SUFFIXES = {"HIGH": ":high", "MEDIUM": "", "LOW": ":low"}
+
+
+def normalize_priority(priority: Optional[str]) -> str:
+    priority = str(priority or "").upper()
+    return priority if priority in PRIORITY_LEVELS else DEFAULT_PRIORITY
+
+
+def priority_queue(queue_name: str, priority: Optional[str]) -> str:
+    """Имя полосы очереди для приоритета"""
+    return queue_name + LANE_SUFFIXES[normalize_priority(priority)]
+
+
+def base_queue(queue_name: str) -> str:
+    """Исходное имя очереди по имени полосы"""
+    for suffix in LANE_SUFFIXES.values():
+        if suffix and queue_name.endswith(suffix):
+            return queue_name[:-len(suffix)]
+    return queue_name
+
+
+def raise_priority(priority: Optional[str], minimum: str) -> str:
+    """Повышает приоритет до minimum (понижать нельзя)"""
+    priority = normalize_priority(priority)
+    return min(priority, minimum, key=PRIORITY_LEVELS.index)
+
+
+class PriorityScheduler:
+    """
+    Smooth weighted round-robin по полосам.
+    Каждое чтение начинается с полосы, выбранной по весам PRIORITY_WEIGHTS,
+    остальные идут следом по убыванию приоритета. Если заняты все полосы,
+    доли чтений равны весам, поэтому LOW получает свою долю даже под нагрузкой
+    """
+
+    def __init__(self, weights: Dict[str, int] = None):
+        self.weights = weights or PRIORITY_WEIGHTS
+        self._current = {priority: 0 for priority in PRIORITY_LEVELS}
+
+    def next_order(self) -> List[str]:
+        total = 0
+        for priority in PRIORITY_LEVELS:
+            weight = max(1, int(self.weights.get(priority, 1)))
+            self._current[priority] += weight
+            total += weight
+
+        first = max(PRIORITY_LEVELS, key=lambda priority: self._current[priority])
+        self._current[first] -= total
+        return [first] + [priority for priority in PRIORITY_LEVELS if priority != first]
+
+    def lanes(self, queues: List[str]) -> List[str]:
+        """Полосы всех очередей в порядке чтения"""
+        return [priority_queue(queue_name, priority) for priority in self.next_order() for queue_name in queues]
+
+# ============================================================================
+# ЛОКАЛЬНАЯ ОЦЕНКА ПРИОРИТЕТА
+# ============================================================================
+
+def score_priority(message: str, found: Optional[Dict[str, List[str]]] = None) -> str:
+    """
+    Оценивает приоритет сообщения за микросекунды: угрозы - HIGH, короткий безобидный текст - LOW.
+    found - уже посчитанные совпадения словаря (lexicon.py), чтобы не искать повторно
+    """
+    if not message or not message.strip():
+        return "LOW"
+
+    if found is None:
+        found = base_lexicon.categories(message)
+    if "threat" in found:
+        return "HIGH"
+
+    has_link = bool(LINK_RE.search(message))
+    letters = [char for char in message if char.isalpha()]
+    shouting = len(letters) >= 10 and sum(char.isupper() for char in letters) / len(letters) > 0.7
+
+    if has_link or shouting or found:
+        return "MEDIUM"
+    if len(message) < 40:
+        return "LOW"
+    return DEFAULT_PRIORITY
+
+
+def priority_by_verdict(priority: Optional[str], severity, is_violation: bool = False) -> str:
+    """Повышает приоритет по результату анализа: серьёзное нарушение - сразу HIGH"""
+    try:
+        severity = float(severity or 0)
+    except (TypeError, ValueError):
+        severity = 0
+    if severity >= 7:
+        return "HIGH"
+    if is_violation:
+        return raise_priority(priority, "MEDIUM")
+    return normalize_priority(priority)
+
+
+def local_verdict(message: str) -> Dict[str, Any]:
+    """
+    Вердикт без LLM по словарю (режим перегрузки local_only): решает и спорные случаи.
+    Формат - как у analyze_with_mistral Агента 2
+    """
+    verdict = lexicon_verdict(message, base_lexicon.categories(message), decisive_only=False)
+    if verdict is not None:
+        verdict.pop("category", None)
+        verdict["explanation"] = "Режим перегрузки: решение без LLM"
+        return verdict
+
+    return {
+        "is_violation": False,
+        "type": "none",
+        "severity": 0,
+        "confidence": 50,
+        "action": "none",
+        "reason": "Локальная проверка: нарушений не найдено",
+        "explanation": "Режим перегрузки: решение без LLM"
+    }
+
+# ============================================================================
+# МАРШРУТ АГЕНТА 1
+# ============================================================================
+
+ROUTES = ("SIMPLE", "COMPLEX", "BOTH")
+
+
+def route_features(message: str, found: Optional[Dict[str, List[str]]] = None,
+                   history: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Признаки для выбора маршрута: всё считается локально за микросекунды"""
+    message = message or ""
+    if found is None:
+        found = base_lexicon.categories(message)
+    history = history or {}
+    return {
+        "length": len(message),
+        "links": len(LINK_RE.findall(message)),
+        "categories": sorted(found),
+        "decisive": [category for category in found if is_decisive(category, message)],
+        "violations": int(history.get("violations", 0)),
+        "priority": score_priority(message, found),
+    }
+
+
+def local_route(features: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Маршрут по признакам (формат - как у coordinate_with_mistral Агента 1).
+    Уверенность низкая, когда признаки спорят друг с другом - такие случаи можно отдать LLM
+    """
+    priority = features["priority"]
+    categories = features["categories"]
+
+    if "threat" in categories or features["violations"] >= ROUTER_REPEAT_OFFENDER:
+        route, confidence, reasoning = "BOTH", 0.9, "угроза или повторный нарушитель - полный путь"
+        priority = "HIGH"
+    elif categories and len(features["decisive"]) == len(categories):
+        # Однозначные слова словаря: Агенту 2 достаточно подтвердить
+        route, confidence, reasoning = "SIMPLE", 0.8, f"однозначный словарь: {', '.join(categories)}"
+    elif categories:
+        # Оскорбления и спам без ссылки зависят от контекста
+        route, confidence, reasoning = "BOTH", 0.7, f"спорный словарь: {', '.join(categories)}"
+    elif features["length"] >= ROUTER_COMPLEX_MIN_LENGTH:
+        route, confidence, reasoning = "COMPLEX", 0.7, "длинный текст - сразу глубокий анализ"
+    elif features["links"]:
+        # Ссылка без слов спама: может быть и полезной, и рекламой
+        route, confidence, reasoning = "BOTH", 0.5, "ссылки без совпадений словаря"
+    elif features["length"] <= ROUTER_SIMPLE_MAX_LENGTH:
+        route, confidence, reasoning = "SIMPLE", 0.8, "короткий текст без ссылок и совпадений словаря"
+    else:
+        route, confidence, reasoning = "BOTH", 0.5, "средний текст без явных признаков"
+
+    if features["violations"] and route == "SIMPLE":
+        route, confidence, reasoning = "BOTH", 0.6, reasoning + "; у автора были нарушения"
+
+    return {
+        "route": route,
+        "priority": priority,
+        "strategy": route,
+        "confidence": confidence,
+        "reasoning": f"Локально: {reasoning}",
+    }
+
+
+def reported_by_agent2(route: Optional[str]) -> bool:
+    """
+    Видели ли модераторы мнение Агента 2 (queue:agent2:output). COMPLEX идёт мимо Агента 2 -
+    тогда модераторам докладывается решение Агента 5
+    """
+    return route != "COMPLEX"
+
+# ============================================================================
+# КАСКАД
+# ============================================================================
+
+def cascade_exit(verdict: Dict[str, Any]) -> Optional[str]:
+    """
+    Ранний выход по решению Агента 2: "clean" или "violation" - мнения агентов 3 и 4 не нужны,
+    None - спорная зона (ошибки и fallback Агента 2 с нулевой уверенностью всегда сюда)
+    """
+    try:
+        confidence = float(verdict.get("confidence") or 0)
+        severity = float(verdict.get("severity") or 0)
+    except (TypeError, ValueError):
+        return None
+
+    if not verdict.get("is_violation") and verdict.get("action", "none") == "none":
+        return "clean" if confidence >= CASCADE_CLEAN_CONFIDENCE else None
+    if confidence >= CASCADE_VIOLATION_CONFIDENCE and severity >= CASCADE_VIOLATION_SEVERITY:
+        return "violation"
+    return None
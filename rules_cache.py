@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📜 ПРАВИЛА ЧАТОВ
+✅ Свои правила чата - Redis-ключ rules:chat:{chat_id} (источник правды для агентов), копия - chats.custom_rules в Postgres
+✅ Агенты держат правила в памяти процесса: на сообщение - только поиск в словаре, без Redis и БД
+✅ Изменение правил (/rules в боте) публикуется в канал rules:changed - агенты сбрасывают правила чата сразу
+✅ RULES_CACHE_TTL - страховка на случай пропущенного уведомления (канал был недоступен)
+✅ Нет своих правил - DEFAULT_RULES; правила из payload (если вызывающий их передал) важнее
+"""
+
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from config import DEFAULT_RULES, RULES_CACHE_TTL, RULES_MAX_COUNT, setup_logging
+
+logger = setup_logging("CHAT RULES")
+
+RULES_CHANNEL = "rules:changed"
+
+# Правила чатов в режиме memory (без Redis)
+_local_rules: Dict[str, str] = {}
+
+
+def rules_key(chat_id) -> str:
+    return f"rules:chat:{chat_id}"
+
+
+def parse_rules(text: Optional[str]) -> List[str]:
+    """Текст правил (по одному в строке или через ';') -> список, не больше RULES_MAX_COUNT"""
+    if not text:
+        return []
+    rules = [rule.strip() for line in text.splitlines() for rule in line.split(";")]
+    return [rule for rule in rules if rule][:RULES_MAX_COUNT]
+
+
+def format_rules_text(rules: List[str]) -> str:
+    """Список правил -> текст для Redis и chats.custom_rules (по правилу в строке)"""
+    return "\n".join(rules)
+
+
+class ChatRules:
+    """redis_client со строками; None - правила только внутри процесса (режим memory)"""
+
+    def __init__(self, redis_client=None):
+        self.redis_client = redis_client
+        # {chat_id: (до какого времени верить, правила)}
+        self._rules: Dict[str, Tuple[float, List[str]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def bind(self, redis_client):
+        self.redis_client = redis_client
+        self._rules.clear()
+
+    async def get(self, chat_id) -> List[str]:
+        """Правила чата: из памяти процесса, при промахе - из Redis (DEFAULT_RULES, если своих нет)"""
+        if chat_id is None:
+            return DEFAULT_RULES
+        key = str(chat_id)
+        cached = self._rules.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        if self.redis_client is None:
+            text = _local_rules.get(key)
+        else:
+            try:
+                text = await self.redis_client.get(rules_key(chat_id))
+            except Exception as e:
+                # Redis недоступен - последние известные правила лучше правил по умолчанию
+                logger.warning(f"⚠️ Правила чата {chat_id} недоступны: {e}")
+                return cached[1] if cached else DEFAULT_RULES
+        rules = parse_rules(text) or DEFAULT_RULES
+        self._rules[key] = (time.monotonic() + RULES_CACHE_TTL, rules)
+        return rules
+
+    async def for_payload(self, payload: Dict[str, Any]) -> List[str]:
+        """Правила для сообщения: переданные в payload или правила его чата"""
+        return payload.get("rules") or await self.get(payload.get("chat_id"))
+
+    async def set(self, chat_id, rules: List[str]):
+        """Новые правила чата (пустой список - снова DEFAULT_RULES); все агенты узнают через канал"""
+        key = str(chat_id)
+        text = format_rules_text(rules)
+        if self.redis_client is None:
+            if text:
+                _local_rules[key] = text
+            else:
+                _local_rules.pop(key, None)
+            self._rules.pop(key, None)
+            return
+
+        pipe = self.redis_client.pipeline(transaction=True)
+        if text:
+            pipe.set(rules_key(chat_id), text)
+        else:
+            pipe.delete(rules_key(chat_id))
+        pipe.publish(RULES_CHANNEL, key)
+        await pipe.execute()
+        self._rules.pop(key, None)
+
+    # ------------------------------------------------------------------------
+    # Уведомления об изменениях
+    # ------------------------------------------------------------------------
+
+    async def listen(self):
+        if self.redis_client is not None and self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub()
+                await pubsub.subscribe(RULES_CHANNEL)
+                # Пока канала не было, уведомления могли потеряться - всё перечитаем
+                self._rules.clear()
+                try:
+                    async for message in pubsub.listen():
+                        if message.get("type") == "message":
+                            self._rules.pop(message["data"], None)
+                            logger.info(f"📜 Правила чата {message['data']} изменились")
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Канал правил недоступен: {e}")
+                await asyncio.sleep(1)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+# Один кэш правил на процесс
+chat_rules = ChatRules()
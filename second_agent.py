@@ -10,81 +10,46 @@
 """
 
 import json
-import redis
-import time
-from typing import Dict, Any, List
+import asyncio
+from typing import Dict, Any, List, Optional, Callable
 from datetime import datetime
 
-try:
-    from mistralai import Mistral
-    from mistralai.models.chat_completion import ChatMessage
-    MISTRAL_IMPORT_SUCCESS = True
-    MISTRAL_IMPORT_VERSION = "v1.0+ (новый SDK)"
-except ImportError:
-    try:
-        from mistralai.client import MistralClient as Mistral
-        from mistralai.models.chat_completion import ChatMessage
-        MISTRAL_IMPORT_SUCCESS = True
-        MISTRAL_IMPORT_VERSION = "v0.0.11 (legacy)"
-    except Exception as e:
-        MISTRAL_IMPORT_SUCCESS = False
-        
-        class Mistral:
-            def __init__(self, api_key=None): 
-                pass
-            def chat(self, **kwargs):
-                raise ImportError("Mistral AI не установлен")
-        
-        class ChatMessage:
-            def __init__(self, role, content):
-                self.role = role
-                self.content = content
-
 from config import (
     MISTRAL_API_KEY, MISTRAL_MODEL, MISTRAL_GENERATION_PARAMS,
-    get_redis_config, QUEUE_AGENT_2_INPUT, QUEUE_AGENT_2_OUTPUT,
-    QUEUE_AGENT_3_INPUT, QUEUE_AGENT_4_INPUT, DEFAULT_RULES, setup_logging
+    MICROBATCH_SIZE, MICROBATCH_WAIT_MS, ROUTER_SIMPLE_MIN_CONFIDENCE, CASCADE_ENABLED,
+    QUEUE_AGENT_2_INPUT, QUEUE_AGENT_2_OUTPUT,
+    QUEUE_AGENT_3_INPUT, QUEUE_AGENT_4_INPUT, QUEUE_AGENT_5_INPUT,
+    setup_logging
+)
+from agent_runtime import AsyncAgentWorker
+from llm_client import chat_stream
+from routing import normalize_priority, priority_by_verdict, local_verdict, cascade_exit
+from overload import mode_level
+from verdict_cache import verdict_cache, fingerprint, cache_key
+from metrics import metrics
+from prompt_compiler import PromptTemplate
+from token_budget import analyze_chunked
+from rules_cache import chat_rules
+from verdict_parser import (
+    ParseError, extract_object, extract_array, to_verdict, parse_counted, record_parse, json_mode_params
 )
 
 logger = setup_logging("АГЕНТ 2")
 
-if MISTRAL_IMPORT_SUCCESS:
-    logger.info(f"✅ Mistral AI импортирован ({MISTRAL_IMPORT_VERSION})")
-else:
-    logger.error("❌ Mistral AI не импортирован")
-
 # ============================================================================
 # ИНИЦИАЛИЗАЦИЯ MISTRAL
 # ============================================================================
 
-if MISTRAL_IMPORT_SUCCESS and MISTRAL_API_KEY:
-    try:
-        mistral_client = Mistral(api_key=MISTRAL_API_KEY)
-        logger.info("✅ Mistral AI клиент создан")
-    except Exception as e:
-        logger.error(f"❌ Ошибка создания Mistral AI клиента: {e}")
-        mistral_client = None
+if MISTRAL_API_KEY:
+    logger.info("✅ Mistral AI клиент создан (общий пул llm_client)")
 else:
-    mistral_client = None
-    logger.warning("⚠️ Mistral AI клиент не создан")
+    logger.warning("⚠️ Mistral AI клиент не создан: MISTRAL_API_KEY не установлен")
 
 # ============================================================================
 # ПРОМПТ ДЛЯ MISTRAL
 # ============================================================================
 
-MODERATION_PROMPT = """Ты модератор чата. Проанализируй сообщение и определи нарушает ли оно правила.
-
-ПРАВИЛА ЧАТА:
-{rules}
-
-СООБЩЕНИЕ: "{message}"
-
-ТРЕБОВАНИЯ:
-1. Ответь ТОЛЬКО JSON (никакого другого текста!)
-2. Severity: 0-10 (0=OK, 10=критично)
-3. Confidence: 0-100 (насколько уверен)
-
-ДОПУСТИМЫЕ ТИПЫ:
+MODERATION_GUIDE = """ДОПУСТИМЫЕ ТИПЫ:
 - obscene (мат, оскорбления)
 - hate_speech (ненависть к группе)
 - threat (угроза, насилие)
@@ -99,27 +64,73 @@ MODERATION_PROMPT = """Ты модератор чата. Проанализир
 - ban (блокировка пользователя)
 - mute (запрет на написание)
 - warn (предупреждение)
-- none (ничего не делать)
+- none (ничего не делать)"""
 
-JSON ФОРМАТ:
-{{
-"is_violation": boolean,
+VERDICT_FIELDS_FORMAT = """"is_violation": boolean,
 "type": "тип нарушения",
 "severity": число 0-10,
 "confidence": число 0-100,
 "action": "ban|mute|warn|none",
 "reason": "краткое объяснение",
-"explanation": "подробное объяснение"
-}}"""
+"explanation": "подробное объяснение\""""
+
+# Инструкции и правила - стабильный префикс (system), сообщение - последним (user)
+MODERATION_PROMPT = PromptTemplate("agent2", f"""Ты модератор чата. Проанализируй сообщение пользователя и определи нарушает ли оно правила чата (они ниже).
+
+ТРЕБОВАНИЯ:
+1. Ответь ТОЛЬКО JSON (никакого другого текста!)
+2. Severity: 0-10 (0=OK, 10=критично)
+3. Confidence: 0-100 (насколько уверен)
+
+{MODERATION_GUIDE}
+
+JSON ФОРМАТ:
+{{
+{VERDICT_FIELDS_FORMAT}
+}}""", message_template='СООБЩЕНИЕ: "{message}"')
+
+# Пакетный вариант (микробатчинг): нумерованный список сообщений - JSON-массив вердиктов
+BATCH_PROMPT = PromptTemplate("agent2_batch", f"""Ты модератор чата. Тебе дан нумерованный список сообщений пользователей. Для КАЖДОГО сообщения независимо определи, нарушает ли оно правила чата (они ниже).
+
+ТРЕБОВАНИЯ:
+1. Ответь ТОЛЬКО JSON-массивом (никакого другого текста!)
+2. Ровно один объект на каждое сообщение, в том же порядке; поле "id" - номер сообщения из списка
+3. Severity: 0-10 (0=OK, 10=критично)
+4. Confidence: 0-100 (насколько уверен)
+
+{MODERATION_GUIDE}
+
+JSON ФОРМАТ:
+[
+{{
+"id": номер сообщения,
+{VERDICT_FIELDS_FORMAT}
+}}
+]""", message_template="СООБЩЕНИЯ:\n{message}")
+
+# Смена модели, промпта или параметров генерации - новая версия ключей кэша вердиктов
+PROMPT_VERSION = fingerprint(MISTRAL_MODEL, MODERATION_PROMPT.version, MISTRAL_GENERATION_PARAMS)
 
 # ============================================================================
 # АНАЛИЗ С MISTRAL
 # ============================================================================
 
-def analyze_with_mistral(message: str, rules: List[str]) -> Dict[str, Any]:
-    """Анализирует сообщение с помощью Mistral"""
+# Когда эти поля ответа пришли, Агент 2 решает, не дожидаясь длинного explanation.
+# reason (короткая) нужна в уведомлении модераторам и идёт в промпте сразу после action
+DECISION_FIELDS = ("is_violation", "severity", "confidence", "action", "reason")
+
+def normalize_analysis(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Приводит вердикт модели к формату Агента 2: severity 0-10, confidence 0-100, известное действие"""
+    return to_verdict(result, default_severity=5, default_confidence=50).as_dict()
+
+async def analyze_with_mistral(message: str, rules: List[str], cache_message: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Анализирует сообщение с помощью Mistral.
+    cache_message - исходный текст сообщения, если message - он сам (а не кусок длинного текста):
+    под его ключом полный вердикт из потока попадает в кэш вердиктов
+    """
     
-    if not mistral_client:
+    if not MISTRAL_API_KEY:
         logger.error("❌ Mistral клиент не инициализирован")
         return {
             "is_violation": False,
@@ -132,53 +143,48 @@ def analyze_with_mistral(message: str, rules: List[str]) -> Dict[str, Any]:
         }
     
     try:
-        rules_text = "\n".join([f"- {rule}" for rule in rules]) if rules else "- Никаких правил"
-        prompt = MODERATION_PROMPT.format(rules=rules_text, message=message)
+        messages = MODERATION_PROMPT.messages(message, rules)
         
-        messages = [ChatMessage(role="user", content=prompt)]
+        logger.info("📤 Отправляю запрос к Mistral...")
         
-        logger.info(f"📤 Отправляю запрос к Mistral...")
+        fields: Dict[str, Any] = {}
         
-        response = mistral_client.chat(
-            model=MISTRAL_MODEL,
-            messages=messages,
-            **MISTRAL_GENERATION_PARAMS
-        )
+        def on_field(key, value) -> bool:
+            fields[key] = value
+            return all(field in fields for field in DECISION_FIELDS)
         
-        content = response.choices[0].message.content
-        logger.info(f"📥 Получен ответ от Mistral")
+        async def store_full(full_content: str):
+            # Ранний вердикт в кэш не попадает (is_cacheable), туда идёт полный - с explanation
+            full = normalize_analysis(extract_object(full_content))
+            if is_cacheable(full):
+                await verdict_cache.set(cache_key("agent2", PROMPT_VERSION, cache_message, rules), full)
+        
+        content = await chat_stream(
+            "mistral", MISTRAL_MODEL, messages, on_field, on_complete=store_full if cache_message is not None else None,
+            usage_key=MODERATION_PROMPT.name, **json_mode_params("mistral"), **MISTRAL_GENERATION_PARAMS
+        )
+        if content is None:
+            record_parse("mistral", MISTRAL_MODEL, True)
+            analysis = normalize_analysis(fields)
+            # explanation ещё не дописан: пока вместо него reason
+            analysis["explanation"] = analysis["explanation"] or analysis["reason"]
+            analysis["early"] = True
+            logger.info(
+                f"⚡ Ранний вердикт из потока: severity={analysis['severity']}, action={analysis['action']}, "
+                f"confidence={analysis['confidence']} (explanation дочитывается в фоне)"
+            )
+            return analysis
+        logger.info("📥 Получен ответ от Mistral")
         
         try:
-            json_start = content.find("{")
-            json_end = content.rfind("}") + 1
-            
-            if json_start >= 0 and json_end > json_start:
-                json_str = content[json_start:json_end]
-                result = json.loads(json_str)
-                
-                severity = int(result.get("severity", 5))
-                severity = max(0, min(10, severity))
-                
-                confidence = int(result.get("confidence", 50))
-                confidence = max(0, min(100, confidence))
-                
-                action = result.get("action", "none")
-                if action not in ["ban", "mute", "warn", "none"]:
-                    action = "warn" if result.get("is_violation") else "none"
-                
-                logger.info(f"✅ Анализ: severity={severity}, action={action}, confidence={confidence}")
-                
-                return {
-                    "is_violation": result.get("is_violation", False),
-                    "type": result.get("type", "unknown"),
-                    "severity": severity,
-                    "confidence": confidence,
-                    "action": action,
-                    "reason": result.get("reason", ""),
-                    "explanation": result.get("explanation", "")
-                }
+            analysis = normalize_analysis(parse_counted("mistral", MISTRAL_MODEL, extract_object, content))
+            logger.info(
+                f"✅ Анализ: severity={analysis['severity']}, action={analysis['action']}, "
+                f"confidence={analysis['confidence']}"
+            )
+            return analysis
         
-        except json.JSONDecodeError as e:
+        except ParseError as e:
             logger.warning(f"⚠️ Ошибка парсинга JSON: {e}")
             
             severity = 5
@@ -217,21 +223,167 @@ def analyze_with_mistral(message: str, rules: List[str]) -> Dict[str, Any]:
             "explanation": str(e)
         }
 
+# ============================================================================
+# МИКРОБАТЧИНГ: НЕСКОЛЬКО СООБЩЕНИЙ В ОДНОМ ЗАПРОСЕ
+# ============================================================================
+
+def parse_batch_response(content: str, count: int) -> List[Optional[Dict[str, Any]]]:
+    """Разбирает JSON-массив вердиктов; None - вердикт для сообщения не найден"""
+    results: List[Optional[Dict[str, Any]]] = [None] * count
+    
+    try:
+        items = parse_counted("mistral", MISTRAL_MODEL, extract_array, content)
+    except ParseError:
+        return results
+    
+    # Без номеров - только если количество совпало и порядок можно принять как есть
+    positional = len(items) == count and not any(isinstance(item, dict) and "id" in item for item in items)
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = position if positional else int(item.get("id")) - 1
+            if 0 <= index < count and results[index] is None:
+                results[index] = normalize_analysis(item)
+        except (TypeError, ValueError):
+            continue
+    return results
+
+async def analyze_batch_with_mistral(messages_text: List[str], rules: List[str],
+                                     on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> List[Optional[Dict[str, Any]]]:
+    """
+    Один запрос к Mistral на весь пакет (одинаковые правила).
+    on_result(номер, вердикт) - как только вердикт сообщения дописан в потоке, не дожидаясь всего пакета
+    """
+    numbered = "\n".join(
+        f"{number}. {json.dumps(text, ensure_ascii=False)}" for number, text in enumerate(messages_text, start=1)
+    )
+    messages = BATCH_PROMPT.messages(numbered, rules)
+    params = {**MISTRAL_GENERATION_PARAMS, "max_tokens": MISTRAL_GENERATION_PARAMS["max_tokens"] * len(messages_text)}
+    
+    logger.info(f"📤 Отправляю пакет из {len(messages_text)} сообщений к Mistral...")
+    
+    def on_item(_, item) -> bool:
+        # Досрочно - только вердикты с номером (без номеров порядок проверяется по всему массиву)
+        if on_result is not None and isinstance(item, dict):
+            try:
+                index = int(item.get("id")) - 1
+            except (TypeError, ValueError):
+                return False
+            if 0 <= index < len(messages_text):
+                on_result(index, normalize_analysis(item))
+        return False
+    
+    content = await chat_stream("mistral", MISTRAL_MODEL, messages, on_item, usage_key=BATCH_PROMPT.name, **params)
+    return parse_batch_response(content, len(messages_text))
+
+class MistralMicroBatcher:
+    """
+    Копит запросы analyze() и отправляет их одним запросом: до size сообщений или через wait_ms после первого.
+    В пакет попадают только сообщения с одинаковыми правилами. Если пакет не разобран - каждое сообщение отдельно
+    """
+    
+    def __init__(self, size: int = MICROBATCH_SIZE, wait_ms: int = MICROBATCH_WAIT_MS):
+        self.size = size
+        self.wait = wait_ms / 1000
+        self._pending: Dict[str, List[tuple]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self.stats = {"batches": 0, "batched_messages": 0, "fallbacks": 0}
+    
+    async def analyze(self, message: str, rules: List[str], cache_message: Optional[str] = None) -> Dict[str, Any]:
+        if self.size <= 1 or not MISTRAL_API_KEY:
+            return await analyze_with_mistral(message, rules, cache_message)
+        
+        loop = asyncio.get_running_loop()
+        key = fingerprint(rules)
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((message, rules, future, cache_message))
+        
+        if len(batch) >= self.size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.wait, self._flush, key)
+        return await future
+    
+    def _flush(self, key: str):
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, batch: List[tuple]):
+        messages_text = [message for message, _, _, _ in batch]
+        rules = batch[0][1]
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(batch)
+        if len(batch) == 1:
+            results = [await analyze_with_mistral(messages_text[0], rules, batch[0][3])]
+        else:
+            def resolve(index: int, result: Dict[str, Any]):
+                future = batch[index][2]
+                if not future.done():
+                    future.set_result(result)
+            
+            try:
+                results = await analyze_batch_with_mistral(messages_text, rules, on_result=resolve)
+                self.stats["batches"] += 1
+                self.stats["batched_messages"] += len(batch)
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка пакетного запроса: {e}")
+        
+        # Уже решённые досрочно (из потока) повторно не анализируем
+        missing = [index for index, result in enumerate(results) if result is None and not batch[index][2].done()]
+        if missing:
+            # Пакет не разобран целиком - недостающие сообщения по одному
+            self.stats["fallbacks"] += len(missing)
+            logger.warning(f"⚠️ Пакет: нет вердикта для {len(missing)} из {len(batch)}, анализирую по одному")
+            fallback = await asyncio.gather(*[
+                analyze_with_mistral(messages_text[index], rules, batch[index][3]) for index in missing
+            ])
+            for index, result in zip(missing, fallback):
+                results[index] = result
+        elif len(batch) > 1:
+            logger.info(f"📦 Пакет из {len(batch)} сообщений разобран одним запросом")
+        
+        for (_, _, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+# Один батчер на процесс (как llm_client)
+mistral_batcher = MistralMicroBatcher()
+
+def is_cacheable(result: Dict[str, Any]) -> bool:
+    """
+    Ошибки, fallback-парсинг и неполные вердикты в кэш не попадают: не все куски длинного текста разобраны (partial)
+    или ранний вердикт из потока (early) - полный запишет store_full
+    """
+    return (
+        result["confidence"] > 0 and result["reason"] != "Fallback парсинг"
+        and not result.get("partial") and not result.get("early")
+    )
+
 # ============================================================================
 # ОСНОВНАЯ ФУНКЦИЯ АГЕНТА 2
 # ============================================================================
 
-def moderation_agent_2(input_data: Dict[str, Any]) -> Dict[str, Any]:
-    """Агент 2 — Главный аналитик"""
+async def moderation_agent_2(input_data: Dict[str, Any], local_only: bool = False) -> Dict[str, Any]:
+    """Агент 2 — Главный аналитик (local_only - решение локальной эвристикой, режим перегрузки)"""
     
     message = input_data.get("message", "")
-    rules = input_data.get("rules", DEFAULT_RULES)
+    rules = await chat_rules.for_payload(input_data)
     user_id = input_data.get("user_id")
     username = input_data.get("username", "unknown")
     chat_id = input_data.get("chat_id")
     message_id = input_data.get("message_id")
     message_link = input_data.get("message_link", "")
     media_type = input_data.get("media_type", "")
+    priority = input_data.get("priority")
     
     logger.info(f"🔍 Анализирую сообщение от @{username}: '{message[:50]}...'")
     
@@ -249,10 +401,22 @@ def moderation_agent_2(input_data: Dict[str, Any]) -> Dict[str, Any]:
             "confidence": 100,
             "reason": "Пустое сообщение",
             "media_type": media_type,
+            "priority": normalize_priority(priority),
             "timestamp": datetime.now().isoformat()
         }
     
-    analysis_result = analyze_with_mistral(message, rules)
+    if local_only:
+        analysis_result = local_verdict(message)
+    else:
+        analysis_result = await verdict_cache.cached(
+            "agent2", PROMPT_VERSION, message, rules,
+            lambda: analyze_chunked(
+                "agent2", message,
+                # Кусок длинного текста - не само сообщение: под ключом сообщения в кэш не пишем
+                lambda text: mistral_batcher.analyze(text, rules, message if text is message else None)
+            ),
+            is_cacheable
+        )
     
     output = {
         "agent_id": 2,
@@ -270,8 +434,13 @@ def moderation_agent_2(input_data: Dict[str, Any]) -> Dict[str, Any]:
         "explanation": analysis_result["explanation"],
         "is_violation": analysis_result["is_violation"],
         "media_type": media_type,
+        # Приоритет идёт дальше к агентам 3/4/5; серьёзные нарушения обгоняют очередь
+        "priority": priority_by_verdict(priority, analysis_result["severity"], analysis_result["is_violation"]),
         "timestamp": datetime.now().isoformat()
     }
+    # Совпадения словарного фильтра (бот) - Агенту 3 для категории нарушения
+    if input_data.get("lexicon_hits"):
+        output["lexicon_hits"] = input_data["lexicon_hits"]
     
     if analysis_result["is_violation"]:
         logger.warning(
@@ -279,7 +448,7 @@ def moderation_agent_2(input_data: Dict[str, Any]) -> Dict[str, Any]:
             f"severity={analysis_result['severity']}/10, action={analysis_result['action']}"
         )
     else:
-        logger.info(f"✅ OK: сообщение в порядке")
+        logger.info("✅ OK: сообщение в порядке")
     
     return output
 
@@ -287,64 +456,67 @@ def moderation_agent_2(input_data: Dict[str, Any]) -> Dict[str, Any]:
 # REDIS WORKER
 # ============================================================================
 
-class Agent2Worker:
+class Agent2Worker(AsyncAgentWorker):
+    agent_id = 2
+    input_queues = [QUEUE_AGENT_2_INPUT]
+    # ✅ РЕЗУЛЬТАТ В ОЧЕРЕДИ АГЕНТОВ 3 И 4 (и боту)
+    output_queues = [QUEUE_AGENT_2_OUTPUT, QUEUE_AGENT_3_INPUT, QUEUE_AGENT_4_INPUT]
+    llm_providers = ["mistral"]
+    per_chat_rules = True
+    # Агент 2 - вход конвейера, здесь же меряем очереди и переключаем режим перегрузки
+    overload_controller = True
+    
     def __init__(self):
-        try:
-            redis_config = get_redis_config()
-            self.redis_client = redis.Redis(**redis_config)
-            self.redis_client.ping()
-            logger.info("✅ Подключение к Redis успешно")
-        except Exception as e:
-            logger.error(f"❌ Ошибка подключения к Redis: {e}")
-            raise
+        super().__init__(logger)
+    
+    async def process(self, input_data):
+        mode = await self.overload.get()
+        output = await moderation_agent_2(input_data, local_only=mode == "local_only")
+        if input_data.get("speculative"):
+            # Спекулятивный веер: агенты 3 и 4 уже работают, наше мнение идёт Агенту 5 в общий join
+            output["speculative"] = True
+        if mode != "normal":
+            output["overload_mode"] = mode
+        elif CASCADE_ENABLED and output.get("message"):
+            # Каскад: уверенное решение не ждёт агентов 3 и 4
+            exit_kind = cascade_exit(output)
+            metrics.count("cascade", "early_exits" if exit_kind else "escalated")
+            if exit_kind:
+                output["decision_source"] = f"cascade_{exit_kind}"
+        return output
+    
+    def route(self, payload, output):
+        if output.get("speculative"):
+            logger.info(f"📤 Спекулятивный веер: мнение Агенту 5 (action={output.get('action')})")
+            return [QUEUE_AGENT_2_OUTPUT, QUEUE_AGENT_5_INPUT]
+        if mode_level(output.get("overload_mode", "normal")) >= mode_level("skip_3_4"):
+            # Перегрузка: агенты 3 и 4 пропускаются, Агент 5 решает по мнению Агента 2
+            logger.info(f"📤 Перегрузка ({output['overload_mode']}): результат сразу Агенту 5 (action={output.get('action')})")
+            return [QUEUE_AGENT_2_OUTPUT, QUEUE_AGENT_5_INPUT]
+        if output.get("decision_source", "").startswith("cascade_"):
+            logger.info(f"📤 Каскад ({output['decision_source']}): результат сразу Агенту 5 (action={output.get('action')})")
+            return [QUEUE_AGENT_2_OUTPUT, QUEUE_AGENT_5_INPUT]
+        if payload.get("route") == "SIMPLE" and not (
+            output.get("is_violation") and output.get("confidence", 0) < ROUTER_SIMPLE_MIN_CONFIDENCE
+        ):
+            # Маршрут Агента 1: хватает проверки Агента 2 (неуверенное нарушение всё же уходит в 3 и 4)
+            logger.info(f"📤 Маршрут SIMPLE: результат сразу Агенту 5 (action={output.get('action')})")
+            return [QUEUE_AGENT_2_OUTPUT, QUEUE_AGENT_5_INPUT]
+        logger.info(f"📤 Результат отправлен в Агентов 3 и 4 (action={output.get('action')})")
+        return self.output_queues
     
     def run(self):
         """Главный цикл обработки сообщений"""
         logger.info("="*80)
         logger.info("✅ АГЕНТ 2 ЗАПУЩЕН (Главный аналитик)")
         logger.info(f"📊 Модель: {MISTRAL_MODEL}")
-        logger.info(f"📥 Импорт: {MISTRAL_IMPORT_VERSION}")
         logger.info(f"🔔 Очередь входа: {QUEUE_AGENT_2_INPUT}")
-        logger.info(f"📤 Отправляю в Агентов 3 и 4")
+        logger.info("📤 Отправляю в Агентов 3 и 4")
         logger.info("⏱️  Нажмите Ctrl+C для остановки")
         logger.info("="*80 + "\n")
         
         try:
-            while True:
-                try:
-                    result = self.redis_client.blpop(QUEUE_AGENT_2_INPUT, timeout=1)
-                    
-                    if result is None:
-                        continue
-                    
-                    queue_name, message_data = result
-                    logger.info("📨 Получено новое сообщение")
-                    
-                    try:
-                        input_data = json.loads(message_data)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"❌ Невалидный JSON: {e}")
-                        continue
-                    
-                    # Обрабатываем сообщение
-                    output = moderation_agent_2(input_data)
-                    
-                    # ✅ ОТПРАВЛЯЕМ РЕЗУЛЬТАТ В ОЧЕРЕДИ АГЕНТОВ 3 И 4
-                    try:
-                        result_json = json.dumps(output, ensure_ascii=False)
-                        
-                        self.redis_client.rpush(QUEUE_AGENT_2_OUTPUT, result_json)
-                        self.redis_client.rpush(QUEUE_AGENT_3_INPUT, result_json)
-                        self.redis_client.rpush(QUEUE_AGENT_4_INPUT, result_json)
-                        
-                        logger.info(f"📤 Результат отправлен в Агентов 3 и 4 (action={output.get('action')})\n")
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка отправки: {e}")
-                    
-                except Exception as e:
-                    logger.error(f"❌ Ошибка в цикле: {e}")
-                    time.sleep(1)
-        
+            super().run()
         except KeyboardInterrupt:
             logger.info("\n🛑 Агент 2 остановлен (Ctrl+C)")
         finally:
@@ -356,7 +528,7 @@ class Agent2Worker:
 
 if __name__ == "__main__":
     try:
-        if not mistral_client:
+        if not MISTRAL_API_KEY:
             logger.error("❌ Mistral клиент не инициализирован - выход")
             exit(1)
         
@@ -8,25 +8,21 @@
 ✅ Обнаруживает обнажённость, насилие, экстремизм
 """
 
-import json
-import redis
-import time
-import asyncio
 import os
 import base64
 from typing import Dict, Any
 from datetime import datetime
 from pathlib import Path
-import aiohttp
 
 # Импортируем конфигурацию
 from config import (
-    get_redis_config,
     QUEUE_AGENT_6_INPUT,
     QUEUE_AGENT_6_OUTPUT,
-    MISTRAL_API_KEY,
     setup_logging,
 )
+from agent_runtime import AsyncAgentWorker
+from llm_client import chat, LLMError
+from verdict_parser import ParseError, extract_object, parse_counted, json_mode_params, to_int, to_bool, confidence_percent
 
 # ============================================================================
 # ЛОГИРОВАНИЕ
@@ -38,7 +34,7 @@ logger = setup_logging("АГЕНТ 6")
 # MISTRAL VISION API
 # ============================================================================
 
-MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
+VISION_MODEL = "pixtral-12b-2409"
 
 async def analyze_image_with_mistral(image_path: str) -> Dict[str, Any]:
     """
@@ -68,27 +64,20 @@ async def analyze_image_with_mistral(image_path: str) -> Dict[str, Any]:
         
         logger.info(f"📋 MIME-type: {mime_type}")
         
-        # Формируем запрос к Mistral Vision
-        headers = {
-            "Authorization": f"Bearer {MISTRAL_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "pixtral-12b-2409",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{mime_type};base64,{image_data}"
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": """Проанализируй это изображение и ответь ТОЛЬКО JSON:
+        # Формируем запрос к Mistral Vision (pixtral)
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{image_data}"
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": """Проанализируй это изображение и ответь ТОЛЬКО JSON:
 {
   "has_nudity": boolean,
   "has_violence": boolean,
@@ -106,72 +95,65 @@ async def analyze_image_with_mistral(image_path: str) -> Dict[str, Any]:
 - Оскорбительный контент
 
 Ответь ТОЛЬКО JSON, без других текстов!"""
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 300
-        }
+                    }
+                ]
+            }
+        ]
         
         logger.info("🌐 Отправляю запрос к Mistral API...")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(MISTRAL_API_URL, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as resp:
-                logger.info(f"📡 Ответ от API: статус {resp.status}")
-                
-                if resp.status == 200:
-                    result = await resp.json()
-                    
-                    # Парсим ответ
-                    try:
-                        response_text = result["choices"][0]["message"]["content"]
-                        logger.info(f"📝 Ответ Mistral: {response_text[:200]}")
-                        
-                        # Пытаемся найти JSON в ответе
-                        json_start = response_text.find("{")
-                        json_end = response_text.rfind("}") + 1
-                        
-                        if json_start >= 0 and json_end > json_start:
-                            json_str = response_text[json_start:json_end]
-                            analysis = json.loads(json_str)
-                            
-                            severity = int(analysis.get("severity", 0))
-                            severity = min(10, max(0, severity))
-                            
-                            confidence = int(analysis.get("confidence", 50))
-                            confidence = min(100, max(0, confidence))
-                            
-                            logger.info(f"✅ Анализ: severity={severity}, nudity={analysis.get('has_nudity', False)}, confidence={confidence}%")
-                            
-                            return {
-                                "verdict": any([
-                                    analysis.get("has_nudity", False),
-                                    analysis.get("has_violence", False),
-                                    analysis.get("has_extremism", False),
-                                    analysis.get("has_inappropriate", False)
-                                ]),
-                                "reason": analysis.get("description", "Контент нарушает правила"),
-                                "severity": severity,
-                                "confidence": confidence,
-                                "details": analysis
-                            }
-                    except Exception as e:
-                        logger.error(f"⚠️ Ошибка парсинга JSON: {e}")
-                        return {
-                            "verdict": False,
-                            "reason": f"Ошибка анализа: {str(e)}",
-                            "severity": 0,
-                            "confidence": 0.5
-                        }
-                else:
-                    error_text = await resp.text()
-                    logger.error(f"❌ API ошибка: {resp.status} - {error_text[:200]}")
-                    return {
-                        "verdict": False,
-                        "reason": f"API ошибка: {resp.status}",
-                        "severity": 0,
-                        "confidence": 0
-                    }
+        try:
+            response_text = await chat(
+                "mistral", VISION_MODEL, messages, max_tokens=300, timeout=30, **json_mode_params("mistral")
+            )
+        except LLMError as e:
+            logger.error(f"❌ API ошибка: {e}")
+            return {
+                "verdict": False,
+                "reason": f"API ошибка: {e.status or e}",
+                "severity": 0,
+                "confidence": 0
+            }
+        
+        # Парсим ответ
+        try:
+            logger.info(f"📝 Ответ Mistral: {response_text[:200]}")
+            
+            analysis = parse_counted("mistral", VISION_MODEL, extract_object, response_text)
+            
+            severity = to_int(analysis.get("severity"), 0, 0, 10)
+            confidence = int(round(confidence_percent(analysis.get("confidence"), 50)))
+            
+            logger.info(f"✅ Анализ: severity={severity}, nudity={analysis.get('has_nudity', False)}, confidence={confidence}%")
+            
+            return {
+                "verdict": any([
+                    to_bool(analysis.get("has_nudity", False)),
+                    to_bool(analysis.get("has_violence", False)),
+                    to_bool(analysis.get("has_extremism", False)),
+                    to_bool(analysis.get("has_inappropriate", False))
+                ]),
+                "reason": analysis.get("description", "Контент нарушает правила"),
+                "severity": severity,
+                "confidence": confidence,
+                "details": analysis
+            }
+        except ParseError as e:
+            logger.warning(f"⚠️ JSON не найден в ответе Mistral: {e}")
+            return {
+                "verdict": False,
+                "reason": "Не удалось разобрать ответ модели",
+                "severity": 0,
+                "confidence": 0
+            }
+        except Exception as e:
+            logger.error(f"⚠️ Ошибка парсинга JSON: {e}")
+            return {
+                "verdict": False,
+                "reason": f"Ошибка анализа: {str(e)}",
+                "severity": 0,
+                "confidence": 0.5
+            }
     
     except Exception as e:
         logger.error(f"❌ Ошибка при анализе изображения: {e}")
@@ -272,16 +254,21 @@ async def process_media(media_data: Dict[str, Any]) -> Dict[str, Any]:
 # REDIS WORKER
 # ============================================================================
 
-class Agent6Worker:
+class Agent6Worker(AsyncAgentWorker):
+    agent_id = 6
+    input_queues = [QUEUE_AGENT_6_INPUT]
+    output_queues = [QUEUE_AGENT_6_OUTPUT]
+    llm_providers = ["mistral"]
+    
     def __init__(self):
-        try:
-            redis_config = get_redis_config()
-            self.redis_client = redis.Redis(**redis_config)
-            self.redis_client.ping()
-            logger.info("✅ Подключение к Redis успешно")
-        except Exception as e:
-            logger.error(f"❌ Не удалось подключиться к Redis: {e}")
-            raise
+        super().__init__(logger)
+    
+    async def process(self, input_data):
+        logger.info(f"📄 Данные медиа: media_type={input_data.get('media_type')}")
+        
+        output = await process_media(input_data)
+        logger.info(f"📤 ✅ Результат отправлен в БОТ: verdict={output.get('verdict')}, severity={output.get('severity')}")
+        return output
     
     def run(self):
         """Главный цикл обработки медиа"""
@@ -291,45 +278,7 @@ class Agent6Worker:
         logger.info("⏱️ Нажмите Ctrl+C для остановки\n")
         
         try:
-            while True:
-                try:
-                    result = self.redis_client.blpop(QUEUE_AGENT_6_INPUT, timeout=1)
-                    
-                    if result is None:
-                        continue
-                    
-                    queue_name, message_data = result
-                    logger.info("📨 Получено новое медиа")
-                    
-                    # Парсим JSON
-                    try:
-                        input_data = json.loads(message_data)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"❌ Невалидный JSON: {e}")
-                        continue
-                    
-                    logger.info(f"📄 Данные медиа: media_type={input_data.get('media_type')}")
-                    
-                    # Обрабатываем асинхронно
-                    output = asyncio.run(process_media(input_data))
-                    
-                    # ✅ ПИШЕМ РЕЗУЛЬТАТ В REDIS для БОТа
-                    try:
-                        result_json = json.dumps(output, ensure_ascii=False)
-                        
-                        # ОЧЕРЕДЬ ДЛЯ БОТа
-                        self.redis_client.rpush(QUEUE_AGENT_6_OUTPUT, result_json)
-                        
-                        logger.info(f"📤 ✅ Результат отправлен в БОТ: verdict={output.get('verdict')}, severity={output.get('severity')}")
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка отправки результата в Redis: {e}")
-                    
-                    logger.info("✅ Обработка завершена\n")
-                
-                except Exception as e:
-                    logger.error(f"❌ Ошибка в цикле: {e}")
-                    time.sleep(1)
-        
+            super().run()
         except KeyboardInterrupt:
             logger.info("\n❌ Агент 6 остановлен (Ctrl+C)")
         finally:
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🏎️ СПЕКУЛЯТИВНЫЙ ВЕЕР
+✅ Режим SPECULATIVE: Агент 1 отправляет сообщение маршрута BOTH агентам 2, 3 и 4 одновременно
+✅ Агент 5 решает, как только хватает мнений, и отменяет ставшие лишними вызовы
+✅ Отмена: ключ cancel:{chat_id}:{message_id} (для сообщений, ещё стоящих в очереди)
+   + канал speculation:cancel (для вызовов LLM, уже идущих в агентах 3 и 4)
+"""
+
+import asyncio
+import time
+from typing import Dict, Any, Optional, Set, Callable, Awaitable
+
+from config import (
+    QUEUE_AGENT_2_INPUT,
+    QUEUE_AGENT_3_INPUT,
+    QUEUE_AGENT_4_INPUT,
+    SPECULATIVE_CANCEL_TTL,
+)
+
+CANCEL_CHANNEL = "speculation:cancel"
+
+# Куда сообщение уходит сразу при спекулятивном веере
+SPECULATIVE_QUEUES = [QUEUE_AGENT_2_INPUT, QUEUE_AGENT_3_INPUT, QUEUE_AGENT_4_INPUT]
+
+# Отмены и ожидающие вызовы этого процесса (в режиме memory агенты 3-5 в одном процессе)
+_local_cancelled: Dict[str, float] = {}
+_waiters: Dict[str, Set[asyncio.Event]] = {}
+
+
+def cancel_key(chat_id, message_id) -> str:
+    return f"cancel:{chat_id}:{message_id}"
+
+
+def _wake(key: str):
+    for event in _waiters.get(key, ()):
+        event.set()
+
+
+class Speculation:
+    """
+    Отмена спекулятивных вызовов. redis_client со строками; None - отмены только внутри процесса.
+    listen() запускается в агентах, чьи вызовы можно прервать (3 и 4)
+    """
+
+    def __init__(self, redis_client, logger):
+        self.redis_client = redis_client
+        self.logger = logger
+        self._task: Optional[asyncio.Task] = None
+
+    async def listen(self):
+        if self.redis_client is not None and self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub()
+                await pubsub.subscribe(CANCEL_CHANNEL)
+                try:
+                    async for message in pubsub.listen():
+                        if message.get("type") == "message":
+                            _wake(message["data"])
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"❌ Канал отмен недоступен: {e}")
+                await asyncio.sleep(1)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def cancel(self, chat_id, message_id):
+        """Решение принято: оставшиеся вызовы по сообщению не нужны"""
+        key = cancel_key(chat_id, message_id)
+        if self.redis_client is None:
+            now = time.time()
+            for old in [old for old, until in _local_cancelled.items() if until < now]:
+                del _local_cancelled[old]
+            _local_cancelled[key] = now + SPECULATIVE_CANCEL_TTL
+            _wake(key)
+            return
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.set(key, "1", ex=SPECULATIVE_CANCEL_TTL)
+        pipe.publish(CANCEL_CHANNEL, key)
+        await pipe.execute()
+
+    async def is_cancelled(self, key: str) -> bool:
+        if self.redis_client is None:
+            return _local_cancelled.get(key, 0) >= time.time()
+        return bool(await self.redis_client.exists(key))
+
+    async def run(self, payload: Dict[str, Any], call: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        """
+        Выполняет call(), пока сообщение не отменено. None - отменено (до начала или во время вызова).
+        Не спекулятивные сообщения выполняются как обычно
+        """
+        if not payload.get("speculative") or payload.get("message_id") is None:
+            return await call()
+
+        key = cancel_key(payload.get("chat_id"), payload.get("message_id"))
+        if await self.is_cancelled(key):
+            return None
+
+        event = asyncio.Event()
+        _waiters.setdefault(key, set()).add(event)
+        task = asyncio.create_task(call())
+        waiter = asyncio.create_task(event.wait())
+        try:
+            done, _ = await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if task in done:
+                return task.result()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return None
+        finally:
+            waiter.cancel()
+            waiters = _waiters.get(key)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del _waiters[key]
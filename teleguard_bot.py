@@ -9,10 +9,11 @@
 ✅ ИСПРАВЛЕНО: Улучшена функция notify_mods()
 """
 
-import json
 import redis
+import redis.asyncio as aioredis
 import asyncio
 import os
+import random
 import aiohttp
 from datetime import datetime
 
@@ -29,13 +30,34 @@ try:
         TELEGRAM_BOT_TOKEN,
         get_redis_config,
         get_db_connection_string,
+        QUEUE_AGENT_1_INPUT,
         QUEUE_AGENT_2_INPUT,
         QUEUE_AGENT_2_OUTPUT,
+        QUEUE_AGENT_5_INPUT,
+        QUEUE_AGENT_5_OUTPUT,
         QUEUE_AGENT_6_INPUT,
         QUEUE_AGENT_6_OUTPUT,
         setup_logging,
-        DOWNLOADS_DIR
+        DOWNLOADS_DIR,
+        NEARDUP_ENABLED,
+        LEXICON_ENABLED,
+        CLASSIFIER_ENABLED,
+        CLASSIFIER_AUDIT_RATE,
+        LOOP_BACKOFF_BASE,
+        LOOP_BACKOFF_MAX,
+        DEFAULT_RULES
     )
+    from queue_transport import create_transport
+    from routing import score_priority, base_queue, reported_by_agent2
+    from overload import read_state as read_overload_state, MODE_TITLES
+    from verdict_cache import read_stats as read_cache_stats
+    from metrics import metrics, read_stats as read_metrics, format_metric
+    from neardup import NearDuplicateIndex, simhash
+    from lexicon import ChatLexicons, lexicon_verdict
+    from classifier import text_classifier
+    from circuit_breaker import backoff_delay
+    from rate_limiter import read_stats as read_rate_stats
+    from rules_cache import chat_rules, parse_rules, format_rules_text
 except ImportError as e:
     print(f"❌ ОШИБКА ИМПОРТА: {e}")
     exit(1)
@@ -76,6 +98,17 @@ class Moderator(Base):
 
 Base.metadata.create_all(engine)
 redis_client = redis.Redis(**get_redis_config())
+# Очереди агентов - через асинхронный клиент, чтобы не блокировать event loop бота.
+# Клиент очередей работает с байтами (конверты msgpack), общее состояние - со строками
+transport = create_transport(aioredis.Redis(**get_redis_config(binary=True)), logger, "bot")
+state_client = None if transport.mode == "memory" else aioredis.Redis(**get_redis_config())
+# Почти-дубликаты уже проверенных сообщений получают готовый вердикт без LLM
+neardup = NearDuplicateIndex(state_client)
+# Словарный фильтр: базовые слова + свои слова чата (/lexicon)
+chat_lexicons = ChatLexicons(state_client)
+metrics.bind(state_client)
+# Свои правила чата (/rules): Redis - для агентов, chats.custom_rules - постоянная копия
+chat_rules.bind(state_client)
 
 # ============================================================================
 # STATES
@@ -134,6 +167,32 @@ def get_chat_by_tg_id(tg_chat_id):
     finally:
         session.close()
 
+def save_custom_rules(tg_chat_id, rules):
+    """Правила чата в chats.custom_rules. False - чат не зарегистрирован (правила только в Redis)"""
+    session = Session()
+    try:
+        chat = session.query(Chat).filter_by(tg_chat_id=str(tg_chat_id)).first()
+        if not chat:
+            return False
+        chat.custom_rules = format_rules_text(rules) or None
+        session.commit()
+        return True
+    finally:
+        session.close()
+
+async def sync_rules_from_db():
+    """Правила из Postgres -> Redis при старте (Redis мог быть очищен); агенты получат уведомление"""
+    session = Session()
+    try:
+        chats = session.query(Chat).filter(Chat.custom_rules.isnot(None)).all()
+        saved = [(chat.tg_chat_id, parse_rules(chat.custom_rules)) for chat in chats]
+    finally:
+        session.close()
+    for tg_chat_id, rules in saved:
+        await chat_rules.set(tg_chat_id, rules)
+    if saved:
+        logger.info(f"📜 Правила чатов из БД: {len(saved)}")
+
 def get_moderators(chat_id):
     """Получить модераторов по chat_id"""
     session = Session()
@@ -447,8 +506,12 @@ async def add_mod_process(msg: Message, state: FSMContext):
 async def status(msg: Message):
     """Статус системы"""
     try:
-        redis_ping = redis_client.ping()
-        redis_status = "✅ OK" if redis_ping else "❌ ERROR"
+        if transport.mode == "memory":
+            # Однопроцессный режим (local_pipeline.py) - Redis не используется
+            redis_status = "— (режим memory)"
+        else:
+            redis_ping = redis_client.ping()
+            redis_status = "✅ OK" if redis_ping else "❌ ERROR"
         session = Session()
         try:
             chats_count = session.query(Chat).filter_by(is_active=True).count()
@@ -456,8 +519,25 @@ async def status(msg: Message):
         finally:
             session.close()
 
-        q2_len = redis_client.llen(QUEUE_AGENT_2_INPUT)
-        q6_len = redis_client.llen(QUEUE_AGENT_6_INPUT)
+        q1_len = await transport.depth(QUEUE_AGENT_1_INPUT, 1)
+        q2_len = await transport.depth(QUEUE_AGENT_2_INPUT, 2)
+        q6_len = await transport.depth(QUEUE_AGENT_6_INPUT, 6)
+        overload = await read_overload_state(state_client)
+        cache_stats = await read_cache_stats(state_client)
+        cache_lines = "\n".join(
+            f"{namespace.replace('agent', 'Agent ')}: {bucket['hits']} попаданий / {bucket['misses']} промахов, "
+            f"сэкономлено ~{bucket['saved_ms'] / 1000:.0f} сек"
+            for namespace, bucket in sorted(cache_stats.items())
+        ) or "пока нет данных"
+        metric_lines = "\n".join(
+            format_metric(name, bucket) for name, bucket in sorted((await read_metrics(state_client)).items())
+        ) or "пока нет данных"
+        rate_stats = await read_rate_stats(state_client)
+        rate_lines = "\n".join(
+            f"{name.rsplit(':', 1)[0].replace(':', '/')}: {bucket['calls']} вызовов, ждали {bucket['waited']} "
+            f"(всего {bucket['wait_ms'] / 1000:.1f} сек), отказов {bucket['rejected']}"
+            for name, bucket in sorted(rate_stats.items())
+        ) or "пока нет данных"
 
         text = f"""📊 *СТАТУС СИСТЕМЫ*
 
@@ -466,10 +546,23 @@ Redis: {redis_status}
 БД Chats: {chats_count}
 БД Mods: {mods_count}
 
-📬 *Очереди:*
+📬 *Очереди ({transport.mode}):*
+Agent 1: {q1_len} сообщений
 Agent 2: {q2_len} сообщений
 Agent 6: {q6_len} фото
 
+🚦 *Режим:* {MODE_TITLES.get(overload['mode'], overload['mode'])}
+Худшая очередь: {overload['depth']} сообщ., ждёт {overload['age']:.0f} сек
+
+💾 *Кэш вердиктов:*
+{cache_lines}
+
+📈 *Конвейер:*
+{metric_lines}
+
+⏳ *Лимиты провайдеров:*
+{rate_lines}
+
 🕐 {datetime.now().strftime('%H:%M:%S')}"""
 
         await msg.answer(text, reply_markup=get_status_inline(), parse_mode="Markdown")
@@ -492,7 +585,13 @@ async def help_cmd(msg: Message):
 🚫 BAN | 🔇 MUTE | ⚠️ WARN
 
 📸 *Проверка:*
-Текст + Фото анализируются автоматически"""
+Текст + Фото анализируются автоматически
+
+🔤 *Слова чата (в группе):*
+/lexicon add слово | /lexicon del слово | /lexicon list
+
+📜 *Правила чата (в группе):*
+/rules set правило1; правило2 | /rules reset | /rules list"""
 
     await msg.answer(text, reply_markup=get_main_keyboard(), parse_mode="Markdown")
 
@@ -500,6 +599,119 @@ async def help_cmd(msg: Message):
 # ОБРАБОТКА СООБЩЕНИЙ И ФОТО
 # ============================================================================
 
+async def find_near_duplicate(data):
+    """Вердикт похожего сообщения этого чата (волна спама) или None"""
+    if not NEARDUP_ENABLED:
+        return None
+    signature = simhash(data["message"])
+    if signature is None:
+        return None
+    verdict = await neardup.find(data["chat_id"], signature)
+    metrics.count("neardup", "reused" if verdict else "unique")
+    await metrics.maybe_flush()
+    return verdict
+
+async def reuse_verdict(data, verdict, source="neardup"):
+    """Готовый вердикт (почти-дубликат или словарь): действие применяет Агент 5, модераторы получают уведомление сразу"""
+    if source == "neardup":
+        logger.info(
+            f"🧬 Почти-дубликат (отличие {verdict['distance']} бит): "
+            f"action={verdict['action']} без LLM"
+        )
+        reason = f"Повтор уже проверенного сообщения: {verdict.get('reason') or ''}"
+    else:
+        logger.info(f"🔤 Словарь ({verdict['category']}): action={verdict['action']} без LLM")
+        reason = verdict["reason"]
+    if verdict["action"] not in ("ban", "mute", "warn"):
+        return
+
+    result = {
+        **data,
+        **verdict,
+        "agent_id": 0,
+        "reason": reason,
+        "decision_source": source
+    }
+    await transport.send([(QUEUE_AGENT_5_INPUT, result)])
+    await notify_mods(data["chat_id"], result)
+
+def classifier_approves(data):
+    """Локальная модель уверена, что сообщение чистое - LLM не нужен (малая доля всё равно идёт на проверку)"""
+    if not CLASSIFIER_ENABLED or data.get("lexicon_hits"):
+        return False
+    probability = text_classifier.probability(data["message"])
+    if probability is None:
+        return False
+    data["classifier_score"] = round(probability, 4)
+    clean = text_classifier.is_clean(probability)
+    metrics.count("classifier", "clean" if clean else "suspicious")
+    if clean and random.random() < CLASSIFIER_AUDIT_RATE:
+        logger.info(f"🧮 Контрольная проверка: P(нарушение)={probability:.4f}, отправляю в LLM")
+        return False
+    if clean:
+        logger.info(f"🧮 Чисто по модели v{text_classifier.model.version}: P(нарушение)={probability:.4f}, без LLM")
+    return clean
+
+@dp.message(Command("lexicon"))
+async def lexicon_cmd(msg: Message):
+    """Свои слова чата: /lexicon add слово, /lexicon del слово, /lexicon list"""
+    try:
+        if msg.chat.type == "private":
+            await msg.answer("❌ Команда работает в группе")
+            return
+        if msg.from_user.id not in [tg_user_id for tg_user_id, _ in get_moderators(msg.chat.id)]:
+            await msg.answer("❌ Только для модераторов")
+            return
+
+        parts = (msg.text or "").split(maxsplit=2)
+        command = parts[1].lower() if len(parts) > 1 else "list"
+        terms = parts[2].split(",") if len(parts) > 2 else []
+
+        if command == "add" and terms:
+            await chat_lexicons.update(msg.chat.id, add=terms)
+        elif command == "del" and terms:
+            await chat_lexicons.update(msg.chat.id, remove=terms)
+        elif command != "list":
+            await msg.answer("ℹ️ /lexicon add слово1, осно*, *корень* | /lexicon del слово | /lexicon list")
+            return
+
+        current = await chat_lexicons.terms(msg.chat.id)
+        await msg.answer(f"🔤 Слова чата ({len(current)}): {', '.join(current) or 'нет'}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка /lexicon: {e}")
+        await msg.answer(f"❌ Ошибка: {e}")
+
+@dp.message(Command("rules"))
+async def rules_cmd(msg: Message):
+    """Свои правила чата: /rules set правило1; правило2 (или по строке), /rules reset, /rules list"""
+    try:
+        if msg.chat.type == "private":
+            await msg.answer("❌ Команда работает в группе")
+            return
+        if msg.from_user.id not in [tg_user_id for tg_user_id, _ in get_moderators(msg.chat.id)]:
+            await msg.answer("❌ Только для модераторов")
+            return
+
+        parts = (msg.text or "").split(maxsplit=2)
+        command = parts[1].lower() if len(parts) > 1 else "list"
+        rules = parse_rules(parts[2]) if len(parts) > 2 else []
+
+        if command in ("set", "reset") and (rules or command == "reset"):
+            # Сначала постоянная копия, затем Redis + уведомление агентам
+            if not save_custom_rules(msg.chat.id, rules):
+                logger.warning(f"⚠️ Чат {msg.chat.id} не зарегистрирован: правила только в Redis")
+            await chat_rules.set(msg.chat.id, rules)
+        elif command != "list":
+            await msg.answer("ℹ️ /rules set Без рекламы; Без мата | /rules reset | /rules list")
+            return
+
+        current = await chat_rules.get(msg.chat.id)
+        title = "Правила чата" if current is not DEFAULT_RULES else "Правила по умолчанию"
+        await msg.answer(f"📜 {title} ({len(current)}):\n" + "\n".join(f"• {rule}" for rule in current))
+    except Exception as e:
+        logger.error(f"❌ Ошибка /rules: {e}")
+        await msg.answer(f"❌ Ошибка: {e}")
+
 @dp.message(F.text & ~F.text.startswith("/"))
 async def handle_text(msg: Message):
     """Обработка текста"""
@@ -520,8 +732,33 @@ async def handle_text(msg: Message):
             "media_type": ""
         }
 
-        redis_client.rpush(QUEUE_AGENT_2_INPUT, json.dumps(data, ensure_ascii=False))
-        logger.info(f"📤 Сообщение отправлено в очередь агента 2")
+        # Tier-0: один проход словаря чата; совпадения едут дальше для Агента 3
+        found = {}
+        if LEXICON_ENABLED:
+            lexicon = await chat_lexicons.get(msg.chat.id)
+            found = lexicon.categories(msg.text)
+        if found:
+            data["lexicon_hits"] = found
+        # Приоритет полосы очередей: угрозы обгоняют приветствия
+        data["priority"] = score_priority(msg.text, found)
+
+        verdict = lexicon_verdict(msg.text, found)
+        metrics.count("lexicon", "decided" if verdict else "passed")
+        if verdict is not None:
+            await reuse_verdict(data, verdict, "lexicon")
+            return
+
+        verdict = await find_near_duplicate(data)
+        if verdict is not None:
+            await reuse_verdict(data, verdict)
+            return
+
+        if classifier_approves(data):
+            return
+
+        # Маршрут (SIMPLE/COMPLEX/BOTH, веер агентов 2-4) выбирает Агент 1
+        await transport.send([(QUEUE_AGENT_1_INPUT, data)])
+        logger.info(f"📤 Сообщение отправлено Агенту 1 (приоритет {data['priority']})")
     except Exception as e:
         logger.error(f"❌ Ошибка текста: {e}")
 
@@ -549,7 +786,7 @@ async def handle_photo(msg: Message):
             "message_link": f"https://t.me/c/{str(msg.chat.id)[4:]}/{msg.message_id}"
         }
 
-        redis_client.rpush(QUEUE_AGENT_6_INPUT, json.dumps(data, ensure_ascii=False))
+        await transport.send([(QUEUE_AGENT_6_INPUT, data)])
         logger.info(f"📤 ФОТО отправлено АГЕНТУ 6")
     except Exception as e:
         logger.error(f"❌ Ошибка фото: {e}")
@@ -607,46 +844,62 @@ async def result_reader():
     """Читает результаты и уведомляет модераторов - ИСПРАВЛЕННАЯ ВЕРСИЯ"""
     logger.info("📥 READER: Слушаю результаты модерации")
 
+    errors = 0
     while True:
         try:
-            # ✅ ЧАСТЬ 1: Читаем результаты от АГЕНТА 2 (текст)
-            result = redis_client.blpop(QUEUE_AGENT_2_OUTPUT, timeout=0.5)
-            if result:
-                _, data = result
-                try:
-                    j = json.loads(data)
-                    logger.info(
-                        f"📨 Результат от Агента 2: "
-                        f"user=@{j.get('username')}, "
-                        f"action={j.get('action')}, "
-                        f"severity={j.get('severity')}/10"
-                    )
-                    await notify_mods(j.get("chat_id"), j)
-                except Exception as e:
-                    logger.error(f"❌ Ошибка обработки результата Агента 2: {e}")
-
-            # ✅ ЧАСТЬ 2: Читаем результаты от АГЕНТА 6 (ФОТО) - ДОБАВЛЕНО!
-            result = redis_client.blpop(QUEUE_AGENT_6_OUTPUT, timeout=0.5)
-            if result:
-                _, data = result
-                try:
-                    j = json.loads(data)
-                    logger.info(
-                        f"📨 Результат от Агента 6 (ФОТО): "
-                        f"user=@{j.get('username')}, "
-                        f"action={j.get('action')}, "
-                        f"severity={j.get('severity')}/10, "
-                        f"media_type={j.get('media_type')}"
-                    )
-                    await notify_mods(j.get("chat_id"), j)
-                except Exception as e:
-                    logger.error(f"❌ Ошибка обработки результата Агента 6: {e}")
-
-            await asyncio.sleep(0.1)
+            items = await transport.receive([QUEUE_AGENT_2_OUTPUT, QUEUE_AGENT_5_OUTPUT, QUEUE_AGENT_6_OUTPUT])
+            errors = 0
+
+            for queue_name, j, _ in items:
+                # ✅ ЧАСТЬ 1: Результаты от АГЕНТА 2 (текст)
+                if base_queue(queue_name) == QUEUE_AGENT_2_OUTPUT:
+                    try:
+                        logger.info(
+                            f"📨 Результат от Агента 2: "
+                            f"user=@{j.get('username')}, "
+                            f"action={j.get('action')}, "
+                            f"severity={j.get('severity')}/10"
+                        )
+                        await notify_mods(j.get("chat_id"), j)
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка обработки результата Агента 2: {e}")
+
+                # ✅ Решения АГЕНТА 5 - по сообщениям, которые шли мимо Агента 2 (маршрут COMPLEX)
+                elif base_queue(queue_name) == QUEUE_AGENT_5_OUTPUT:
+                    if reported_by_agent2(j.get("route")):
+                        continue
+                    try:
+                        logger.info(
+                            f"📨 Решение Агента 5 (маршрут {j.get('route')}): "
+                            f"user=@{j.get('user')}, "
+                            f"action={j.get('action')}, "
+                            f"severity={j.get('severity')}/10"
+                        )
+                        await notify_mods(j.get("chat_id"), {**j, "message": j.get("message_text", "")})
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка обработки решения Агента 5: {e}")
+
+                # ✅ ЧАСТЬ 2: Результаты от АГЕНТА 6 (ФОТО)
+                else:
+                    try:
+                        logger.info(
+                            f"📨 Результат от Агента 6 (ФОТО): "
+                            f"user=@{j.get('username')}, "
+                            f"action={j.get('action')}, "
+                            f"severity={j.get('severity')}/10, "
+                            f"media_type={j.get('media_type')}"
+                        )
+                        await notify_mods(j.get("chat_id"), j)
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка обработки результата Агента 6: {e}")
+
+            # Подтверждаем прочитанное (для режима streams)
+            await transport.send([], processed=items)
 
         except Exception as e:
+            errors += 1
             logger.error(f"❌ Reader error: {e}")
-            await asyncio.sleep(1)
+            await asyncio.sleep(backoff_delay(errors, LOOP_BACKOFF_BASE, LOOP_BACKOFF_MAX))
 
 # ============================================================================
 # MAIN
@@ -654,6 +907,10 @@ async def result_reader():
 
 async def main():
     logger.info("✅ БОТ ЗАПУЩЕН!")
+    try:
+        await sync_rules_from_db()
+    except Exception as e:
+        logger.error(f"❌ Правила чатов из БД не загружены: {e}")
     reader_task = asyncio.create_task(result_reader())
     try:
         await dp.start_polling(bot)
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import second_agent
+from config import DEFAULT_RULES
+from verdict_cache import verdict_cache, cache_key
+
+FULL = {
+    "is_violation": True, "type": "spam", "severity": 6, "confidence": 90, "action": "warn",
+    "reason": "реклама", "explanation": "ссылка на сторонний канал",
+}
+
+
+def fake_stream(completions):
+    """chat_stream, который отдаёт поля по одному и решает досрочно, как настоящий поток"""
+    async def chat_stream(provider, model, messages, on_value, on_complete=None, **params):
+        content = json.dumps(FULL, ensure_ascii=False)
+        for key, value in FULL.items():
+            if on_value(key, value):
+                if on_complete is not None:
+                    completions.append(asyncio.create_task(on_complete(content)))
+                return None
+        return content
+    return chat_stream
+
+
+def run_agent2(monkeypatch, message):
+    completions = []
+    monkeypatch.setattr(second_agent, "chat_stream", fake_stream(completions))
+    monkeypatch.setattr(second_agent.mistral_batcher, "size", 1)
+    verdict_cache.bind(None)
+
+    async def run():
+        output = await second_agent.moderation_agent_2({"message": message, "chat_id": -1, "message_id": 1})
+        await asyncio.gather(*completions)
+        return output
+
+    return asyncio.run(run())
+
+
+def test_early_verdict_has_explanation_and_full_one_is_cached(monkeypatch):
+    message = "Подписывайтесь на мой канал"
+    output = run_agent2(monkeypatch, message)
+    assert output["action"] == "warn"
+    assert output["explanation"]
+
+    cached = asyncio.run(verdict_cache.get(cache_key("agent2", second_agent.PROMPT_VERSION, message, DEFAULT_RULES)))
+    assert cached["explanation"] == FULL["explanation"]
+    assert not cached.get("early")
+
+
+def test_chunks_are_not_cached_under_their_own_text(monkeypatch):
+    message = " ".join(f"слово{i}" for i in range(3000))
+    written = []
+    original_set = verdict_cache.set
+
+    async def record_set(key, verdict):
+        written.append(key)
+        await original_set(key, verdict)
+
+    monkeypatch.setattr(verdict_cache, "set", record_set)
+    run_agent2(monkeypatch, message)
+    # Ранние вердикты кусков не кэшируются вовсе: ни под ключом кусков, ни под ключом сообщения
+    assert written == []
@@ -0,0 +1,33 @@
+from config import (
+    CASCADE_CLEAN_CONFIDENCE,
+    CASCADE_VIOLATION_CONFIDENCE,
+    CASCADE_VIOLATION_SEVERITY,
+    QUEUE_AGENT_2_OUTPUT,
+    QUEUE_AGENT_5_INPUT,
+)
+from routing import cascade_exit
+from second_agent import Agent2Worker
+
+
+def test_confident_clean_exits_early():
+    assert cascade_exit({"is_violation": False, "action": "none", "confidence": CASCADE_CLEAN_CONFIDENCE}) == "clean"
+    assert cascade_exit({"is_violation": False, "action": "none", "confidence": CASCADE_CLEAN_CONFIDENCE - 1}) is None
+
+
+def test_confident_severe_violation_exits_early():
+    verdict = {"is_violation": True, "action": "ban", "confidence": CASCADE_VIOLATION_CONFIDENCE,
+               "severity": CASCADE_VIOLATION_SEVERITY}
+    assert cascade_exit(verdict) == "violation"
+    assert cascade_exit({**verdict, "severity": CASCADE_VIOLATION_SEVERITY - 1}) is None
+    assert cascade_exit({**verdict, "confidence": CASCADE_VIOLATION_CONFIDENCE - 1}) is None
+
+
+def test_errors_and_fallbacks_stay_in_uncertain_band():
+    assert cascade_exit({"is_violation": False, "action": "none", "confidence": 0}) is None
+    assert cascade_exit({"is_violation": False, "action": "none"}) is None
+    assert cascade_exit({"is_violation": True, "confidence": "высокая", "severity": 9}) is None
+
+
+def test_cascade_decision_skips_agents_3_and_4():
+    output = {"is_violation": False, "action": "none", "confidence": 99, "decision_source": "cascade_clean"}
+    assert Agent2Worker().route({"route": "BOTH"}, output) == [QUEUE_AGENT_2_OUTPUT, QUEUE_AGENT_5_INPUT]
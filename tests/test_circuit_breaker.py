@@ -0,0 +1,158 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import circuit_breaker
+import llm_client as llm_client_module
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, RetryBudget, parse_retry_after
+from llm_client import CircuitOpenError, LLMClient, LLMError
+
+PROVIDERS = {"fake": {"url": "https://fake.test/v1/chat/completions", "api_key": "key", "timeout": 5}}
+MESSAGES = [{"role": "user", "content": "проверь"}]
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(llm_client_module, "LLM_PROVIDERS", PROVIDERS)
+    monkeypatch.setattr(llm_client_module, "RETRY_ATTEMPTS", 3)
+    monkeypatch.setattr(llm_client_module, "RETRY_DELAY", 0)
+
+
+class Clock:
+    """Часы автомата, которые двигает тест"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, "time", SimpleNamespace(monotonic=clock, time=time.time))
+    return clock
+
+
+def fake_client(responses, calls):
+    """LLMClient, провайдер которого отвечает по очереди статусами из responses"""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        status, headers = responses.pop(0)
+        if status == 200:
+            return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+        return httpx.Response(status, headers=headers, text="error")
+
+    client = LLMClient()
+    client._clients["fake"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_breaker_opens_after_failures_and_probes_once(clock):
+    breaker = CircuitBreaker("fake", failures=2, open_seconds=30)
+    breaker.failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    clock.now += 30
+    # Срок вышел: один пробный вызов, остальные ждут его исхода
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_failed_probe_reopens_breaker(clock):
+    breaker = CircuitBreaker("fake", failures=1, open_seconds=30)
+    breaker.failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    assert breaker.stats["trips"] == 2
+
+
+def test_retry_after_opens_breaker_for_its_duration(clock):
+    breaker = CircuitBreaker("fake", failures=5, open_seconds=30)
+    breaker.failure(open_for=120)
+    assert breaker.state == OPEN
+    clock.now += 119
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_retry_budget_exhaustion():
+    budget = RetryBudget(ratio=0.5, burst=1)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    assert budget.stats == {"retries": 2, "denied": 2}
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, None),
+    ("", None),
+    ("7", 7.0),
+    ("1.5", 1.5),
+    ("-3", 0.0),
+    ("soon", None),
+])
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    value = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 55 <= parse_retry_after(value) <= 60
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_call_retries_5xx_then_succeeds():
+    calls = []
+    client = fake_client([(503, {}), (502, {}), (200, {})], calls)
+    assert asyncio.run(client.chat("fake", "m", MESSAGES)) == "ok"
+    assert len(calls) == 3
+    assert client.breaker("fake", "m").state == CLOSED
+
+
+def test_call_stops_retrying_when_budget_is_spent():
+    calls = []
+    client = fake_client([(503, {}), (503, {}), (200, {})], calls)
+    client.retry_budget = RetryBudget(ratio=0, burst=0)
+    with pytest.raises(LLMError) as error:
+        asyncio.run(client.chat("fake", "m", MESSAGES))
+    assert error.value.status == 503
+    assert len(calls) == 1
+    assert client.retry_budget.stats["denied"] == 1
+
+
+def test_long_retry_after_opens_breaker_and_fails_fast():
+    calls = []
+    client = fake_client([(429, {"retry-after": "60"})], calls)
+
+    async def scenario():
+        with pytest.raises(LLMError) as first:
+            await client.chat("fake", "m", MESSAGES)
+        started = time.monotonic()
+        with pytest.raises(CircuitOpenError):
+            await client.chat("fake", "m", MESSAGES)
+        return first.value, time.monotonic() - started
+
+    first, elapsed = asyncio.run(scenario())
+    assert first.retry_after == 60
+    # Второй вызов до провайдера не дошёл
+    assert len(calls) == 1
+    assert elapsed < 1
+    assert client.breaker("fake", "m").state == OPEN
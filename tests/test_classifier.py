@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import classifier
+from classifier import CURRENT_FILE, TextClassifier, log_verdict, read_log_file, train_model, verdict_record
+
+SPAM = ["заработок", "казино", "ставки", "бонус", "крипта", "выигрыш"]
+CLEAN = ["погода", "дача", "рыбалка", "рецепт", "концерт", "поезд"]
+
+
+def toy_texts(words, count):
+    """Детерминированный набор: каждое слово с каждым, плюс номер - все тексты разные"""
+    return [f"{words[i % 6]} {words[(i // 6) % 6]} номер {i}" for i in range(count)]
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(classifier, "CLASSIFIER_DIR", str(tmp_path))
+    monkeypatch.setattr(classifier, "CLASSIFIER_MIN_EXAMPLES", 50)
+    monkeypatch.setattr(classifier, "CLASSIFIER_RELOAD_INTERVAL", 0)
+    return tmp_path
+
+
+def log_toy_verdicts():
+    """Решения Агента 5 в журнал (без Redis - файл verdicts.jsonl)"""
+    async def scenario():
+        for action, texts in (("warn", toy_texts(SPAM, 60)), ("none", toy_texts(CLEAN, 60))):
+            for text in texts:
+                output = {"action": action, "decision_source": "consensus", "chat_id": -100}
+                await log_verdict(None, verdict_record({4: {"message": text, "action": action}}, output))
+
+    asyncio.run(scenario())
+
+
+def test_model_trained_on_logged_verdicts_separates_toy_set(model_dir):
+    log_toy_verdicts()
+    records = read_log_file(str(model_dir / "verdicts.jsonl"))
+    assert len(records) == 120
+    assert {record["label"] for record in records} == {0, 1}
+
+    train_model(records, bits=12, epochs=30).save(str(model_dir))
+    model = TextClassifier(str(model_dir))
+
+    # Новые тексты из тех же слов, которых не было в журнале
+    violating = [model.probability(f"{word} срочно пиши") for word in SPAM]
+    clean = [model.probability(f"{word} в субботу") for word in CLEAN]
+    assert min(violating) > 0.5 > max(clean)
+
+
+def test_missing_model_falls_through(model_dir):
+    model = TextClassifier(str(model_dir))
+    assert model.probability("казино бонус") is None
+    assert not model.is_clean(None)
+
+
+def test_corrupt_model_falls_through(model_dir):
+    (model_dir / CURRENT_FILE).write_text("broken", encoding="utf-8")
+    (model_dir / "broken.npz").write_bytes(b"not a model")
+    model = TextClassifier(str(model_dir))
+    assert model.probability("казино бонус") is None
+    assert model.model is None
+
+
+def test_too_few_verdicts_are_not_trained(model_dir):
+    records = [{"text": text, "label": 1} for text in toy_texts(SPAM, 10)]
+    with pytest.raises(ValueError):
+        train_model(records, bits=12)
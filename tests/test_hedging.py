@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import llm_client as llm_client_module
+from llm_client import LLMClient
+
+PROVIDERS = {
+    name: {"url": f"https://{name}.test/v1/chat/completions", "api_key": "key", "timeout": 5}
+    for name in ("primary", "backup")
+}
+MESSAGES = [{"role": "user", "content": "проверь"}]
+P90 = 0.1
+
+
+@pytest.fixture(autouse=True)
+def hedging(monkeypatch):
+    monkeypatch.setattr(llm_client_module, "LLM_PROVIDERS", PROVIDERS)
+    monkeypatch.setattr(llm_client_module, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(llm_client_module, "LLM_HEDGE_TARGETS", {"primary": {"provider": "backup", "model": "b"}})
+    monkeypatch.setattr(llm_client_module, "LLM_HEDGE_MIN_SAMPLES", 10)
+    monkeypatch.setattr(llm_client_module, "LLM_HEDGE_MIN_DELAY", 0)
+    monkeypatch.setattr(llm_client_module, "LLM_HEDGE_BUDGET", 1)
+    monkeypatch.setattr(llm_client_module, "LLM_HEDGE_BURST", 1)
+
+
+class FakeProviders:
+    """Отвечает {"answer": имя провайдера} через delays[имя] секунд, запоминает начала и отмены запросов"""
+
+    def __init__(self, **delays):
+        self.delays = delays
+        self.started = []
+        self.cancelled = []
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        provider = request.url.host.split(".")[0]
+        self.started.append((provider, time.monotonic()))
+        try:
+            await asyncio.sleep(self.delays[provider])
+        except asyncio.CancelledError:
+            self.cancelled.append(provider)
+            raise
+        content = json.dumps({"answer": provider})
+        return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+    def client(self) -> LLMClient:
+        client = LLMClient()
+        for provider in PROVIDERS:
+            client._clients[provider] = httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+        # p90 основного провайдера - P90 (замеров с запасом, чтобы медленные ответы теста его не сдвинули)
+        for _ in range(50):
+            client.record_latency("primary", "a", P90)
+        return client
+
+
+def test_hedge_fires_after_p90_and_cancels_slow_primary():
+    providers = FakeProviders(primary=5, backup=0)
+
+    async def scenario():
+        client = providers.client()
+        started = time.monotonic()
+        result = await client.chat_json("primary", "a", MESSAGES)
+        elapsed = time.monotonic() - started
+        # Отмена доходит до запроса основного на следующем шаге цикла
+        await asyncio.sleep(0)
+        return client, result, started, elapsed
+
+    client, result, started, elapsed = asyncio.run(scenario())
+    assert result == {"answer": "backup"}
+    assert elapsed < 1
+    [(_, hedge_started)] = [item for item in providers.started if item[0] == "backup"]
+    assert hedge_started - started >= P90
+    assert providers.cancelled == ["primary"]
+    assert client.hedge_stats["primary"] == {"calls": 1, "hedged": 1, "hedge_wins": 1, "primary_wins": 0}
+
+
+def test_fast_primary_is_not_hedged():
+    providers = FakeProviders(primary=0, backup=0)
+
+    async def scenario():
+        client = providers.client()
+        return client, await client.chat_json("primary", "a", MESSAGES)
+
+    client, result = asyncio.run(scenario())
+    assert result == {"answer": "primary"}
+    assert [provider for provider, _ in providers.started] == ["primary"]
+    assert client.hedge_stats["primary"]["hedged"] == 0
+
+
+def test_hedge_budget_caps_extra_calls(monkeypatch):
+    # Полхеджа на вызов: из четырёх медленных вызовов хеджируются только два
+    monkeypatch.setattr(llm_client_module, "LLM_HEDGE_BUDGET", 0.5)
+    providers = FakeProviders(primary=P90 * 2, backup=0)
+
+    async def scenario():
+        client = providers.client()
+        results = [await client.chat_json("primary", "a", MESSAGES) for _ in range(4)]
+        return client, results
+
+    client, results = asyncio.run(scenario())
+    assert results == [{"answer": "primary"}, {"answer": "backup"}] * 2
+    assert [provider for provider, _ in providers.started].count("backup") == 2
+    assert client.hedge_stats["primary"]["hedged"] == 2
@@ -0,0 +1,44 @@
+from lexicon import Lexicon, base_lexicon, lexicon_verdict, normalize, parse_term
+
+
+def test_short_roots_match_only_at_word_start():
+    # "бля" есть в "корабля", "ебан" - в "колебания", "хуе" - в "страхуется"
+    assert base_lexicon.match("Нос корабля скрылся в тумане") == []
+    assert base_lexicon.match("Сильные колебания курса") == []
+    assert base_lexicon.match("Он всегда страхуется") == []
+
+
+def test_term_modes():
+    lexicon = Lexicon({"custom": ["кот", "собак*", "*мыш*"]})
+    assert lexicon.categories("Кот спит") == {"custom": ["кот"]}
+    assert lexicon.categories("Котлеты на ужин") == {}
+    assert lexicon.categories("Две собаки") == {"custom": ["собак*"]}
+    assert lexicon.categories("Пёс-собачник") == {}
+    assert lexicon.categories("Летучая мышь и компьютерная мышка") == {"custom": ["*мыш*"]}
+    assert parse_term(" слово* ") == ("слово", "prefix")
+
+
+def test_normalization_defeats_simple_obfuscation():
+    assert normalize("ИДИООООТ") == "идиот"
+    assert normalize("ид1от") == "ид1от"
+    assert normalize("идиoт") == "идиот"
+    assert base_lexicon.categories("ты идиoooт") == {"insult": ["идиот*"]}
+    # В словах без кириллицы латиница не трогается
+    assert normalize("hello") == "hello"
+
+
+def test_spam_is_decisive_only_with_link():
+    found = base_lexicon.categories("Пассивный доход без вложений")
+    assert found == {"spam": ["пассивный доход", "без вложений"]}
+    assert lexicon_verdict("Пассивный доход без вложений", found) is None
+    text = "Пассивный доход без вложений t.me/money"
+    verdict = lexicon_verdict(text, base_lexicon.categories(text))
+    assert verdict["is_violation"] is True
+    assert verdict["category"] == "spam"
+
+
+def test_threat_goes_to_llm():
+    text = "Я тебя убью, идиот"
+    found = base_lexicon.categories(text)
+    assert set(found) == {"threat", "insult"}
+    assert lexicon_verdict(text, found) is None
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import agent_runtime
+import fifth_agent
+import local_pipeline
+import queue_transport
+import third_agent
+from config import LLM_PROVIDERS, QUEUE_AGENT_1_INPUT, QUEUE_AGENT_2_OUTPUT, QUEUE_AGENT_5_OUTPUT
+from llm_client import llm_client
+from queue_transport import QueueTransport, get_memory_queue
+from routing import reported_by_agent2
+
+COMPLEX_MESSAGE = "Подробный рассказ о поездке на дачу и планах на выходные. " * 12
+
+
+@pytest.fixture
+def memory_pipeline(monkeypatch):
+    """Все агенты local_pipeline в одном процессе без Redis, сети и Telegram"""
+    monkeypatch.setattr(agent_runtime, "QUEUE_TRANSPORT", "memory")
+    monkeypatch.setattr(queue_transport, "QUEUE_TRANSPORT", "memory")
+    monkeypatch.setattr(queue_transport, "_memory_queues", {})
+    # Без ключей агенты сразу берут свой fallback
+    for provider in LLM_PROVIDERS:
+        monkeypatch.setitem(LLM_PROVIDERS[provider], "api_key", "")
+    monkeypatch.setattr(third_agent, "MISTRAL_API_KEY", "")
+
+    async def warmup(providers):
+        pass
+
+    async def apply_moderation_action(chat_id, user_id, action, duration=0):
+        return True
+
+    monkeypatch.setattr(llm_client, "warmup", warmup)
+    monkeypatch.setattr(fifth_agent, "apply_moderation_action", apply_moderation_action)
+
+
+def queued(queue_name):
+    items = []
+    for lane in QueueTransport.all_lanes(queue_name):
+        queue = get_memory_queue(lane)
+        while not queue.empty():
+            items.append(queue.get_nowait())
+    return items
+
+
+async def run_pipeline(payload, timeout=20):
+    workers = [worker_class() for worker_class in local_pipeline.WORKERS]
+    tasks = [asyncio.create_task(worker.run_forever()) for worker in workers]
+    try:
+        get_memory_queue(QUEUE_AGENT_1_INPUT).put_nowait(payload)
+        deadline = asyncio.get_running_loop().time() + timeout
+        while asyncio.get_running_loop().time() < deadline:
+            decisions = queued(QUEUE_AGENT_5_OUTPUT)
+            if decisions:
+                return decisions, queued(QUEUE_AGENT_2_OUTPUT)
+            await asyncio.sleep(0.05)
+        raise AssertionError("Агент 5 не принял решение")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def test_complex_message_reaches_moderators_through_agent_5(memory_pipeline):
+    payload = {
+        "message": COMPLEX_MESSAGE, "user_id": 42, "username": "author", "chat_id": -100,
+        "message_id": 7, "message_link": "", "priority": "MEDIUM",
+    }
+    decisions, agent2_outputs = asyncio.run(run_pipeline(payload))
+
+    # Агент 2 сообщение не видел - единственный доклад модераторам идёт от Агента 5
+    assert agent2_outputs == []
+    [decision] = decisions
+    assert decision["route"] == "COMPLEX"
+    assert decision["chat_id"] == -100 and decision["message_id"] == 7
+    assert not reported_by_agent2(decision["route"])
@@ -0,0 +1,36 @@
+import asyncio
+
+import fakeredis
+
+import metrics as metrics_module
+from metrics import Metrics, format_metric, read_stats
+
+
+def test_format_metric_uses_metric_labels():
+    assert format_metric("hedge", {"hedge_wins": 3, "primary_wins": 40}) == "Хедж: выиграл хедж 3, выиграл основной 40"
+    assert format_metric("parse:mistral/mistral-small", {"rejected": 2}) == \
+        "Разбор mistral/mistral-small: разобрано 0, выброшено 2"
+    assert format_metric("breaker", {"fast_fails": 2, "timeout_ms": 60000}) == \
+        "Автоматы: сразу в fallback 2, сдались после повторов 0, не ждали таймаутов до ~60 сек"
+
+
+def test_flush_adds_counters_to_redis():
+    async def scenario():
+        redis_client = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+        counters = Metrics()
+        counters.bind(redis_client)
+        counters.count("cascade", "early_exits")
+        counters.count("cascade", "escalated", 2)
+        await counters.flush()
+        counters.count("cascade", "early_exits")
+        await counters.flush()
+        return await read_stats(redis_client)
+
+    assert asyncio.run(scenario()) == {"cascade": {"early_exits": 2, "escalated": 2}}
+
+
+def test_memory_mode_reads_process_counters(monkeypatch):
+    counters = Metrics()
+    monkeypatch.setattr(metrics_module, "metrics", counters)
+    counters.count("lexicon", "decided")
+    assert asyncio.run(read_stats(None)) == {"lexicon": {"decided": 1}}
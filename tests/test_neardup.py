@@ -0,0 +1,44 @@
+import asyncio
+
+from config import NEARDUP_BANDS, NEARDUP_MAX_DISTANCE
+from neardup import BAND_BITS, NearDuplicateIndex, bands, hamming, normalize_for_signature, simhash
+
+SPAM = "Заработок от 5000 рублей в день без вложений, пиши в личку https://t.me/earn_money_bot?start=123"
+
+
+def test_normalization_hides_what_spammers_vary():
+    assert normalize_for_signature("Цена 5000!!! https://example.com/a?b=1") == "цена 0 example com"
+    assert normalize_for_signature("Цена 700 www.example.com/other") == "цена 0 example com"
+
+
+def test_simhash_close_for_variants_and_far_for_other_text():
+    variant = "Заработок от 7000 рублей в день без вложений!!! пиши в личку https://t.me/earn_money_bot?start=999"
+    other = "Коллеги, встреча переносится на четверг, захватите, пожалуйста, отчёты за квартал"
+    assert hamming(simhash(SPAM), simhash(variant)) <= NEARDUP_MAX_DISTANCE
+    assert hamming(simhash(SPAM), simhash(other)) > NEARDUP_MAX_DISTANCE
+
+
+def test_short_text_has_no_signature():
+    assert simhash("привет") is None
+
+
+def test_bands_split_and_restore_signature():
+    signature = simhash(SPAM)
+    parts = bands(signature)
+    assert len(parts) == NEARDUP_BANDS
+    assert all(0 <= part < 1 << BAND_BITS for part in parts)
+    assert sum(part << (band * BAND_BITS) for band, part in enumerate(parts)) == signature
+
+
+def test_memory_index_finds_near_duplicate_in_same_chat():
+    async def scenario():
+        index = NearDuplicateIndex(None)
+        await index.add(-100, simhash(SPAM), {"action": "ban", "severity": 7, "is_violation": True, "extra": 1})
+        variant = simhash(SPAM.replace("5000", "9000"))
+        return await index.find(-100, variant), await index.find(-200, variant)
+
+    found, other_chat = asyncio.run(scenario())
+    assert found["action"] == "ban"
+    assert "extra" not in found
+    assert found["distance"] <= NEARDUP_MAX_DISTANCE
+    assert other_chat is None
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+
+import fakeredis
+import pytest
+
+import queue_transport
+from envelope import pack, unpack
+from queue_transport import (
+    ATTEMPTS_FIELD, ListQueueTransport, MemoryQueueTransport, StreamQueueTransport, dead_queue, get_memory_queue,
+)
+
+QUEUE = "queue:test:input"
+logger = logging.getLogger("test")
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(queue_transport, "QUEUE_MAX_DELIVERIES", 3)
+    monkeypatch.setattr(queue_transport, "STREAM_CLAIM_IDLE_MS", 0)
+    monkeypatch.setattr(queue_transport, "STREAM_CLAIM_INTERVAL", 0)
+    monkeypatch.setattr(queue_transport, "CLAIM_CHECK_ENABLED", False)
+    monkeypatch.setattr(queue_transport, "_memory_queues", {})
+
+
+def binary_redis():
+    return fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+
+
+def test_stream_entry_is_dead_lettered_after_max_deliveries():
+    async def scenario():
+        redis_client = binary_redis()
+        transport = StreamQueueTransport(redis_client, logger, group="agent2", max_wait=0.01)
+        await transport.ensure_group(QUEUE)
+        await redis_client.xadd(QUEUE, {"data": pack({"message": "падает"})})
+
+        deliveries = 0
+        while True:
+            items = await transport.receive([QUEUE])
+            if not items:
+                break
+            deliveries += 1
+            await transport.fail(items[0], "ошибка агента")
+
+        pending = await redis_client.xpending(QUEUE, "agent2")
+        dead = await redis_client.xrange(dead_queue(QUEUE))
+        return deliveries, pending["pending"], dead
+
+    deliveries, pending, dead = asyncio.run(scenario())
+    assert deliveries == 3
+    assert pending == 0
+    [(_, fields)] = dead
+    assert unpack(fields[b"data"]) == {"message": "падает"}
+    assert fields[b"error"] == "ошибка агента".encode("utf-8")
+    assert fields[b"deliveries"] == b"3"
+
+
+def test_stream_entry_stays_pending_before_limit():
+    async def scenario():
+        redis_client = binary_redis()
+        transport = StreamQueueTransport(redis_client, logger, group="agent2", max_wait=0.01)
+        await transport.ensure_group(QUEUE)
+        await redis_client.xadd(QUEUE, {"data": pack({"message": "раз"})})
+        [item] = await transport.receive([QUEUE])
+        await transport.fail(item, "ошибка")
+        return (await redis_client.xpending(QUEUE, "agent2"))["pending"], await redis_client.exists(dead_queue(QUEUE))
+
+    assert asyncio.run(scenario()) == (1, 0)
+
+
+def test_list_message_is_retried_then_dead_lettered():
+    async def scenario():
+        redis_client = binary_redis()
+        transport = ListQueueTransport(redis_client, logger, max_wait=0.01)
+        await redis_client.rpush(QUEUE, pack({"message": "падает"}))
+
+        deliveries = 0
+        while True:
+            items = await transport.receive([QUEUE])
+            if not items:
+                break
+            deliveries += 1
+            await transport.fail(items[0], "ошибка агента")
+        return deliveries, [unpack(raw) for raw in await redis_client.lrange(dead_queue(QUEUE), 0, -1)]
+
+    deliveries, dead = asyncio.run(scenario())
+    assert deliveries == 3
+    assert dead == [{"message": "падает", ATTEMPTS_FIELD: 3, "error": "ошибка агента"}]
+
+
+def test_memory_message_is_retried_then_dead_lettered():
+    async def scenario():
+        transport = MemoryQueueTransport(None, logger, max_wait=0.01)
+        get_memory_queue(QUEUE).put_nowait({"message": "падает"})
+
+        deliveries = 0
+        while True:
+            items = await transport.receive([QUEUE])
+            if not items:
+                break
+            deliveries += 1
+            await transport.fail(items[0], "ошибка агента")
+        return deliveries, get_memory_queue(dead_queue(QUEUE)).get_nowait()
+
+    deliveries, dead = asyncio.run(scenario())
+    assert deliveries == 3
+    assert dead[ATTEMPTS_FIELD] == 3
@@ -0,0 +1,79 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+import rate_limiter as rate_limiter_module
+from rate_limiter import RateLimiter, bucket_name, read_stats
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter_module, "LLM_RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limiter_module, "LLM_RATE_LIMITS", {
+        "test": {"rpm": 2, "tpm": 100000},
+        "tiny": {"rpm": 1000, "tpm": 100},
+    })
+    # Ждать нельзя совсем: любой вызов сверх ведра - отказ
+    monkeypatch.setattr(rate_limiter_module, "LLM_RATE_MAX_WAIT", 0)
+
+
+def make_limiter(backend):
+    limiter = RateLimiter()
+    redis_client = None
+    if backend == "redis":
+        redis_client = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    limiter.bind(redis_client)
+    return limiter, redis_client
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_requests_bucket_rejects_over_rpm(limits, monkeypatch, backend):
+    async def scenario():
+        limiter, redis_client = make_limiter(backend)
+        monkeypatch.setattr(rate_limiter_module, "rate_limiter", limiter)
+        waits = [await limiter.acquire("test", "model", "key", 10) for _ in range(3)]
+        return waits, await read_stats(redis_client)
+
+    waits, stats = asyncio.run(scenario())
+    assert waits == [0.0, 0.0, None]
+    assert stats == {bucket_name("test", "model", "key"): {"calls": 2, "waited": 0, "wait_ms": 0, "rejected": 1}}
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_tokens_bucket_rejects_over_tpm(limits, backend):
+    async def scenario():
+        limiter, _ = make_limiter(backend)
+        return [await limiter.acquire("tiny", "model", "key", 80) for _ in range(2)]
+
+    assert asyncio.run(scenario()) == [0.0, None]
+
+
+def test_buckets_are_separate_per_api_key(limits):
+    async def scenario():
+        limiter, _ = make_limiter("redis")
+        first = [await limiter.acquire("test", "model", "key-1", 10) for _ in range(2)]
+        return first, await limiter.acquire("test", "model", "key-2", 10)
+
+    first, other_key = asyncio.run(scenario())
+    assert first == [0.0, 0.0]
+    assert other_key == 0.0
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_bucket_waits_instead_of_rejecting(limits, monkeypatch, backend):
+    monkeypatch.setattr(rate_limiter_module, "LLM_RATE_LIMITS", {"fast": {"rpm": 1000, "tpm": 6000}})
+    monkeypatch.setattr(rate_limiter_module, "LLM_RATE_MAX_WAIT", 1)
+
+    async def scenario():
+        limiter, _ = make_limiter(backend)
+        # Первый вызов забирает все токены; 10 токенов набегут за 10 * 60000 / 6000 = 100 мс
+        await limiter.acquire("fast", "model", "key", 6000)
+        return await limiter.acquire("fast", "model", "key", 10)
+
+    assert 0.05 <= asyncio.run(scenario()) <= 0.1
+
+
+def test_unknown_provider_is_not_limited(limits):
+    limiter, _ = make_limiter("memory")
+    assert asyncio.run(limiter.acquire("other", "model", "key", 10)) == 0.0
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+
+import fakeredis
+import pytest
+
+import fifth_agent
+import queue_transport
+import user_history
+from config import QUEUE_AGENT_5_OUTPUT
+from fifth_agent import Agent5Worker, MemoryResultJoin, RedisResultJoin
+from overload import OverloadMode
+from queue_transport import MemoryQueueTransport, get_memory_queue
+from user_history import UserHistory
+
+MEMBER = "-100:42"
+
+
+def verdict(agent_id, action="none", **fields):
+    return {
+        "agent_id": agent_id, "chat_id": -100, "message_id": 42, "user_id": 7, "username": "user",
+        "message": "текст", "action": action, "severity": 0, "confidence": 0.9 if agent_id == 3 else 90,
+        **fields,
+    }
+
+
+def make_join(backend):
+    if backend == "memory":
+        return MemoryResultJoin()
+    return RedisResultJoin(fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True))
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    return request.param
+
+
+@pytest.mark.parametrize("order", [(3, 4), (4, 3)])
+def test_join_completes_in_either_order(backend, order):
+    async def scenario():
+        join = make_join(backend)
+        first = await join.add(verdict(order[0]))
+        both = await join.add(verdict(order[1]))
+        return first, both, await join.expired(10)
+
+    first, both, expired = asyncio.run(scenario())
+    assert first is None
+    assert sorted(both) == [3, 4]
+    assert both[3]["agent_id"] == 3 and both[4]["agent_id"] == 4
+    # Решение принято - дедлайн больше не нужен
+    assert expired == []
+
+
+def test_duplicate_delivery_decides_once(backend):
+    async def scenario():
+        join = make_join(backend)
+        outcomes = [
+            await join.add(verdict(3)),
+            await join.add(verdict(3)),
+            await join.add(verdict(4)),
+            await join.add(verdict(4)),
+            await join.add(verdict(3)),
+        ]
+        return outcomes, await join.claim(MEMBER)
+
+    outcomes, claimed = asyncio.run(scenario())
+    assert [outcome is not None for outcome in outcomes] == [False, False, True, False, False]
+    assert claimed is None
+
+
+@pytest.fixture
+def worker(backend, monkeypatch):
+    """Агент 5 без Redis-очередей, LLM и Telegram; join - в памяти или в Redis"""
+    monkeypatch.setattr(fifth_agent, "JOIN_DEADLINE", 0)
+    monkeypatch.setattr(fifth_agent, "NEARDUP_ENABLED", False)
+    monkeypatch.setattr(fifth_agent, "CLASSIFIER_ENABLED", False)
+    monkeypatch.setattr(queue_transport, "_memory_queues", {})
+    monkeypatch.setattr(user_history, "_local_history", {})
+
+    async def apply_moderation_action(chat_id, user_id, action, duration=0):
+        return True
+
+    monkeypatch.setattr(fifth_agent, "apply_moderation_action", apply_moderation_action)
+
+    worker = Agent5Worker()
+    worker.join = make_join(backend)
+    worker.overload = OverloadMode(None)
+    worker.history = UserHistory(None)
+    worker.transport = MemoryQueueTransport(None, logging.getLogger("test"))
+    return worker
+
+
+def test_deadline_decides_on_single_agent(worker):
+    async def scenario():
+        worker._semaphore = asyncio.Semaphore(1)
+        waiting = await worker.process(verdict(3, action="warn", severity=5, reason="спам"))
+        expired = await worker.join.expired(10)
+        for member in expired:
+            await worker.expire(member)
+        # Второе решение пришло после дедлайна - решение уже принято
+        late = await worker.process(verdict(4, action="ban", severity=9))
+        return waiting, expired, late
+
+    waiting, expired, late = asyncio.run(scenario())
+    assert waiting is None
+    assert expired == [MEMBER]
+    assert late is None
+
+    decision = get_memory_queue(QUEUE_AGENT_5_OUTPUT).get_nowait()
+    assert decision["decision_source"] == "agent3_only"
+    assert decision["action"] == "warn"
+    assert decision["confidence"] == 90
+    assert get_memory_queue(QUEUE_AGENT_5_OUTPUT).empty()
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from config import (
+    QUEUE_AGENT_2_INPUT,
+    QUEUE_AGENT_3_INPUT,
+    QUEUE_AGENT_4_INPUT,
+    QUEUE_AGENT_5_INPUT,
+    ROUTER_SIMPLE_MIN_CONFIDENCE,
+)
+import first_agent
+import overload
+from overload import OverloadMode
+from routing import route_features, local_route
+from first_agent import Agent1Worker
+from second_agent import Agent2Worker
+from speculation import SPECULATIVE_QUEUES
+
+DEEP_QUEUES = {QUEUE_AGENT_3_INPUT, QUEUE_AGENT_4_INPUT}
+
+
+def decide(message, history=None):
+    return local_route(route_features(message, history=history))
+
+
+def make_agent1():
+    agent1 = Agent1Worker()
+    # Режим перегрузки в памяти процесса (overload._local_state)
+    agent1.overload = OverloadMode(None)
+    asyncio.run(agent1.setup())
+    return agent1
+
+
+def test_short_clean_text_is_simple():
+    decision = decide("Всем привет, кто идёт на встречу?")
+    assert decision["route"] == "SIMPLE"
+
+
+def test_threat_takes_full_path_with_high_priority():
+    decision = decide("Я тебя убью")
+    assert decision["route"] == "BOTH"
+    assert decision["priority"] == "HIGH"
+
+
+def test_long_text_goes_straight_to_deep_analysis():
+    assert decide("обычное слово " * 60)["route"] == "COMPLEX"
+
+
+def test_link_without_lexicon_hits_is_both():
+    assert decide("Смотри https://example.com")["route"] == "BOTH"
+
+
+def test_author_history_upgrades_simple():
+    assert decide("Привет", history={"violations": 1})["route"] == "BOTH"
+    assert decide("Привет", history={"violations": 5})["priority"] == "HIGH"
+
+
+@pytest.mark.parametrize("message", ["Привет всем", "Спасибо за помощь", "Ок"])
+def test_simple_message_skips_agents_3_and_4(message):
+    agent1 = make_agent1()
+    output = asyncio.run(agent1.process({"message": message, "chat_id": -1, "user_id": 1, "message_id": 1}))
+    assert output["route"] == "SIMPLE"
+    assert not DEEP_QUEUES & set(agent1.route({}, output))
+
+    agent2 = Agent2Worker()
+    for verdict in (
+        {"is_violation": False, "action": "none", "confidence": 30},
+        {"is_violation": True, "action": "warn", "confidence": ROUTER_SIMPLE_MIN_CONFIDENCE},
+    ):
+        queues = agent2.route(output, verdict)
+        assert QUEUE_AGENT_5_INPUT in queues
+        assert not DEEP_QUEUES & set(queues)
+
+
+def test_unsure_violation_on_simple_route_gets_second_opinion():
+    verdict = {"is_violation": True, "action": "warn", "confidence": ROUTER_SIMPLE_MIN_CONFIDENCE - 1}
+    assert DEEP_QUEUES <= set(Agent2Worker().route({"route": "SIMPLE"}, verdict))
+
+
+def test_complex_route_skips_agent_2():
+    agent1 = Agent1Worker()
+    assert set(agent1.route({}, {"route": "COMPLEX"})) == DEEP_QUEUES
+    assert agent1.route({}, {"route": "BOTH"}) == [QUEUE_AGENT_2_INPUT]
+
+
+@pytest.mark.parametrize("mode", ["skip_3_4", "local_only"])
+def test_overload_sends_complex_to_agent_2_only(monkeypatch, mode):
+    monkeypatch.setitem(overload._local_state, "mode", mode)
+    agent1 = make_agent1()
+    output = asyncio.run(agent1.process({"message": "обычное слово " * 60, "chat_id": -1, "user_id": 1, "message_id": 1}))
+    assert output["route"] == "COMPLEX"
+    assert output["overload_mode"] == mode
+    assert agent1.route({}, output) == [QUEUE_AGENT_2_INPUT]
+
+
+def test_overload_cancels_speculative_fan_out(monkeypatch):
+    monkeypatch.setattr(first_agent, "SPECULATIVE_ENABLED", True)
+    payload = {"message": "Смотри https://example.com", "chat_id": -1, "user_id": 1, "message_id": 1}
+    agent1 = make_agent1()
+    output = asyncio.run(agent1.process(payload))
+    assert output["speculative"]
+    assert agent1.route({}, output) == SPECULATIVE_QUEUES
+
+    monkeypatch.setitem(overload._local_state, "mode", "skip_3_4")
+    agent1 = make_agent1()
+    output = asyncio.run(agent1.process(payload))
+    assert "speculative" not in output
+    assert agent1.route({}, output) == [QUEUE_AGENT_2_INPUT]
+
+
+def test_no_arbitration_mode_keeps_agents_3_and_4(monkeypatch):
+    monkeypatch.setitem(overload._local_state, "mode", "no_arbitration")
+    agent1 = make_agent1()
+    output = asyncio.run(agent1.process({"message": "обычное слово " * 60, "chat_id": -1, "user_id": 1, "message_id": 1}))
+    assert set(agent1.route({}, output)) == DEEP_QUEUES
+
+
+def test_agent1_output_carries_timestamp_for_queue_age():
+    output = Agent1Worker().build_agent_input({"message": "x"}, {"route": "BOTH"})
+    assert output["timestamp"]
@@ -0,0 +1,66 @@
+import asyncio
+
+import fakeredis
+
+import rules_cache
+from config import DEFAULT_RULES, RULES_MAX_COUNT
+from rules_cache import ChatRules, parse_rules, rules_key
+
+
+def test_parse_rules_splits_lines_and_semicolons():
+    assert parse_rules("Без мата; без спама\n\n  Без рекламы  \n;") == ["Без мата", "без спама", "Без рекламы"]
+    assert parse_rules("") == []
+    assert parse_rules(None) == []
+    assert len(parse_rules("\n".join(f"правило {i}" for i in range(RULES_MAX_COUNT + 5)))) == RULES_MAX_COUNT
+
+
+def test_memory_mode_set_and_reset(monkeypatch):
+    monkeypatch.setattr(rules_cache, "_local_rules", {})
+
+    async def scenario():
+        rules = ChatRules()
+        before = await rules.get(-100)
+        await rules.set(-100, ["Только по делу"])
+        custom = await rules.get(-100)
+        await rules.set(-100, [])
+        return before, custom, await rules.get(-100)
+
+    before, custom, after = asyncio.run(scenario())
+    assert before == DEFAULT_RULES
+    assert custom == ["Только по делу"]
+    assert after == DEFAULT_RULES
+
+
+def test_payload_rules_win_over_chat_rules(monkeypatch):
+    monkeypatch.setattr(rules_cache, "_local_rules", {"-100": "Только по делу"})
+    rules = ChatRules()
+    assert asyncio.run(rules.for_payload({"chat_id": -100, "rules": ["Своё"]})) == ["Своё"]
+    assert asyncio.run(rules.for_payload({"chat_id": -100})) == ["Только по делу"]
+    assert asyncio.run(rules.for_payload({})) == DEFAULT_RULES
+
+
+def test_change_notification_drops_cached_rules():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        agent = ChatRules(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+        bot = ChatRules(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+        await agent.listen()
+        await asyncio.sleep(0.05)
+
+        before = await agent.get(-100)
+        # Правило, записанное в обход set(), агент не видит, пока не придёт уведомление
+        await bot.redis_client.set(rules_key(-100), "Старое")
+        stale = await agent.get(-100)
+        await bot.set(-100, ["Без ссылок"])
+        for _ in range(50):
+            if "-100" not in agent._rules:
+                break
+            await asyncio.sleep(0.01)
+        fresh = await agent.get(-100)
+        await agent.stop()
+        return before, stale, fresh
+
+    before, stale, fresh = asyncio.run(scenario())
+    assert before == DEFAULT_RULES
+    assert stale == DEFAULT_RULES
+    assert fresh == ["Без ссылок"]
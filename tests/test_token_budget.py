@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+import token_budget
+from llm_client import estimate_tokens
+from token_budget import compact, split, fit, analyze_chunked
+
+
+def test_compact_collapses_stretches_emoji_and_whitespace():
+    assert compact("Приииииивет!!!!!!   мир") == "Прииивет!!! мир"
+    assert compact("ура 🔥🔥🔥🔥🔥🔥🔥 😀 😂 🤣 😊") == "ура 🔥🔥🔥"
+    assert compact("  раз\n\n\n  два  ") == "раз\nдва"
+
+
+def test_compact_keeps_ordinary_text():
+    assert compact("Всем привет, кто идёт на встречу?") == "Всем привет, кто идёт на встречу?"
+
+
+def test_split_respects_budget_and_overlaps():
+    text = " ".join(f"слово{i}" for i in range(2000))
+    chunks = split(text, budget=100, overlap=10)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 100 for chunk in chunks)
+    for left, right in zip(chunks, chunks[1:]):
+        # Начало следующего куска - целое слово из хвоста предыдущего
+        assert right.split()[0] in left.split()
+    assert chunks[0].split()[0] == "слово0"
+    assert chunks[-1].split()[-1] == "слово1999"
+
+
+def test_split_short_text_is_one_chunk():
+    assert split("короткий текст", budget=100) == ["короткий текст"]
+
+
+def test_fit_truncates_to_budget_keeping_head_and_tail():
+    text = "начало " + "середина " * 500 + "конец"
+    result = fit("agent1", text)
+    assert result.startswith("начало")
+    assert result.endswith("конец")
+    assert estimate_tokens(result) <= token_budget.budget_for("agent1") + 1
+
+
+def long_text(marker_at: int, count: int = 3000) -> str:
+    words = [f"слово{i}" for i in range(count)]
+    words[marker_at] = "SPAM"
+    return " ".join(words)
+
+
+def test_every_chunk_is_analyzed_including_the_middle():
+    text = long_text(1500)
+    seen = []
+
+    async def analyze(chunk):
+        seen.append(chunk)
+        return {"severity": 9 if "SPAM" in chunk else 0, "confidence": 90}
+
+    result = asyncio.run(analyze_chunked("agent2", text, analyze))
+    assert len(seen) == len(split(compact(text), token_budget.budget_for("agent2")))
+    assert result["severity"] == 9
+    assert not result.get("partial")
+
+
+def test_failed_chunk_lowers_confidence_of_clean_verdict():
+    text = long_text(0)
+
+    async def analyze(chunk):
+        if "SPAM" in chunk:
+            return {"severity": 0, "confidence": 0, "reason": "Ошибка"}
+        return {"severity": 0, "confidence": 90}
+
+    result = asyncio.run(analyze_chunked("agent2", text, analyze))
+    chunks = len(split(compact(text), token_budget.budget_for("agent2")))
+    assert result["partial"] is True
+    assert result["confidence"] == pytest.approx(90 * (chunks - 1) / chunks, abs=0.01)
+
+
+def test_exception_in_chunk_marks_partial_and_all_failed_raises():
+    text = long_text(0)
+
+    async def flaky(chunk):
+        if "SPAM" in chunk:
+            raise RuntimeError("провайдер недоступен")
+        return {"severity": 2, "confidence": 80}
+
+    assert asyncio.run(analyze_chunked("agent4", text, flaky))["partial"] is True
+
+    async def broken(chunk):
+        raise RuntimeError("провайдер недоступен")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(analyze_chunked("agent4", text, broken))
+
+
+def test_text_within_budget_is_passed_unchanged():
+    calls = []
+
+    async def analyze(text):
+        calls.append(text)
+        return {"severity": 0, "confidence": 90}
+
+    asyncio.run(analyze_chunked("agent2", "Привет!!!!!!", analyze))
+    assert calls == ["Привет!!!!!!"]
@@ -0,0 +1,51 @@
+import pytest
+
+from verdict_parser import ParseError, confidence_percent, extract_object, extract_array, to_verdict
+
+
+def test_confidence_percent_scale():
+    assert confidence_percent(85) == 85
+    assert confidence_percent("85%") == 85
+    assert confidence_percent(0.85) == pytest.approx(85)
+    # На шкале 0-100 единица - это 1%, а не 100%
+    assert confidence_percent(1) == 1
+    assert confidence_percent("1") == 1
+    assert confidence_percent(150) == 100
+    assert confidence_percent("высокая", default=50) == 50
+
+
+def test_confidence_percent_fraction_scale():
+    assert confidence_percent(1, fraction=True) == 100
+    assert confidence_percent(0.3, fraction=True) == pytest.approx(30)
+    # Модель ответила процентами вопреки промпту
+    assert confidence_percent(70, fraction=True) == 70
+
+
+def test_extract_json_skips_preamble_and_tail():
+    content = 'Вот ответ:\n{"is_violation": true, "reason": "a {b}"}\nГотово.'
+    assert extract_object(content) == {"is_violation": True, "reason": "a {b}"}
+    assert extract_array('ответ: [1, 2] и всё') == [1, 2]
+    with pytest.raises(ParseError):
+        extract_object("без JSON")
+    with pytest.raises(ParseError):
+        extract_object("[1, 2]")
+
+
+def test_to_verdict_coerces_types():
+    verdict = to_verdict({
+        "is_violation": "да", "severity": "12", "confidence": "0.9", "action": "BAN", "reasoning": "спам",
+    })
+    assert verdict.is_violation is True
+    assert verdict.severity == 10
+    assert verdict.confidence == 90
+    assert verdict.action == "ban"
+    assert verdict.reason == "спам"
+    assert verdict.type == "unknown"
+
+
+def test_to_verdict_defaults_for_partial_data():
+    verdict = to_verdict({"is_violation": True, "action": "выгнать"}, default_severity=5, default_confidence=50)
+    assert verdict.severity == 5
+    assert verdict.confidence == 50
+    assert verdict.action == "warn"
+    assert to_verdict({"confidence": 1}, fraction=True).confidence == 100
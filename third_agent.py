@@ -6,26 +6,29 @@
 
 ✅ Получает сообщения от Агента 2
 ✅ Анализирует контекст (Mistral или FALLBACK)
-✅ Пишет результаты в Redis
+✅ Пишет результаты в Redis (Агент 5 сопоставляет их с решением Агента 4)
 ✅ НИКОГДА не падает - всегда есть fallback!
 """
 
-import json
-import redis
-import time
-import asyncio
 from typing import Dict, Any
 from datetime import datetime
-import aiohttp
 
 # Импортируем конфигурацию
 from config import (
-    get_redis_config,
     QUEUE_AGENT_3_INPUT,
     QUEUE_AGENT_3_OUTPUT,
     MISTRAL_API_KEY,
+    LEXICON_CATEGORIES,
     setup_logging,
+    determine_action,
 )
+from agent_runtime import AsyncAgentWorker
+from llm_client import chat_json, LLMError
+from verdict_parser import extract_object, to_verdict
+from verdict_cache import verdict_cache, fingerprint
+from metrics import metrics
+from lexicon import base_lexicon, lexicon_verdict, category_settings
+from token_budget import analyze_chunked, fit
 
 # ============================================================================
 # ЛОГИРОВАНИЕ
@@ -37,24 +40,11 @@ logger = setup_logging("АГЕНТ 3")
 # MISTRAL API (С FALLBACK!)
 # ============================================================================
 
-MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
+ANALYSIS_MODEL = "mistral-large-latest"
 
-async def analyze_with_mistral(message: str, violation_type: str = "unknown") -> Dict[str, Any]:
-    """
-    Анализирует сообщение с помощью Mistral
-    ЕСЛИ НЕ РАБОТАЕТ - используется FALLBACK!
-    """
-    try:
-        if not MISTRAL_API_KEY:
-            logger.warning("⚠️ Mistral API Key не установлен, используется fallback")
-            return use_fallback_analysis(message, violation_type)
-        
-        headers = {
-            "Authorization": f"Bearer {MISTRAL_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        prompt = f"""Анализ сообщения Telegram:
+def build_analysis_prompt(message: str, violation_type: str) -> str:
+    """Промпт контекстного анализа"""
+    return f"""Анализ сообщения Telegram:
 "{message}"
 
 Тип нарушения: {violation_type}
@@ -71,34 +61,44 @@ async def analyze_with_mistral(message: str, violation_type: str = "unknown") ->
   "confidence": float,
   "reasoning": "короткое объяснение"
 }}"""
+
+# Смена модели или промпта - новая версия ключей кэша вердиктов
+PROMPT_VERSION = fingerprint(ANALYSIS_MODEL, build_analysis_prompt("", ""))
+
+def parse_analysis(content: str) -> Dict[str, Any]:
+    """Ответ Mistral -> анализ Агента 3 (промпт просит долю 0-1, модель может ответить и в процентах)"""
+    data = extract_object(content)
+    if "severity" not in data:
+        raise ValueError("нет поля severity")
+    verdict = to_verdict(data, fraction=True)
+    return {
+        "is_violation": verdict.is_violation,
+        "severity": verdict.severity,
+        "confidence": verdict.confidence / 100,
+        "reasoning": verdict.reason,
+    }
+
+async def analyze_with_mistral(message: str, violation_type: str = "unknown") -> Dict[str, Any]:
+    """
+    Анализирует сообщение с помощью Mistral
+    ЕСЛИ НЕ РАБОТАЕТ - используется FALLBACK!
+    """
+    try:
+        if not MISTRAL_API_KEY:
+            logger.warning("⚠️ Mistral API Key не установлен, используется fallback")
+            return use_fallback_analysis(message, violation_type)
         
-        payload = {
-            "model": "mistral-large-latest",
-            "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": 200
-        }
+        messages = [{"role": "user", "content": build_analysis_prompt(fit("agent3", message), violation_type)}]
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                MISTRAL_API_URL, 
-                json=payload, 
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=10)
-            ) as resp:
-                if resp.status == 200:
-                    result = await resp.json()
-                    response_text = result["choices"][0]["message"]["content"]
-                    
-                    # Парсим JSON из ответа
-                    json_start = response_text.find("{")
-                    json_end = response_text.rfind("}") + 1
-                    if json_start >= 0:
-                        analysis = json.loads(response_text[json_start:json_end])
-                        logger.info(f"✅ Mistral анализ: severity={analysis.get('severity', 0)}")
-                        return analysis
-                else:
-                    logger.warning(f"⚠️ Mistral API ошибка: {resp.status}")
-                    return use_fallback_analysis(message, violation_type)
+        # JSON из ответа; если большая модель задерживается - первый валидный от хеджа (mistral-small)
+        try:
+            analysis = await chat_json("mistral", ANALYSIS_MODEL, messages, max_tokens=200, timeout=10, parse=parse_analysis)
+        except LLMError as e:
+            logger.warning(f"⚠️ Mistral API ошибка: {e}")
+            return use_fallback_analysis(message, violation_type)
+        
+        logger.info(f"✅ Mistral анализ: severity={analysis.get('severity', 0)}")
+        return analysis
     
     except Exception as e:
         logger.warning(f"⚠️ Ошибка Mistral: {e}, используется fallback")
@@ -107,58 +107,68 @@ async def analyze_with_mistral(message: str, violation_type: str = "unknown") ->
 def use_fallback_analysis(message: str, violation_type: str = "unknown") -> Dict[str, Any]:
     """
     FALLBACK анализ - когда Mistral недоступен
-    Используется простая логика без API
+    Категорию и серьёзность даёт словарный фильтр (lexicon.py), без API
     """
-    logger.info("🔄 Использую FALLBACK анализ")
+    logger.info("🔄 Использую FALLBACK анализ (словарь)")
     
-    # Простая эвристика
-    if violation_type == "profanity":
-        return {
-            "is_violation": True,
-            "severity": 5,
-            "confidence": 0.6,
-            "reasoning": "Fallback: матерные слова обнаружены"
-        }
-    elif violation_type == "insult":
-        return {
-            "is_violation": True,
-            "severity": 4,
-            "confidence": 0.6,
-            "reasoning": "Fallback: оскорбления обнаружены"
-        }
-    elif violation_type == "discrimination":
-        return {
-            "is_violation": True,
-            "severity": 8,
-            "confidence": 0.7,
-            "reasoning": "Fallback: дискриминация обнаружена"
-        }
-    else:
+    found = base_lexicon.categories(message)
+    if violation_type in LEXICON_CATEGORIES:
+        found.setdefault(violation_type, [violation_type])
+    
+    verdict = lexicon_verdict(message, found, decisive_only=False)
+    if verdict is None:
         return {
             "is_violation": False,
             "severity": 0,
             "confidence": 0.5,
             "reasoning": "Fallback: нарушений не обнаружено"
         }
+    return {
+        "is_violation": True,
+        "severity": verdict["severity"],
+        "confidence": verdict["confidence"] / 100,
+        "reasoning": f"Fallback: {verdict['reason']}",
+        "violation_type": verdict["category"]
+    }
 
 # ============================================================================
 # ОСНОВНАЯ ФУНКЦИЯ АГЕНТА 3
 # ============================================================================
 
+def message_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Поля, по которым Агент 5 сопоставляет результат с решением Агента 4"""
+    return {
+        "chat_id": data.get("chat_id"),
+        "message_id": data.get("message_id"),
+        "user_id": data.get("user_id"),
+        "username": data.get("username", "unknown"),
+        "message_link": data.get("message_link", ""),
+        "priority": data.get("priority"),
+        "route": data.get("route"),
+    }
+
 async def process_contextual_analysis(data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Анализирует контекст сообщения
     """
     try:
         message = data.get("message", "")
-        violation_type = data.get("violation_type", "unknown")
+        # Категория - от вызывающего или из словаря (бот кладёт совпадения со словами чата в lexicon_hits)
+        found = data.get("lexicon_hits") or base_lexicon.categories(message)
+        violation_type = data.get("violation_type") or next(
+            iter(sorted(found, key=lambda category: category_settings(category)["severity"], reverse=True)), "unknown"
+        )
         severity_from_agent2 = data.get("severity", 0)
         confidence_from_agent2 = data.get("confidence", 0)
         
         logger.info(f"🔍 Анализирую сообщение: {message[:50]}")
         
-        # Получаем анализ (Mistral или fallback)
-        analysis = await analyze_with_mistral(message, violation_type)
+        # Получаем анализ (кэш, Mistral или fallback; длинный текст - по кускам); fallback не кэшируем
+        analysis = await verdict_cache.cached(
+            "agent3", PROMPT_VERSION, message, violation_type,
+            lambda: analyze_chunked("agent3", message, lambda text: analyze_with_mistral(text, violation_type)),
+            lambda result: not str(result.get("reasoning", "")).startswith("Fallback") and not result.get("partial")
+        )
         
         is_violation = analysis.get("is_violation", False)
         severity = analysis.get("severity", severity_from_agent2)
@@ -170,17 +180,25 @@ async def process_contextual_analysis(data: Dict[str, Any]) -> Dict[str, Any]:
             return {
                 "agent_id": 3,
                 "status": "ok",
+                **message_fields(data),
                 "message": message,
+                "action": "none",
                 "severity": severity,
                 "confidence": confidence,
-                "skip_to_agent5": False  # НЕ отправляем в агента 5
+                "skip_to_agent5": False  # Агент 5 всё равно учтёт это мнение как "none"
             }
         else:
             logger.warning(f"⚠️ VIOLATION: severity={severity}/10, type={violation_type}")
+            violation_type = analysis.get("violation_type", violation_type)
+            # determine_action знает русские типы нарушений, словарь - свои категории
+            action_type = LEXICON_CATEGORIES[violation_type]["type"] if violation_type in LEXICON_CATEGORIES else violation_type
+            action = determine_action(action_type, severity, confidence)["action"]
             return {
                 "agent_id": 3,
                 "status": "violation",
+                **message_fields(data),
                 "message": message,
+                "action": action,
                 "violation_type": violation_type,
                 "severity": severity,
                 "confidence": confidence,
@@ -192,6 +210,7 @@ async def process_contextual_analysis(data: Dict[str, Any]) -> Dict[str, Any]:
         return {
             "agent_id": 3,
             "status": "error",
+            **message_fields(data),
             "error": str(e),
             "skip_to_agent5": False
         }
@@ -200,16 +219,31 @@ async def process_contextual_analysis(data: Dict[str, Any]) -> Dict[str, Any]:
 # REDIS WORKER
 # ============================================================================
 
-class Agent3Worker:
+class Agent3Worker(AsyncAgentWorker):
+    agent_id = 3
+    input_queues = [QUEUE_AGENT_3_INPUT]
+    output_queues = [QUEUE_AGENT_3_OUTPUT]
+    llm_providers = ["mistral"]
+    # Спекулятивный веер: Агент 5 может решить без нас и отменить вызов
+    cancellable = True
+    
     def __init__(self):
-        try:
-            redis_config = get_redis_config()
-            self.redis_client = redis.Redis(**redis_config)
-            self.redis_client.ping()
-            logger.info("✅ Подключение к Redis успешно")
-        except Exception as e:
-            logger.error(f"❌ Не удалось подключиться к Redis: {e}")
-            raise
+        super().__init__(logger)
+    
+    async def process(self, input_data):
+        output = await self.speculation.run(input_data, lambda: process_contextual_analysis(input_data))
+        if output is None:
+            logger.info("🏁 Решение уже принято без Агента 3, вызов отменён")
+            metrics.count("speculation", "cancelled")
+            return None
+        if input_data.get("speculative"):
+            metrics.count("speculation", "completed")
+        
+        if output.get("skip_to_agent5"):
+            logger.info(f"📤 ✅ Результаты отправлены Агенту 5")
+        else:
+            logger.info(f"📤 ✅ OK результат (severity < 3)")
+        return output
     
     def run(self):
         """Главный цикл обработки сообщений"""
@@ -220,45 +254,7 @@ class Agent3Worker:
         logger.info("⏱️  Нажмите Ctrl+C для остановки\n")
         
         try:
-            while True:
-                try:
-                    result = self.redis_client.blpop(QUEUE_AGENT_3_INPUT, timeout=1)
-                    
-                    if result is None:
-                        continue
-                    
-                    queue_name, message_data = result
-                    logger.info("📨 Получено новое сообщение")
-                    
-                    # Парсим JSON
-                    try:
-                        input_data = json.loads(message_data)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"❌ Невалидный JSON: {e}")
-                        continue
-                    
-                    # Обрабатываем асинхронно
-                    output = asyncio.run(process_contextual_analysis(input_data))
-                    
-                    # ✅ ПИШЕМ РЕЗУЛЬТАТ В REDIS
-                    try:
-                        result_json = json.dumps(output, ensure_ascii=False)
-                        self.redis_client.rpush(QUEUE_AGENT_3_OUTPUT, result_json)
-                        
-                        if output.get("skip_to_agent5"):
-                            logger.info(f"📤 ✅ Результаты отправлены Агенту 5")
-                        else:
-                            logger.info(f"📤 ✅ OK результат (severity < 3)")
-                    
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка отправки результата в Redis: {e}")
-                    
-                    logger.info("✅ Анализ завершен\n")
-                
-                except Exception as e:
-                    logger.error(f"❌ Ошибка в цикле: {e}")
-                    time.sleep(1)
-        
+            super().run()
         except KeyboardInterrupt:
             logger.info("\n❌ Агент 3 остановлен (Ctrl+C)")
         finally:
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📏 БЮДЖЕТ ТОКЕНОВ НА ТЕКСТ СООБЩЕНИЯ
+✅ Сжатие без потери смысла: растянутые символы ("!!!!!!" -> "!!!"), потоки эмодзи, лишние пробелы
+✅ Бюджет на агента (TOKEN_BUDGETS, по имени шаблона промпта): текст сверх бюджета режется на куски с перекрытием,
+   куски анализируются параллельно, итог - вердикт самого серьёзного куска (analyze_chunked);
+   не разобранные куски снижают уверенность итога (вердикт partial)
+✅ Страховка в компиляторе промптов: текст сверх бюджета обрезается (начало + конец) - fit()
+✅ Сэкономленные токены - в отчёте шаблона промпта (prompt_compiler.report_line)
+"""
+
+import asyncio
+import re
+from typing import Dict, Any, List, Callable, Awaitable
+
+from config import TOKEN_BUDGETS, TOKEN_BUDGET_OVERLAP, TOKEN_BUDGET_CONCURRENCY, setup_logging
+from llm_client import CHARS_PER_TOKEN, estimate_tokens
+
+logger = setup_logging("TOKEN BUDGET")
+
+_STRETCH_RE = re.compile(r"(.)\1{3,}", re.DOTALL)
+_EMOJI = "\U0001F000-\U0001FAFF☀-➿⬀-⯿"
+_EMOJI_FLOOD_RE = re.compile(f"((?:[{_EMOJI}][️‍]*\\s*){{3}})(?:[{_EMOJI}][️‍]*\\s*)+")
+_SPACES_RE = re.compile(r"[ \t ]+")
+_NEWLINES_RE = re.compile(r"\s*\n\s*")
+
+# Обрезка сверх бюджета: какая доля бюджета достаётся началу текста (остальное - концу, там часто ссылка)
+HEAD_SHARE = 0.7
+
+# {имя бюджета: {"messages", "saved_tokens", "chunked", "truncated"}}
+stats: Dict[str, Dict[str, int]] = {}
+
+# ============================================================================
+# СЖАТИЕ
+# ============================================================================
+
+
+def compact(text: str) -> str:
+    """Больше трёх одинаковых символов подряд -> три, поток эмодзи -> три, пробелы и пустые строки -> один"""
+    text = _STRETCH_RE.sub(r"\1\1\1", text or "")
+    text = _EMOJI_FLOOD_RE.sub(r"\1", text)
+    text = _SPACES_RE.sub(" ", text)
+    return _NEWLINES_RE.sub("\n", text).strip()
+
+
+def budget_for(name: str):
+    """Бюджет токенов на текст сообщения; None - без ограничения (только сжатие)"""
+    return TOKEN_BUDGETS.get(name)
+
+
+def _count(name: str, field: str, value: int):
+    bucket = stats.setdefault(name, {"messages": 0, "saved_tokens": 0, "chunked": 0, "truncated": 0})
+    bucket[field] += value
+
+# ============================================================================
+# КУСКИ
+# ============================================================================
+
+
+def _cut(text: str, end: int, low: int) -> int:
+    """Конец куска - по последнему пробелу в хвосте окна, чтобы не резать слово"""
+    if end >= len(text):
+        return len(text)
+    space = text.rfind(" ", low, end)
+    return space if space > low else end
+
+
+def split(text: str, budget: int, overlap: int = TOKEN_BUDGET_OVERLAP) -> List[str]:
+    """Куски не длиннее budget токенов, соседние перекрываются на overlap (нарушение на стыке не потеряется)"""
+    size = budget * CHARS_PER_TOKEN
+    if len(text) <= size:
+        return [text]
+    step_back = min(overlap * CHARS_PER_TOKEN, size // 2)
+
+    chunks, start = [], 0
+    while start < len(text):
+        end = _cut(text, start + size, start + size * 4 // 5)
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        # Перекрытие тоже с начала слова
+        start = text.find(" ", end - step_back, end) + 1 or end - step_back
+    return chunks
+
+
+def fit(name: str, text: str) -> str:
+    """Сжатие и, если текст всё ещё больше бюджета, обрезка: начало и конец текста"""
+    _count(name, "messages", 1)
+    compacted = compact(text)
+    budget = budget_for(name)
+    if budget and estimate_tokens(compacted) > budget:
+        size = budget * CHARS_PER_TOKEN
+        head = int(size * HEAD_SHARE)
+        compacted = f"{compacted[:head]} … {compacted[-(size - head):]}"
+        _count(name, "truncated", 1)
+    _count(name, "saved_tokens", max(0, estimate_tokens(text) - estimate_tokens(compacted)))
+    return compacted
+
+
+async def analyze_chunked(name: str, text: str, analyze: Callable[[str], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    analyze(текст) для текста в бюджете агента; длинный текст - по кускам параллельно.
+    Итог - вердикт куска с наибольшей severity (при равенстве - с большей уверенностью).
+    Кусок с ошибкой или нулевой уверенностью не разобран: уверенность итога умножается на долю разобранных
+    кусков, вердикт помечается partial (чистый вердикт по части текста не выглядит уверенным)
+    """
+    compacted = compact(text)
+    budget = budget_for(name)
+    if not budget or estimate_tokens(compacted) <= budget:
+        # Исходный текст: сожмёт сам промпт (fit), а ключи кэша вердиктов останутся прежними
+        return await analyze(text)
+
+    chunks = split(compacted, budget)
+    logger.info(f"✂️ {name}: текст ~{estimate_tokens(compacted)} ток. больше бюджета {budget}, кусков: {len(chunks)}")
+    _count(name, "chunked", 1)
+
+    semaphore = asyncio.Semaphore(TOKEN_BUDGET_CONCURRENCY)
+
+    async def analyze_one(chunk: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await analyze(chunk)
+
+    results = await asyncio.gather(*[analyze_one(chunk) for chunk in chunks], return_exceptions=True)
+    verdicts = [result for result in results if isinstance(result, dict)]
+    analyzed = [result for result in verdicts if _number(result.get("confidence")) > 0]
+    if not verdicts:
+        raise next(result for result in results if isinstance(result, BaseException))
+
+    merged = dict(max(analyzed or verdicts, key=_severity_key))
+    if len(analyzed) < len(chunks):
+        logger.warning(f"⚠️ {name}: разобрано кусков {len(analyzed)} из {len(chunks)}, вердикт неполный")
+        merged["confidence"] = round(_number(merged.get("confidence")) * len(analyzed) / len(chunks), 2)
+        merged["partial"] = True
+    return merged
+
+
+def _severity_key(result: Dict[str, Any]):
+    return _number(result.get("severity")), _number(result.get("confidence"))
+
+
+def _number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def report(name: str) -> Dict[str, int]:
+    return stats.get(name, {"messages": 0, "saved_tokens": 0, "chunked": 0, "truncated": 0})
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📒 ИСТОРИЯ АВТОРОВ
+✅ Сколько сообщений автора в чате дошло до решения и сколько из них - нарушения
+✅ Пишет Агент 5 после каждого решения, читает Агент 1 при выборе маршрута
+✅ Redis: хэш history:{chat_id}:{user_id} (поля messages, violations), живёт USER_HISTORY_TTL
+"""
+
+from typing import Dict
+
+from config import USER_HISTORY_TTL
+
+# Для режима memory (без Redis): {ключ: {"messages": n, "violations": n}}
+_local_history: Dict[str, Dict[str, int]] = {}
+
+
+def history_key(chat_id, user_id) -> str:
+    return f"history:{chat_id}:{user_id}"
+
+
+class UserHistory:
+    """redis_client со строками; None - история в памяти процесса"""
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    async def get(self, chat_id, user_id) -> Dict[str, int]:
+        if chat_id is None or user_id is None:
+            return {"messages": 0, "violations": 0}
+
+        key = history_key(chat_id, user_id)
+        if self.redis_client is None:
+            stored = _local_history.get(key, {})
+        else:
+            stored = await self.redis_client.hgetall(key)
+        return {
+            "messages": int(stored.get("messages", 0)),
+            "violations": int(stored.get("violations", 0)),
+        }
+
+    async def record(self, chat_id, user_id, violation: bool):
+        if chat_id is None or user_id is None:
+            return
+
+        key = history_key(chat_id, user_id)
+        if self.redis_client is None:
+            stored = _local_history.setdefault(key, {"messages": 0, "violations": 0})
+            stored["messages"] += 1
+            stored["violations"] += int(violation)
+            return
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hincrby(key, "messages", 1)
+        if violation:
+            pipe.hincrby(key, "violations", 1)
+        pipe.expire(key, USER_HISTORY_TTL)
+        await pipe.execute()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+💾 КЭШ ВЕРДИКТОВ LLM
+✅ Ключ: нормализованный текст + правила (контекст запроса) + версия модели/промпта
+✅ LRU в памяти процесса перед Redis (SETEX с VERDICT_CACHE_TTL)
+✅ Каждый агент проверяет кэш до вызова своего провайдера
+✅ Счётчики попаданий, промахов и сэкономленного времени - в Redis (verdict_cache:stats), видны в «📊 Статус»
+"""
+
+import copy
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+from config import (
+    VERDICT_CACHE_ENABLED,
+    VERDICT_CACHE_TTL,
+    VERDICT_CACHE_SIZE,
+    VERDICT_CACHE_STATS_INTERVAL,
+)
+
+STATS_KEY = "verdict_cache:stats"
+STATS_FIELDS = ("hits", "misses", "saved_ms")
+
+_SPACES_RE = re.compile(r"\s+")
+
+# ============================================================================
+# КЛЮЧИ
+# ============================================================================
+
+
+def normalize_text(text: str) -> str:
+    """Регистр, юникодные варианты символов и пробелы не меняют вердикт"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def fingerprint(*parts) -> str:
+    """Короткий хэш любых JSON-совместимых значений (правила, промпт, параметры модели)"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def cache_key(namespace: str, version: str, message: str, context=None) -> str:
+    return f"verdict:{namespace}:{version}:{fingerprint(normalize_text(message), context)}"
+
+# ============================================================================
+# КЭШ
+# ============================================================================
+
+
+class VerdictCache:
+    """
+    Двухуровневый кэш: OrderedDict (LRU, TTL) в процессе и строка JSON в Redis.
+    Без Redis (режим memory) работает только память процесса
+    """
+
+    def __init__(self, size: int = VERDICT_CACHE_SIZE, ttl: int = VERDICT_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.redis_client = None
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self._unflushed: Dict[str, Dict[str, float]] = {}
+        self._miss_time: Dict[str, float] = {}
+        self._flushed = time.monotonic()
+
+    def bind(self, redis_client):
+        """Вызывается рантаймом агента: клиент Redis со строками (decode_responses=True)"""
+        self.redis_client = redis_client
+
+    # ------------------------------------------------------------------------
+    # Хранение
+    # ------------------------------------------------------------------------
+
+    def _remember(self, key: str, verdict: Dict[str, Any]):
+        self._local.pop(key, None)
+        self._local[key] = (time.monotonic() + self.ttl, verdict)
+        while len(self._local) > self.size:
+            self._local.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._local.get(key)
+        if entry is not None:
+            expires, verdict = entry
+            if expires > time.monotonic():
+                self._local.move_to_end(key)
+                return verdict
+            del self._local[key]
+
+        if self.redis_client is None:
+            return None
+        try:
+            raw = await self.redis_client.get(key)
+        except Exception:
+            # Кэш не должен ронять модерацию
+            return None
+        if raw is None:
+            return None
+        verdict = json.loads(raw)
+        self._remember(key, verdict)
+        return verdict
+
+    async def set(self, key: str, verdict: Dict[str, Any]):
+        self._remember(key, verdict)
+        if self.redis_client is None:
+            return
+        try:
+            await self.redis_client.set(key, json.dumps(verdict, ensure_ascii=False), ex=self.ttl)
+        except Exception:
+            pass
+
+    # ------------------------------------------------------------------------
+    # Вызов провайдера через кэш
+    # ------------------------------------------------------------------------
+
+    async def cached(self, namespace: str, version: str, message: str, context,
+                     call: Callable[[], Awaitable[Dict[str, Any]]],
+                     cacheable: Callable[[Dict[str, Any]], bool] = None) -> Dict[str, Any]:
+        """
+        Возвращает вердикт из кэша или вызывает call().
+        Исключения call() не кэшируются; cacheable() отсекает ошибки и fallback-ответы
+        """
+        if not VERDICT_CACHE_ENABLED:
+            return await call()
+
+        key = cache_key(namespace, version, message, context)
+        verdict = await self.get(key)
+        if verdict is not None:
+            self.count(namespace, "hits", 1)
+            # Сэкономлено столько, сколько в среднем длится вызов провайдера
+            misses = self.stats[namespace]["misses"]
+            if misses:
+                self.count(namespace, "saved_ms", self._miss_time[namespace] / misses)
+            await self.maybe_flush()
+            return copy.deepcopy(verdict)
+
+        started = time.perf_counter()
+        verdict = await call()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.count(namespace, "misses", 1)
+        self._miss_time[namespace] = self._miss_time.get(namespace, 0) + elapsed_ms
+
+        if cacheable is None or cacheable(verdict):
+            await self.set(key, copy.deepcopy(verdict))
+        await self.maybe_flush()
+        return verdict
+
+    # ------------------------------------------------------------------------
+    # Счётчики
+    # ------------------------------------------------------------------------
+
+    def count(self, namespace: str, field: str, value: float):
+        for counters in (self.stats, self._unflushed):
+            bucket = counters.setdefault(namespace, dict.fromkeys(STATS_FIELDS, 0))
+            bucket[field] += value
+
+    async def maybe_flush(self):
+        if time.monotonic() - self._flushed >= VERDICT_CACHE_STATS_INTERVAL:
+            await self.flush_stats()
+
+    async def flush_stats(self):
+        """Прибавляет накопленные счётчики к общим в Redis (HINCRBY по namespace:поле)"""
+        self._flushed = time.monotonic()
+        if self.redis_client is None or not self._unflushed:
+            return
+        unflushed, self._unflushed = self._unflushed, {}
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for namespace, bucket in unflushed.items():
+                for field, value in bucket.items():
+                    if value:
+                        pipe.hincrby(STATS_KEY, f"{namespace}:{field}", int(value))
+            await pipe.execute()
+        except Exception:
+            pass
+
+
+verdict_cache = VerdictCache()
+
+
+async def read_stats(redis_client) -> Dict[str, Dict[str, int]]:
+    """Счётчики по агентам: {namespace: {hits, misses, saved_ms}}. Без Redis - счётчики этого процесса"""
+    if redis_client is None:
+        return {namespace: {field: int(value) for field, value in bucket.items()}
+                for namespace, bucket in verdict_cache.stats.items()}
+
+    stats: Dict[str, Dict[str, int]] = {}
+    for name, value in (await redis_client.hgetall(STATS_KEY)).items():
+        namespace, _, field = name.rpartition(":")
+        stats.setdefault(namespace, dict.fromkeys(STATS_FIELDS, 0))[field] = int(value)
+    return stats
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🧾 РАЗБОР ОТВЕТОВ МОДЕЛЕЙ
+✅ Один разбор JSON на все агенты: сразу json.loads (JSON-режим провайдера), иначе - один проход
+   raw_decode с первой { или [ (вступление и хвост после JSON не мешают)
+✅ Приведение типов: уверенность (доля 0-1 или проценты, по шкале промпта) -> 0-100, severity 0-10, "true"/"да" -> bool, известное действие
+✅ Verdict - компактный типизированный вердикт модерации (агенты 2, 3, 4)
+✅ Счётчики разбора по провайдеру и модели: метрика parse:{provider}/{model} в «📊 Статус»
+   (разобрано / ответ пришлось выбросить)
+"""
+
+import json
+from typing import Dict, Any, List, NamedTuple
+
+from config import LLM_PROVIDERS
+from metrics import metrics
+
+ACTIONS = ("ban", "mute", "warn", "none")
+
+_TRUE = {"true", "yes", "да", "1"}
+
+# strict=False: модели пишут переводы строк прямо внутри строк
+_decoder = json.JSONDecoder(strict=False)
+
+
+class ParseError(ValueError):
+    """В ответе нет JSON нужного вида"""
+
+# ============================================================================
+# JSON
+# ============================================================================
+
+
+def extract_json(content: str, opener: str = "{"):
+    """Первое JSON-значение, начинающееся с opener ({ - объект, [ - массив)"""
+    content = (content or "").strip()
+    if content.startswith(opener):
+        try:
+            return json.loads(content)
+        except ValueError:
+            pass
+    start = content.find(opener)
+    if start < 0:
+        raise ParseError(f"в ответе нет JSON ({opener})")
+    try:
+        value, _ = _decoder.raw_decode(content, start)
+    except ValueError as e:
+        raise ParseError(f"битый JSON: {e}")
+    return value
+
+
+def extract_object(content: str) -> Dict[str, Any]:
+    value = extract_json(content, "{")
+    if not isinstance(value, dict):
+        raise ParseError("JSON не является объектом")
+    return value
+
+
+def extract_array(content: str) -> List[Any]:
+    value = extract_json(content, "[")
+    if not isinstance(value, list):
+        raise ParseError("JSON не является массивом")
+    return value
+
+# ============================================================================
+# ПРИВЕДЕНИЕ ТИПОВ
+# ============================================================================
+
+
+def to_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in _TRUE
+    return bool(value)
+
+
+def to_int(value, default: int, low: int, high: int) -> int:
+    try:
+        value = int(round(float(str(value).strip().rstrip("%"))))
+    except (TypeError, ValueError):
+        value = default
+    return max(low, min(high, value))
+
+
+def confidence_percent(value, default: float = 0, fraction: bool = False) -> float:
+    """
+    Уверенность на шкале 0-100. fraction=True - промпт просит долю 0-1 (1 - это 100%, больше 1 - уже проценты).
+    Иначе промпт просит проценты: долей считается только нецелое число меньше 1 (0.85 -> 85, а "1" - это 1%)
+    """
+    try:
+        value = float(str(value).strip().rstrip("%"))
+    except (TypeError, ValueError):
+        return default
+    if fraction:
+        value = value * 100 if value <= 1 else value
+    elif 0 < value < 1:
+        value = value * 100
+    return max(0.0, min(100.0, value))
+
+
+def normalize_action(value, is_violation: bool) -> str:
+    action = str(value or "").strip().lower()
+    if action in ACTIONS:
+        return action
+    return "warn" if is_violation else "none"
+
+# ============================================================================
+# ВЕРДИКТ МОДЕРАЦИИ
+# ============================================================================
+
+
+class Verdict(NamedTuple):
+    is_violation: bool
+    type: str
+    severity: int
+    confidence: int
+    action: str
+    reason: str
+    explanation: str
+
+    def as_dict(self) -> Dict[str, Any]:
+        return self._asdict()
+
+
+def to_verdict(data: Dict[str, Any], default_severity: int = 0, default_confidence: int = 0,
+               fraction: bool = False) -> Verdict:
+    """
+    Словарь от модели (в т.ч. неполный - из потока) -> Verdict; reasoning принимается как reason.
+    fraction - уверенность в промпте запрошена долей 0-1 (см. confidence_percent)
+    """
+    is_violation = to_bool(data.get("is_violation", False))
+    return Verdict(
+        is_violation=is_violation,
+        type=str(data.get("type") or "unknown"),
+        severity=to_int(data.get("severity"), default_severity, 0, 10),
+        confidence=int(round(confidence_percent(data.get("confidence"), default_confidence, fraction))),
+        action=normalize_action(data.get("action"), is_violation),
+        reason=str(data.get("reason") or data.get("reasoning") or ""),
+        explanation=str(data.get("explanation") or ""),
+    )
+
+
+def parse_verdict(content: str, **defaults) -> Verdict:
+    return to_verdict(extract_object(content), **defaults)
+
+# ============================================================================
+# СЧЁТЧИКИ
+# ============================================================================
+
+
+def record_parse(provider: str, model: str, ok: bool):
+    metrics.count(f"parse:{provider}/{model}", "parsed" if ok else "rejected")
+
+
+def parse_counted(provider: str, model: str, parse, content: str, **kwargs):
+    """parse(content) с учётом результата в счётчиках провайдера/модели"""
+    try:
+        result = parse(content, **kwargs)
+    except (ValueError, KeyError, TypeError):
+        record_parse(provider, model, False)
+        raise
+    record_parse(provider, model, True)
+    return result
+
+
+def json_mode_params(provider: str) -> Dict[str, Any]:
+    """response_format для JSON-режима, если провайдер его поддерживает (LLM_PROVIDERS[...]["json_mode"])"""
+    if LLM_PROVIDERS.get(provider, {}).get("json_mode"):
+        return {"response_format": {"type": "json_object"}}
+    return {}